@@ -1,9 +1,32 @@
-from fastapi import FastAPI
-from fastapi.staticfiles import StaticFiles  # 导入StaticFiles
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Depends
+from fastapi.responses import PlainTextResponse, JSONResponse
 from app.api.router import api_router
 from app.core.config import settings
+from app.core.static_files import ArtifactStaticFiles
+from app.core.auth import verify_api_key
+from app.services.metrics import registry
+from app.services.asr_service import asr_service
+from app.services.task_store import task_store
+from app.services.downloader import downloader
+from app.services.backend import backend
+from app.services.video_processor import video_processor
 import os
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    应用生命周期：启动时只创建后台任务，任务记录和缓存索引在后台预热，不阻塞服务开始监听；
+    退出时停止后台任务，关闭共享的连接池，提交尚未写入的任务记录，并注销工作进程
+    """
+    video_processor.start()
+    yield
+    await video_processor.stop()
+    await asr_service.close()
+    await downloader.close()
+    task_store.close()
+    backend.close()
+
 def create_app() -> FastAPI:
     """
     创建FastAPI应用实例
@@ -11,7 +34,8 @@ def create_app() -> FastAPI:
     app = FastAPI(
         title="视频处理API", 
         description="处理视频文件的REST API - 需要API Key认证",
-        version="0.1.0"
+        version="0.1.0",
+        lifespan=lifespan
     )
     
     # 注册路由
@@ -20,11 +44,28 @@ def create_app() -> FastAPI:
     # 确保临时目录存在
     os.makedirs(settings.TEMP_DIR, exist_ok=True)
     
-    # 挂载静态文件目录
-    app.mount("/files", StaticFiles(directory=settings.TEMP_DIR), name="files")
+    # 挂载静态文件目录，任务产物带长期缓存头，支持Range请求和预压缩文本
+    app.mount("/files", ArtifactStaticFiles(directory=settings.TEMP_DIR), name="files")
     
     @app.get("/")
     async def root():
         return {"message": "视频处理API服务正常运行 - 需要API Key认证"}
     
+    @app.get("/healthz")
+    async def healthz():
+        """存活检查：进程能处理请求即返回200"""
+        return {"status": "ok"}
+    
+    @app.get("/readyz")
+    async def readyz():
+        """就绪检查：启动预热完成前返回503，负载均衡在此之前不应转发任务"""
+        if not video_processor.ready:
+            return JSONResponse({"status": "starting"}, status_code=503)
+        return {"status": "ready", "backend": backend.mode}
+    
+    @app.get("/metrics")
+    async def metrics(api_key: str = Depends(verify_api_key)):
+        """Prometheus格式的运行指标"""
+        return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
+    
     return app
\ No newline at end of file
@@ -1,17 +1,58 @@
-from fastapi import APIRouter, HTTPException, Depends
-from fastapi.responses import JSONResponse
-from pydantic import BaseModel, HttpUrl
-from typing import Optional
+import os
+import json
+import asyncio
+import hashlib
+import ffmpeg
+from fastapi import APIRouter, HTTPException, Depends, Request, Query
+from fastapi.responses import JSONResponse, StreamingResponse
+from pydantic import BaseModel, HttpUrl, Field
+from typing import Optional, Literal, List
 from app.services.video_processor import video_processor
+from app.services.scheduler import scheduler, QueueFullError
+from app.services.backend import backend
+from app.services.artifacts import bundle_files, iter_tar, iter_zip
 from app.core.auth import verify_api_key
+from app.core.config import settings
 
 router = APIRouter()
 
+# SSE心跳间隔(秒)，防止代理和负载均衡因连接空闲而断开
+SSE_HEARTBEAT_SECONDS = 15
+
+class FrameOutput(BaseModel):
+    # 帧的最大边长(像素)，超出时按比例缩小，不放大
+    max_dimension: Optional[int] = Field(None, ge=16, le=8192)
+    # 输出格式
+    format: Optional[Literal["jpg", "webp"]] = None
+    # 编码质量(1-100)
+    quality: Optional[int] = Field(None, ge=1, le=100)
+    # 额外生成拼图时每行的帧数，不设置则不生成拼图
+    contact_sheet_columns: Optional[int] = Field(None, ge=1, le=16)
+
 class VideoRequest(BaseModel):
     url: HttpUrl
     start_seconds: Optional[int] = None
     interval_seconds: Optional[int] = None
     max_frames: Optional[int] = 8
+    # 调度优先级，数值越大越先执行
+    priority: Optional[int] = 0
+    # 帧提取模式，keyframe 从关键帧中按场景变化挑选互不相似的帧，默认使用服务端配置
+    frame_mode: Optional[Literal["seek", "select", "per_frame", "keyframe"]] = None
+    # 帧输出参数，缺省项使用服务端配置
+    frame_output: Optional[FrameOutput] = None
+
+class BatchRequest(BaseModel):
+    items: List[VideoRequest] = Field(..., min_length=1, max_length=settings.BATCH_MAX_ITEMS)
+
+class MetadataRequest(BaseModel):
+    url: HttpUrl
+
+def _client_id(api_key):
+    """由API Key派生提交方标识，避免在任务记录中保存明文Key"""
+    return hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:12]
+
+def _queue_full(e):
+    return HTTPException(status_code=429, detail=str(e), headers={"Retry-After": "30"})
 
 @router.post("/process-video")
 async def process_video(
@@ -23,8 +64,173 @@ async def process_video(
             str(request.url),
             start_seconds=request.start_seconds,
             interval_seconds=request.interval_seconds,
-            max_frames=request.max_frames
+            max_frames=request.max_frames,
+            priority=request.priority,
+            client_id=_client_id(api_key),
+            frame_mode=request.frame_mode,
+            frame_output=request.frame_output.model_dump() if request.frame_output else None
         )
         return JSONResponse(content=result)
+    except QueueFullError as e:
+        raise _queue_full(e)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.post("/process-videos")
+async def process_videos(
+    request: BatchRequest,
+    api_key: str = Depends(verify_api_key)
+):
+    """批量处理视频，以NDJSON逐行返回每条的结果(按完成顺序)，最后一行为汇总"""
+    items = [
+        {
+            "url": str(item.url),
+            "start_seconds": item.start_seconds,
+            "interval_seconds": item.interval_seconds,
+            "max_frames": item.max_frames,
+            "priority": item.priority,
+            "frame_mode": item.frame_mode,
+            "frame_output": item.frame_output.model_dump() if item.frame_output else None
+        }
+        for item in request.items
+    ]
+
+    async def result_stream():
+        started = asyncio.get_running_loop().time()
+        completed = 0
+        async for index, task_id, result in video_processor.process_batch(items, client_id=_client_id(api_key)):
+            line = {"index": index, "url": items[index]["url"], "task_id": task_id}
+            if "error" in result:
+                line.update(status="failed", error=result["error"])
+            else:
+                completed += 1
+                line.update(status="completed", result=result)
+            yield json.dumps(line, ensure_ascii=False) + "\n"
+        summary = {
+            "total": len(items),
+            "completed": completed,
+            "failed": len(items) - completed,
+            "duration_seconds": round(asyncio.get_running_loop().time() - started, 3)
+        }
+        yield json.dumps({"summary": summary}, ensure_ascii=False) + "\n"
+
+    return StreamingResponse(
+        result_stream(),
+        media_type="application/x-ndjson",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@router.post("/metadata")
+async def get_metadata(
+    request: MetadataRequest,
+    api_key: str = Depends(verify_api_key)
+):
+    """只读取远程视频的容器头部，返回时长、码率和各路流的编码信息，不下载视频"""
+    try:
+        return await video_processor.get_metadata(str(request.url))
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=504, detail="探测视频超时")
+    except ffmpeg.Error as e:
+        detail = e.stderr.decode("utf-8", errors="ignore").strip().splitlines()[-1:] if e.stderr else []
+        raise HTTPException(status_code=422, detail=f"无法探测视频: {' '.join(detail)}")
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.post("/tasks", status_code=202)
+async def submit_task(
+    request: VideoRequest,
+    api_key: str = Depends(verify_api_key)
+):
+    """提交处理任务，立即返回任务ID，通过状态接口或事件流获取进度和结果"""
+    try:
+        task_id = await video_processor.submit_video(
+            str(request.url),
+            start_seconds=request.start_seconds,
+            interval_seconds=request.interval_seconds,
+            max_frames=request.max_frames,
+            priority=request.priority,
+            client_id=_client_id(api_key),
+            frame_mode=request.frame_mode,
+            frame_output=request.frame_output.model_dump() if request.frame_output else None
+        )
+        return await video_processor.get_task_status(task_id)
+    except QueueFullError as e:
+        raise _queue_full(e)
     except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.get("/queue")
+async def get_queue_stats(
+    api_key: str = Depends(verify_api_key)
+):
+    """查询调度队列深度、执行中任务数、等待时间统计、请求合并命中率和部署后端状态"""
+    return dict(scheduler.stats(), coalescing=video_processor.coalescing_stats(), backend=backend.stats())
+
+@router.get("/tasks/{task_id}")
+async def get_task(
+    task_id: str,
+    api_key: str = Depends(verify_api_key)
+):
+    """查询任务状态"""
+    status = await video_processor.get_task_status(task_id)
+    if status["status"] == "not_found":
+        raise HTTPException(status_code=404, detail=status["message"])
+    return status
+
+@router.get("/tasks/{task_id}/events")
+async def stream_task_events(
+    task_id: str,
+    request: Request,
+    api_key: str = Depends(verify_api_key)
+):
+    """以Server-Sent Events推送任务状态变化，任务结束后关闭连接"""
+    if (await video_processor.get_task_status(task_id))["status"] == "not_found":
+        raise HTTPException(status_code=404, detail="任务不存在")
+
+    async def event_stream():
+        last_payload = None
+        while True:
+            # 先登记等待再读取状态，推送期间发生的变化不会被错过
+            changed = video_processor.watch(task_id)
+            status = await video_processor.get_task_status(task_id)
+            payload = json.dumps(status, ensure_ascii=False)
+            if payload != last_payload:
+                yield f"event: status\ndata: {payload}\n\n"
+                last_payload = payload
+            if status["status"] in ["completed", "failed", "not_found"]:
+                return
+            if await request.is_disconnected():
+                return
+            if not await video_processor.wait_for_update(
+                    task_id, timeout=SSE_HEARTBEAT_SECONDS, event=changed, since=status):
+                yield ": keep-alive\n\n"
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@router.get("/tasks/{task_id}/bundle")
+async def download_task_bundle(
+    task_id: str,
+    archive_format: Literal["zip", "tar"] = Query("zip", alias="format"),
+    api_key: str = Depends(verify_api_key)
+):
+    """将任务的所有帧和转录文本打包为一个zip/tar流返回，一次请求取回全部结果"""
+    status = await video_processor.get_task_status(task_id)
+    if status["status"] == "not_found":
+        raise HTTPException(status_code=404, detail=status["message"])
+    if status["status"] != "completed":
+        raise HTTPException(status_code=409, detail="任务尚未完成")
+
+    files = bundle_files(os.path.join(settings.TEMP_DIR, task_id))
+    if archive_format == "zip":
+        content, media_type = iter_zip(files), "application/zip"
+    else:
+        content, media_type = iter_tar(files), "application/x-tar"
+    return StreamingResponse(
+        content,
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{task_id}.{archive_format}"'}
+    )
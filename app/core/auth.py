@@ -14,7 +14,8 @@ def verify_api_key(credentials: HTTPAuthorizationCredentials = Security(security
             detail="API Key未配置"
         )
     
-    if credentials.credentials != settings.API_KEY:
+    api_keys = [key.strip() for key in settings.API_KEY.split(",") if key.strip()]
+    if credentials.credentials not in api_keys:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="无效的API Key",
@@ -5,27 +5,121 @@ import os
 class Settings(BaseSettings):
     # 并行处理限制
     MAX_CONCURRENT_TASKS: int = int(os.getenv("MAX_CONCURRENT_TASKS", "3"))
+    # 等待队列上限，队列满时新任务返回429
+    MAX_QUEUED_TASKS: int = int(os.getenv("MAX_QUEUED_TASKS", "100"))
+    # 无法获取视频时长时，按该码率(kbps)根据文件大小估算时长作为调度成本
+    SCHEDULER_ASSUMED_BITRATE_KBPS: int = int(os.getenv("SCHEDULER_ASSUMED_BITRATE_KBPS", "2000"))
+    # 任务等待该秒数后调度时的有效成本降为一半(随等待继续下降)，防止长任务被短任务饿死
+    SCHEDULER_AGING_SECONDS: int = int(os.getenv("SCHEDULER_AGING_SECONDS", "60"))
+    # 批量接口：单次请求的最大条目数，以及单个批量请求同时提交到调度队列的任务数
+    BATCH_MAX_ITEMS: int = int(os.getenv("BATCH_MAX_ITEMS", "1000"))
+    BATCH_CONCURRENCY: int = int(os.getenv("BATCH_CONCURRENCY", "16"))
+    # 部署后端: local(单进程) / sqlite(单机多工作进程，共享TEMP_DIR) / redis(多机，共享Redis和TEMP_DIR存储)
+    SHARED_BACKEND: str = os.getenv("SHARED_BACKEND", "local")
+    # Redis连接地址和键前缀，memory:// 使用进程内替身(仅用于测试)
+    REDIS_URL: str = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+    REDIS_PREFIX: str = os.getenv("REDIS_PREFIX", "process_video:")
+    # 共享后端下工作进程的心跳间隔和超时(秒)，超时的工作进程领取的任务标记为失败，清理主进程租约也按该时长过期
+    WORKER_HEARTBEAT_SECONDS: int = int(os.getenv("WORKER_HEARTBEAT_SECONDS", "5"))
+    WORKER_TIMEOUT_SECONDS: int = int(os.getenv("WORKER_TIMEOUT_SECONDS", "30"))
+    # 共享后端下领取队列任务和查询其他进程中任务状态的轮询间隔(毫秒)
+    SHARED_POLL_MS: int = int(os.getenv("SHARED_POLL_MS", "500"))
     # 临时文件存储路径
     TEMP_DIR: str = os.getenv("TEMP_DIR", "")
+    # 任务记录批量写入间隔(毫秒)，间隔内同一任务的多次更新合并为一次写入
+    TASK_STORE_FLUSH_MS: int = int(os.getenv("TASK_STORE_FLUSH_MS", "200"))
     # 下载超时设置(秒)
     DOWNLOAD_TIMEOUT: int = int(os.getenv("DOWNLOAD_TIMEOUT", "300"))
+    # 分段下载配置：源站支持Range时的并发分段数、每段最小大小(MB)和下载连接池大小
+    DOWNLOAD_SEGMENTS: int = int(os.getenv("DOWNLOAD_SEGMENTS", "4"))
+    DOWNLOAD_MIN_SEGMENT_MB: int = int(os.getenv("DOWNLOAD_MIN_SEGMENT_MB", "8"))
+    DOWNLOAD_MAX_CONNECTIONS: int = int(os.getenv("DOWNLOAD_MAX_CONNECTIONS", "32"))
+    # 提交任务时先直接探测远程视频(只读取容器头部)，用真实时长规划帧参数和调度成本
+    PROBE_BEFORE_SCHEDULE: bool = os.getenv("PROBE_BEFORE_SCHEDULE", "true").lower() == "true"
+    # 探测远程视频的超时时间(秒)
+    PROBE_TIMEOUT: int = int(os.getenv("PROBE_TIMEOUT", "15"))
+    # 同时探测远程视频的ffprobe进程数，与任务的ffmpeg进程槽位分开，任务繁忙时提交和元数据查询不必排队
+    REMOTE_PROBE_CONCURRENCY: int = int(os.getenv("REMOTE_PROBE_CONCURRENCY", "4"))
     # 处理超时设置(秒)
     PROCESSING_TIMEOUT: int = int(os.getenv("PROCESSING_TIMEOUT", "600"))
     # 临时文件保留时间(分钟)
     TEMP_FILE_RETENTION_MINUTES: int = int(os.getenv("TEMP_FILE_RETENTION_MINUTES", "10"))
     # 清理任务执行间隔(分钟)
     CLEANUP_INTERVAL_MINUTES: int = int(os.getenv("CLEANUP_INTERVAL_MINUTES", "10"))
+    # 任务文件总大小上限(MB)，超出时从最久未使用的已结束任务开始删除，0表示不限制
+    TEMP_DIR_MAX_MB: int = int(os.getenv("TEMP_DIR_MAX_MB", "0"))
     # 重试设置
     MAX_RETRIES: int = int(os.getenv("MAX_RETRIES", "3"))
     RETRY_DELAY: int = int(os.getenv("RETRY_DELAY", "2"))
 
-    # API认证配置
+    # API认证配置，多个API Key用逗号分隔，调度时按API Key公平分配
     API_KEY: str = os.getenv("API_KEY", "")
 
     # ASR服务配置
     ASR_API_BASE_URL: str = os.getenv("ASR_API_BASE_URL", "")
     ASR_API_KEY: str = os.getenv("ASR_API_KEY", "")
     ASR_MODEL: str = os.getenv("ASR_MODEL", "")
+    # ASR客户端模式: async(连接池异步请求) / sync(openai同步客户端，在线程池中执行)
+    ASR_CLIENT_MODE: str = os.getenv("ASR_CLIENT_MODE", "async")
+    # 异步客户端的最大连接数、空闲连接保持时间(秒)、单次请求超时(秒)和最大尝试次数
+    ASR_MAX_CONNECTIONS: int = int(os.getenv("ASR_MAX_CONNECTIONS", "16"))
+    ASR_KEEPALIVE_SECONDS: int = int(os.getenv("ASR_KEEPALIVE_SECONDS", "60"))
+    ASR_TIMEOUT: int = int(os.getenv("ASR_TIMEOUT", "600"))
+    ASR_MAX_RETRIES: int = int(os.getenv("ASR_MAX_RETRIES", "3"))
+    # 分段识别配置：音频超过分段时长的1.5倍时在静音处切分后并发识别，0表示不分段
+    ASR_CHUNK_SECONDS: int = int(os.getenv("ASR_CHUNK_SECONDS", "0"))
+    ASR_CHUNK_CONCURRENCY: int = int(os.getenv("ASR_CHUNK_CONCURRENCY", "4"))
+    # 找不到静音点硬切时相邻分段的重叠时长(秒)
+    ASR_CHUNK_OVERLAP_SECONDS: int = int(os.getenv("ASR_CHUNK_OVERLAP_SECONDS", "2"))
+    # 静音检测阈值(dB)和最短静音时长(秒)
+    ASR_SILENCE_NOISE_DB: int = int(os.getenv("ASR_SILENCE_NOISE_DB", "-30"))
+    ASR_SILENCE_MIN_SECONDS: float = float(os.getenv("ASR_SILENCE_MIN_SECONDS", "0.5"))
+    # 送入ASR的音频格式: mp3 / flac / wav(16位PCM) / opus(ogg封装)，均为16k采样率单声道
+    ASR_AUDIO_FORMAT: str = os.getenv("ASR_AUDIO_FORMAT", "mp3")
+    ASR_AUDIO_OPUS_KBPS: int = int(os.getenv("ASR_AUDIO_OPUS_KBPS", "24"))
+    # 源音频编码在该列表中(逗号分隔，如 aac,mp3,opus)时直接复制音轨，不解码也不重新编码；空表示总是转码
+    ASR_AUDIO_COPY_CODECS: str = os.getenv("ASR_AUDIO_COPY_CODECS", "")
+    # 是否裁掉长静音后再送入ASR(开启时不复制音轨)，转录时间戳按保留区间映射回原视频时间
+    ASR_TRIM_SILENCE: bool = os.getenv("ASR_TRIM_SILENCE", "false").lower() == "true"
+    # 超过该时长(秒)的静音才裁剪，静音阈值使用 ASR_SILENCE_NOISE_DB
+    ASR_TRIM_MIN_SILENCE_SECONDS: float = float(os.getenv("ASR_TRIM_MIN_SILENCE_SECONDS", "2.0"))
+    # 转录返回格式: verbose_json(带时间戳的分句，生成字幕和逐帧文本窗口) / json(只有文本)
+    ASR_RESPONSE_FORMAT: str = os.getenv("ASR_RESPONSE_FORMAT", "verbose_json")
+    # 每帧对齐的转录文本窗口(秒)，取帧时间点前后各一半范围内的分句，0表示不对齐
+    FRAME_TRANSCRIPT_WINDOW_SECONDS: int = int(os.getenv("FRAME_TRANSCRIPT_WINDOW_SECONDS", "30"))
+
+    # 结果缓存配置：相同URL(且源文件未变化)和相同帧参数的请求直接返回已有结果
+    RESULT_CACHE_ENABLED: bool = os.getenv("RESULT_CACHE_ENABLED", "true").lower() == "true"
+    RESULT_CACHE_MAX_ENTRIES: int = int(os.getenv("RESULT_CACHE_MAX_ENTRIES", "1000"))
+    RESULT_CACHE_MAX_MB: int = int(os.getenv("RESULT_CACHE_MAX_MB", "10240"))
+    # 转录缓存配置：按音频内容哈希和ASR模型缓存转录文本，只改变帧参数的请求不再重复调用ASR
+    TRANSCRIPT_CACHE_ENABLED: bool = os.getenv("TRANSCRIPT_CACHE_ENABLED", "true").lower() == "true"
+    TRANSCRIPT_CACHE_MAX_MB: int = int(os.getenv("TRANSCRIPT_CACHE_MAX_MB", "512"))
+    # 获取源文件校验信息(HEAD请求)的超时时间(秒)
+    SOURCE_HEAD_TIMEOUT: int = int(os.getenv("SOURCE_HEAD_TIMEOUT", "10"))
+
+    # ffmpeg资源配置：同时运行的ffmpeg/ffprobe进程数、每个ffmpeg进程的线程预算、CPU密集型Python工作的线程池大小
+    FFMPEG_MAX_PROCESSES: int = int(os.getenv("FFMPEG_MAX_PROCESSES", str(os.cpu_count() or 4)))
+    FFMPEG_THREADS_PER_JOB: int = int(os.getenv(
+        "FFMPEG_THREADS_PER_JOB",
+        str(max(1, (os.cpu_count() or 4) // int(os.getenv("MAX_CONCURRENT_TASKS", "3"))))
+    ))
+    CPU_WORKERS: int = int(os.getenv("CPU_WORKERS", str(os.cpu_count() or 4)))
+
+    # 视频获取模式: download(先完整下载到本地) / stream(直接将URL交给ffmpeg，边下载边处理)
+    INGEST_MODE: str = os.getenv("INGEST_MODE", "download")
+    # 是否在任务目录中保留源视频文件，stream模式下会在提取音频的同一次读取中顺带保存副本
+    KEEP_SOURCE_VIDEO: bool = os.getenv("KEEP_SOURCE_VIDEO", "true").lower() == "true"
+
+    # 视频帧提取模式: seek(单进程多输入快速定位) / select(单次解码select过滤) / per_frame(逐帧单独进程，用于对比)
+    #                 / keyframe(只解码关键帧，按场景变化挑选并去除近似重复的帧)
+    FRAME_EXTRACT_MODE: str = os.getenv("FRAME_EXTRACT_MODE", "seek")
+    # keyframe模式下两帧差异哈希的汉明距离不超过该值时视为重复帧(0-64)
+    FRAME_DEDUPE_DISTANCE: int = int(os.getenv("FRAME_DEDUPE_DISTANCE", "6"))
+    # 帧输出默认参数：最大边长(像素，0表示保持原分辨率)、格式(jpg/webp)、质量(1-100，0表示使用ffmpeg默认值)
+    FRAME_MAX_DIMENSION: int = int(os.getenv("FRAME_MAX_DIMENSION", "0"))
+    FRAME_FORMAT: str = os.getenv("FRAME_FORMAT", "jpg")
+    FRAME_QUALITY: int = int(os.getenv("FRAME_QUALITY", "0"))
 
     # 视频帧提取配置
     # FRAME_EXTRACT_START_MINUTES: int = int(os.getenv("FRAME_EXTRACT_START_MINUTES", "5"))  # 从第几分钟开始提取
@@ -0,0 +1,61 @@
+import os
+import mimetypes
+from pathlib import PurePath
+from starlette.datastructures import Headers
+from starlette.exceptions import HTTPException
+from starlette.responses import FileResponse
+from starlette.staticfiles import NotModifiedResponse, StaticFiles
+from app.services.task_store import task_store
+
+# 已完成任务的产物不再修改，允许客户端和CDN长期缓存
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+# 任务未完成时产物仍可能被写入或替换，每次使用前都需要重新验证
+REVALIDATE_CACHE_CONTROL = "no-cache"
+
+# 处理过程中会持续更新的文件，不能长期缓存
+MUTABLE_SUFFIXES = (".partial.txt", ".parts")
+
+class ArtifactStaticFiles(StaticFiles):
+    """
+    任务产物的静态文件服务
+
+    - 在ETag/Last-Modified和Range请求(由FileResponse提供)的基础上，为已完成任务的产物加上 immutable 缓存头，
+      任务未完成(或记录已不存在)时返回 no-cache
+    - 客户端接受gzip且存在预压缩文件(<文件名>.gz)时直接返回压缩版本
+    - 不对外提供以下划线开头的内部文件(任务数据库、缓存索引等)
+    """
+
+    async def get_response(self, path, scope):
+        if any(part.startswith("_") for part in PurePath(path).parts):
+            raise HTTPException(status_code=404)
+        # 产物位于 <任务ID>/ 目录下，任务完成后才允许长期缓存
+        parts = PurePath(path).parts
+        task_info = await task_store.aget(parts[0]) if parts else None
+        scope["artifact_completed"] = task_info is not None and task_info.get("status") == "completed"
+        return await super().get_response(path, scope)
+
+    def file_response(self, full_path, stat_result, scope, status_code=200):
+        request_headers = Headers(scope=scope)
+        immutable = scope.get("artifact_completed") and not str(full_path).endswith(MUTABLE_SUFFIXES)
+        headers = {"Cache-Control": IMMUTABLE_CACHE_CONTROL if immutable else REVALIDATE_CACHE_CONTROL}
+
+        # Range请求针对原始内容，只在整体请求时返回预压缩版本
+        gzip_path = f"{full_path}.gz"
+        if ("gzip" in request_headers.get("accept-encoding", "")
+                and "range" not in request_headers and os.path.isfile(gzip_path)):
+            response = FileResponse(
+                gzip_path,
+                status_code=status_code,
+                stat_result=os.stat(gzip_path),
+                media_type=mimetypes.guess_type(str(full_path))[0] or "text/plain",
+                headers=dict(headers, **{"Content-Encoding": "gzip", "Vary": "Accept-Encoding"})
+            )
+        else:
+            response = FileResponse(full_path, status_code=status_code, stat_result=stat_result, headers=headers)
+            if os.path.isfile(gzip_path):
+                response.headers["Vary"] = "Accept-Encoding"
+
+        if self.is_not_modified(response.headers, request_headers):
+            return NotModifiedResponse(response.headers)
+        return response
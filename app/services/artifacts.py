@@ -0,0 +1,99 @@
+import os
+import io
+import gzip
+import time
+import tarfile
+import zipfile
+import logging
+
+# 配置日志
+logger = logging.getLogger("artifacts")
+
+# 打包下载时每次读取的块大小
+_CHUNK_SIZE = 256 * 1024
+
+# 打包下载包含的文件：帧目录和转录文本，不包含源视频和音频
+BUNDLE_FILES = ("transcript.txt", "transcript.jsonl", "transcript.srt", "transcript.vtt")
+BUNDLE_DIRS = ("frames",)
+
+def write_precompressed(path):
+    """生成文件的gzip预压缩版本(<文件名>.gz)，静态文件服务对接受gzip的客户端直接返回"""
+    with open(path, 'rb') as f:
+        data = f.read()
+    compressed = gzip.compress(data, compresslevel=6, mtime=0)
+    # 很短的文本压缩后反而更大，此时不生成压缩版本
+    if len(compressed) < len(data):
+        with open(f"{path}.gz", 'wb') as f:
+            f.write(compressed)
+
+def bundle_files(task_dir):
+    """列出任务打包下载的文件，返回 [(包内路径, 文件路径)]"""
+    files = []
+    for name in BUNDLE_FILES:
+        path = os.path.join(task_dir, name)
+        if os.path.isfile(path):
+            files.append((name, path))
+    for dir_name in BUNDLE_DIRS:
+        dir_path = os.path.join(task_dir, dir_name)
+        if not os.path.isdir(dir_path):
+            continue
+        for name in sorted(os.listdir(dir_path)):
+            path = os.path.join(dir_path, name)
+            if os.path.isfile(path):
+                files.append((f"{dir_name}/{name}", path))
+    return files
+
+def _read_chunks(path):
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(_CHUNK_SIZE)
+            if not chunk:
+                return
+            yield chunk
+
+def iter_tar(files):
+    """边读边生成tar流，不在内存或磁盘上组装整个归档"""
+    for arcname, path in files:
+        info = tarfile.TarInfo(arcname)
+        info.size = os.path.getsize(path)
+        info.mtime = int(os.path.getmtime(path))
+        info.mode = 0o644
+        yield info.tobuf(format=tarfile.PAX_FORMAT)
+        for chunk in _read_chunks(path):
+            yield chunk
+        padding = -info.size % tarfile.BLOCKSIZE
+        if padding:
+            yield b"\0" * padding
+    # 归档结尾为两个全零块
+    yield b"\0" * (tarfile.BLOCKSIZE * 2)
+
+class _ZipStream(io.RawIOBase):
+    """zipfile写入的不可定位输出，写入的数据暂存后由生成器取走"""
+
+    def __init__(self):
+        self._buffer = bytearray()
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._buffer += data
+        return len(data)
+
+    def take(self):
+        data = bytes(self._buffer)
+        self._buffer.clear()
+        return data
+
+def iter_zip(files):
+    """边读边生成zip流，帧已是压缩格式，使用存储模式不再压缩"""
+    stream = _ZipStream()
+    with zipfile.ZipFile(stream, mode='w', compression=zipfile.ZIP_STORED) as archive:
+        for arcname, path in files:
+            info = zipfile.ZipInfo(arcname, date_time=time.localtime(os.path.getmtime(path))[:6])
+            with archive.open(info, mode='w') as entry:
+                for chunk in _read_chunks(path):
+                    entry.write(chunk)
+                    yield stream.take()
+            yield stream.take()
+    yield stream.take()
@@ -1,21 +1,152 @@
 import os
+import re
+import shutil
+import asyncio
 import logging
-import openai
+import tempfile
+import aiohttp
+import ffmpeg
+from tenacity import AsyncRetrying, retry_if_exception_type, stop_after_attempt, wait_exponential
 from app.core.config import settings
+from app.services import ffmpeg_runner
+from app.services.subtitles import normalize_segments
 
 # 配置日志
 logger = logging.getLogger("asr_service")
 
+def parse_silences(output, duration=None):
+    """
+    解析ffmpeg silencedetect输出的静音区间，返回[(开始秒, 结束秒)]
+
+    Args:
+        output: ffmpeg的stderr文本
+        duration: 音频时长，提供时音频以静音结尾(没有silence_end)的区间以该时长作为结束
+    """
+    starts = [max(float(x), 0.0) for x in re.findall(r"silence_start: (-?[\d.]+)", output)]
+    ends = [float(x) for x in re.findall(r"silence_end: (-?[\d.]+)", output)]
+    silences = list(zip(starts, ends))
+    if duration is not None and len(starts) > len(ends):
+        silences.append((starts[-1], duration))
+    return silences
+
+class ASRRetryableError(Exception):
+    """ASR服务返回可重试的错误(限流或服务端错误)"""
+
 class ASRService:
     def __init__(self):
-        """初始化ASR服务"""
-        # 初始化ASR客户端
-        self.client = openai.Client(
-            api_key=settings.ASR_API_KEY, 
-            base_url=settings.ASR_API_BASE_URL
-        )
+        """初始化ASR服务，客户端和连接池都在首次使用时创建"""
+        self._client = None
+        # 异步客户端使用的连接池会话，首次调用时在事件循环中创建
+        self._session = None
+        # 实际使用的返回格式：接口不支持 verbose_json 时退回 json，之后的请求不再尝试
+        self.response_format = settings.ASR_RESPONSE_FORMAT
         logger.info("ASR服务初始化完成")
     
+    @property
+    def client(self):
+        """openai同步客户端，只在sync模式下首次使用时导入openai(导入耗时较长)并创建"""
+        if self._client is None:
+            import openai
+            self._client = openai.Client(
+                api_key=settings.ASR_API_KEY, 
+                base_url=settings.ASR_API_BASE_URL
+            )
+        return self._client
+    
+    def _get_session(self):
+        """获取复用连接的aiohttp会话，连接数受 ASR_MAX_CONNECTIONS 限制"""
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=settings.ASR_MAX_CONNECTIONS,
+                keepalive_timeout=settings.ASR_KEEPALIVE_SECONDS
+            )
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                headers={"Authorization": f"Bearer {settings.ASR_API_KEY}"}
+            )
+        return self._session
+    
+    async def close(self):
+        """关闭异步客户端的连接池"""
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+    
+    async def atranscribe(self, audio_path, output_path=None):
+        """
+        将音频文件转换为文本的异步版本，直接请求OpenAI兼容的转录接口
+        
+        连接在调用之间复用，每次请求有独立超时，限流和服务端错误按指数退避重试。
+        
+        Args:
+            audio_path: 音频文件路径
+            output_path: 可选的输出文件路径，如果提供则将转录结果保存到文件
+            
+        Returns:
+            转录结果 {"text": 文本, "segments": 带时间戳的分句}，接口不返回分句时segments为空列表
+        """
+        try:
+            logger.info(f"开始将音频转换为文本: {audio_path}")
+            
+            retrying = AsyncRetrying(
+                stop=stop_after_attempt(settings.ASR_MAX_RETRIES),
+                wait=wait_exponential(multiplier=settings.RETRY_DELAY),
+                retry=retry_if_exception_type((ASRRetryableError, aiohttp.ClientConnectionError, asyncio.TimeoutError)),
+                reraise=True
+            )
+            async for attempt in retrying:
+                with attempt:
+                    transcription = await self._request_transcription(audio_path)
+            logger.info(f"音频转文本完成，文本长度: {len(transcription['text'])}, 分句数: {len(transcription['segments'])}")
+            
+            # 如果提供了输出路径，保存到文件
+            if output_path:
+                with open(output_path, 'w', encoding='utf-8') as f:
+                    f.write(transcription["text"])
+                logger.info(f"转录文本已保存到: {output_path}")
+            
+            return transcription
+        except Exception as e:
+            logger.error(f"音频转文本失败: {str(e)}", exc_info=True)
+            raise
+    
+    def _fall_back_response_format(self, message):
+        """
+        接口以4xx拒绝 verbose_json 时退回 json，返回是否需要重试
+
+        部分OpenAI兼容服务不支持带时间戳的返回格式，此时只返回文本，不生成分句相关的输出
+        """
+        if self.response_format != "verbose_json" or "response_format" not in message:
+            return False
+        logger.warning(f"ASR服务不支持 response_format=verbose_json，改用json(不再生成分句时间戳): {message}")
+        self.response_format = "json"
+        return True
+    
+    async def _request_transcription(self, audio_path):
+        """发送一次转录请求并返回文本和分句"""
+        url = f"{settings.ASR_API_BASE_URL.rstrip('/')}/audio/transcriptions"
+        timeout = aiohttp.ClientTimeout(total=settings.ASR_TIMEOUT)
+        response_format = self.response_format
+        with open(audio_path, "rb") as audio_file:
+            form = aiohttp.FormData()
+            form.add_field("model", settings.ASR_MODEL)
+            if response_format:
+                form.add_field("response_format", response_format)
+            form.add_field("file", audio_file, filename=os.path.basename(audio_path))
+            async with self._get_session().post(url, data=form, timeout=timeout) as response:
+                if response.status == 429 or response.status >= 500:
+                    raise ASRRetryableError(f"ASR服务返回HTTP状态码: {response.status}")
+                if response.status != 200:
+                    message = await response.text()
+                    if 400 <= response.status < 500 and (
+                            self.response_format != response_format or self._fall_back_response_format(message)):
+                        # 已退回json(可能由并发的其他请求完成)，用新格式重新请求一次
+                        return await self._request_transcription(audio_path)
+                    raise Exception(f"ASR服务返回HTTP状态码: {response.status}, {message}")
+                data = await response.json(content_type=None)
+        if not isinstance(data, dict):
+            return {"text": str(data), "segments": []}
+        return {"text": data.get("text", ""), "segments": normalize_segments(data.get("segments"))}
+    
     def transcribe(self, audio_path, output_path=None):
         """
         将音频文件转换为文本
@@ -25,31 +156,202 @@ class ASRService:
             output_path: 可选的输出文件路径，如果提供则将转录结果保存到文件
             
         Returns:
-            转录的文本内容
+            转录结果 {"text": 文本, "segments": 带时间戳的分句}
         """
         try:
             logger.info(f"开始将音频转换为文本: {audio_path}")
             
-            with open(audio_path, "rb") as audio_file:
-                completion = self.client.audio.transcriptions.create(
-                    model=settings.ASR_MODEL, 
-                    file=audio_file
-                )
+            completion = self._create_transcription(audio_path)
             
-            # 获取转录文本
-            transcript = completion.text if hasattr(completion, 'text') else str(completion)
-            logger.info(f"音频转文本完成，文本长度: {len(transcript)}")
+            # 获取转录文本和分句
+            transcription = {
+                "text": completion.text if hasattr(completion, 'text') else str(completion),
+                "segments": normalize_segments(getattr(completion, 'segments', None))
+            }
+            logger.info(f"音频转文本完成，文本长度: {len(transcription['text'])}, 分句数: {len(transcription['segments'])}")
             
             # 如果提供了输出路径，保存到文件
             if output_path:
                 with open(output_path, 'w', encoding='utf-8') as f:
-                    f.write(transcript)
+                    f.write(transcription["text"])
                 logger.info(f"转录文本已保存到: {output_path}")
             
-            return transcript
+            return transcription
         except Exception as e:
             logger.error(f"音频转文本失败: {str(e)}", exc_info=True)
             raise
 
+    def _create_transcription(self, audio_path):
+        """通过openai客户端发送转录请求，接口拒绝 verbose_json 时退回json重新请求一次"""
+        import openai
+        response_format = self.response_format
+        options = {"response_format": response_format} if response_format else {}
+        try:
+            with open(audio_path, "rb") as audio_file:
+                return self.client.audio.transcriptions.create(
+                    model=settings.ASR_MODEL, 
+                    file=audio_file,
+                    **options
+                )
+        except openai.APIStatusError as e:
+            if e.status_code == 429 or e.status_code >= 500 or not (
+                    self.response_format != response_format or self._fall_back_response_format(str(e))):
+                raise
+        return self._create_transcription(audio_path)
+    
+    async def transcribe_chunked(self, audio_path, output_path=None, on_progress=None):
+        """
+        将长音频在静音处切分为多段，并发调用ASR后按时间顺序拼接
+
+        找不到合适静音点时按固定窗口切分，相邻分段重叠 ASR_CHUNK_OVERLAP_SECONDS 秒，
+        拼接时去掉重叠部分重复识别的文字，各段分句的时间加上该段的起始时间。
+        已完成的连续分段会实时写入 transcript.partial.txt。
+        
+        Args:
+            audio_path: 音频文件路径
+            output_path: 可选的输出文件路径
+            on_progress: 可选回调 on_progress(已完成分段数, 总分段数, 已转录到的秒数)
+            
+        Returns:
+            转录结果 {"text": 文本, "segments": 带时间戳的分句}
+        """
+        probe = await ffmpeg_runner.probe(audio_path)
+        duration = float(probe['format']['duration'])
+        
+        # 较短的音频直接整体识别
+        if duration <= settings.ASR_CHUNK_SECONDS * 1.5:
+            if settings.ASR_CLIENT_MODE == "sync":
+                return await ffmpeg_runner.run_cpu(self.transcribe, audio_path, output_path)
+            return await self.atranscribe(audio_path, output_path)
+        
+        silences = await self._detect_silences(audio_path)
+        chunks = self._plan_chunks(duration, silences)
+        logger.info(f"音频时长 {duration:.1f}秒，切分为 {len(chunks)} 段并发识别，并发数: {settings.ASR_CHUNK_CONCURRENCY}")
+        
+        work_dir = tempfile.mkdtemp(prefix="asr_chunks_", dir=os.path.dirname(audio_path))
+        output_dir = os.path.dirname(output_path) if output_path else None
+        partial_path = os.path.join(output_dir, "transcript.partial.txt") if output_dir else None
+        semaphore = asyncio.Semaphore(settings.ASR_CHUNK_CONCURRENCY)
+        texts = [None] * len(chunks)
+        chunk_segments = [None] * len(chunks)
+        ext = os.path.splitext(audio_path)[1] or ".mp3"
+        
+        async def run_chunk(index, start, end):
+            async with semaphore:
+                chunk_path = os.path.join(work_dir, f"chunk_{index}{ext}")
+                await ffmpeg_runner.run(
+                    ffmpeg
+                    .input(audio_path, ss=start, t=end - start)
+                    .output(chunk_path, c='copy')
+                    .overwrite_output()
+                )
+                if settings.ASR_CLIENT_MODE == "sync":
+                    transcription = await ffmpeg_runner.run_cpu(self.transcribe, chunk_path)
+                else:
+                    transcription = await self.atranscribe(chunk_path)
+                os.remove(chunk_path)
+                chunk_segments[index] = normalize_segments(transcription["segments"], offset=start)
+                texts[index] = transcription["text"]
+            
+            # 只输出从头开始连续完成的部分，保证部分转录结果按时间有序
+            done = 0
+            while done < len(texts) and texts[done] is not None:
+                done += 1
+            if partial_path:
+                with open(partial_path, 'w', encoding='utf-8') as f:
+                    f.write(self._stitch(chunks[:done], texts[:done]))
+            if on_progress:
+                on_progress(sum(1 for text in texts if text is not None), len(chunks), chunks[done - 1][1] if done else 0.0)
+        
+        try:
+            await asyncio.gather(*(run_chunk(i, start, end) for i, (start, end) in enumerate(chunks)))
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+        
+        transcript = self._stitch(chunks, texts)
+        segments = self._merge_segments(chunks, texts, chunk_segments)
+        logger.info(f"分段音频转文本完成，文本长度: {len(transcript)}, 分句数: {len(segments)}")
+        
+        if output_path:
+            with open(output_path, 'w', encoding='utf-8') as f:
+                f.write(transcript)
+            if partial_path and os.path.exists(partial_path):
+                os.remove(partial_path)
+            logger.info(f"转录文本已保存到: {output_path}")
+        
+        return {"text": transcript, "segments": segments}
+    
+    async def _detect_silences(self, audio_path):
+        """用ffmpeg silencedetect检测静音区间，返回[(开始秒, 结束秒)]"""
+        _, stderr = await ffmpeg_runner.run(
+            ffmpeg
+            .input(audio_path)
+            .filter('silencedetect', noise=f"{settings.ASR_SILENCE_NOISE_DB}dB", d=settings.ASR_SILENCE_MIN_SECONDS)
+            .output('-', format='null')
+        )
+        return parse_silences(stderr.decode(errors="ignore"))
+    
+    def _plan_chunks(self, duration, silences):
+        """在每个固定窗口边界附近选择静音中点作为切分点，找不到时在边界处硬切并保留重叠"""
+        window = settings.ASR_CHUNK_SECONDS
+        search = window * 0.2
+        overlap = settings.ASR_CHUNK_OVERLAP_SECONDS
+        midpoints = [(start + end) / 2 for start, end in silences]
+        
+        chunks = []
+        start = 0.0
+        while duration - start > window * 1.2:
+            target = start + window
+            nearby = [m for m in midpoints if abs(m - target) <= search and m > start + window / 2]
+            if nearby:
+                cut = min(nearby, key=lambda m: abs(m - target))
+                chunks.append((start, cut))
+                start = cut
+            else:
+                chunks.append((start, target))
+                start = target - overlap
+        chunks.append((start, duration))
+        return chunks
+    
+    @staticmethod
+    def _dedupe_overlaps(chunks, texts):
+        """去掉重叠区间内重复识别的开头文字，返回处理后的各段文本"""
+        merged = []
+        for i, text in enumerate(texts):
+            text = text.strip()
+            if merged and chunks[i][0] < chunks[i - 1][1]:
+                previous = merged[-1]
+                # 重叠区间内最多约每秒15个字符，取能与上一段结尾对齐的最长开头，至少2个字符才视为重复
+                max_size = int((chunks[i - 1][1] - chunks[i][0]) * 15)
+                for size in range(min(len(previous), len(text) - 1, max_size), 1, -1):
+                    if previous.endswith(text[:size]):
+                        text = text[size:].lstrip()
+                        break
+            merged.append(text)
+        return merged
+    
+    @classmethod
+    def _merge_segments(cls, chunks, texts, chunk_segments):
+        """
+        合并各段的分句：重叠区间内的分句以前一段为准，按中点落在前一段结束之前丢弃；
+        接口没有返回分句的段以整段(去重后的文本)作为一个分句
+        """
+        merged = []
+        for i, ((start, end), text) in enumerate(zip(chunks, cls._dedupe_overlaps(chunks, texts))):
+            if not chunk_segments[i]:
+                if text:
+                    merged.append({"start": round(start, 3), "end": round(end, 3), "text": text})
+                continue
+            covered = chunks[i - 1][1] if i and start < chunks[i - 1][1] else start
+            for segment in chunk_segments[i]:
+                if (segment["start"] + segment["end"]) / 2 >= covered:
+                    merged.append(dict(segment, end=min(segment["end"], round(end, 3))))
+        return merged
+    
+    @classmethod
+    def _stitch(cls, chunks, texts):
+        """按时间顺序拼接分段文本"""
+        return "\n".join(t for t in cls._dedupe_overlaps(chunks, texts) if t)
+
 # 创建单例
 asr_service = ASRService()
\ No newline at end of file
@@ -0,0 +1,506 @@
+import os
+import json
+import time
+import uuid
+import socket
+import sqlite3
+import logging
+import threading
+from app.core.config import settings
+
+# 配置日志
+logger = logging.getLogger("backend")
+
+class LocalRedis:
+    """
+    进程内的Redis替身，实现共享后端用到的命令子集(字符串、哈希、有序集合、过期时间)和Lua脚本
+
+    REDIS_URL 设置为 memory:// 时使用，用于测试和单进程调试，不能在进程间共享
+    """
+
+    def __init__(self):
+        self._data = {}
+        self._expires = {}
+        self._lock = threading.RLock()
+
+    def _alive(self, name):
+        expires_at = self._expires.get(name)
+        if expires_at is not None and expires_at <= time.time():
+            self._data.pop(name, None)
+            self._expires.pop(name, None)
+        return name in self._data
+
+    def _container(self, name, factory):
+        if not self._alive(name):
+            self._data[name] = factory()
+        return self._data[name]
+
+    def get(self, name):
+        with self._lock:
+            return self._data[name] if self._alive(name) else None
+
+    def set(self, name, value, nx=False, xx=False, px=None):
+        with self._lock:
+            exists = self._alive(name)
+            if (nx and exists) or (xx and not exists):
+                return None
+            self._data[name] = str(value)
+            if px is not None:
+                self._expires[name] = time.time() + px / 1000
+            else:
+                self._expires.pop(name, None)
+            return True
+
+    def pexpire(self, name, px):
+        with self._lock:
+            if not self._alive(name):
+                return 0
+            self._expires[name] = time.time() + int(px) / 1000
+            return 1
+
+    def exists(self, *names):
+        with self._lock:
+            return sum(1 for name in names if self._alive(name))
+
+    def delete(self, *names):
+        with self._lock:
+            deleted = 0
+            for name in names:
+                if self._alive(name):
+                    deleted += 1
+                self._data.pop(name, None)
+                self._expires.pop(name, None)
+            return deleted
+
+    def hset(self, name, key, value):
+        with self._lock:
+            values = self._container(name, dict)
+            created = key not in values
+            values[key] = str(value)
+            return int(created)
+
+    def hget(self, name, key):
+        with self._lock:
+            return self._data[name].get(key) if self._alive(name) else None
+
+    def hdel(self, name, *keys):
+        with self._lock:
+            if not self._alive(name):
+                return 0
+            return sum(1 for key in keys if self._data[name].pop(key, None) is not None)
+
+    def hgetall(self, name):
+        with self._lock:
+            return dict(self._data[name]) if self._alive(name) else {}
+
+    def hlen(self, name):
+        with self._lock:
+            return len(self._data[name]) if self._alive(name) else 0
+
+    def zadd(self, name, mapping):
+        with self._lock:
+            values = self._container(name, dict)
+            added = sum(1 for member in mapping if member not in values)
+            values.update({member: float(score) for member, score in mapping.items()})
+            return added
+
+    def zrem(self, name, *members):
+        with self._lock:
+            if not self._alive(name):
+                return 0
+            return sum(1 for member in members if self._data[name].pop(member, None) is not None)
+
+    def zcard(self, name):
+        with self._lock:
+            return len(self._data[name]) if self._alive(name) else 0
+
+    def zrange(self, name, start, end, withscores=False):
+        with self._lock:
+            if not self._alive(name):
+                return []
+            items = sorted(self._data[name].items(), key=lambda item: (item[1], item[0]))
+            items = items[start:] if end == -1 else items[start:end + 1]
+            return items if withscores else [member for member, _ in items]
+
+    def zpopmin(self, name, count=1):
+        with self._lock:
+            items = self.zrange(name, 0, count - 1, withscores=True)
+            for member, _ in items:
+                del self._data[name][member]
+            return items
+
+    def eval(self, script, numkeys, *keys_and_args):
+        """不执行Lua，按脚本查找等价的Python实现，在锁内执行以保持原子性"""
+        keys = list(keys_and_args[:numkeys])
+        args = [str(arg) for arg in keys_and_args[numkeys:]]
+        with self._lock:
+            return _LOCAL_SCRIPTS[script](self, keys, args)
+
+    def pipeline(self, transaction=False):
+        return _LocalPipeline(self)
+
+    def close(self):
+        pass
+
+class _LocalPipeline:
+    """按顺序执行排队的命令，与redis-py的非事务管道用法一致"""
+
+    def __init__(self, client):
+        self._client = client
+        self._commands = []
+
+    def __getattr__(self, name):
+        method = getattr(self._client, name)
+
+        def queue(*args, **kwargs):
+            self._commands.append((method, args, kwargs))
+            return self
+        return queue
+
+    def execute(self):
+        with self._client._lock:
+            results = [method(*args, **kwargs) for method, args, kwargs in self._commands]
+        self._commands = []
+        return results
+
+# 主进程租约续期：仍由本进程持有时才延长过期时间，返回1表示续期成功
+_RENEW_LEASE = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('PEXPIRE', KEYS[1], ARGV[2])
+end
+return 0
+"""
+
+# 领取任务：弹出队首任务并登记领取方，返回 [任务ID, 任务参数]，队列为空时返回nil
+_CLAIM_JOB = """
+local popped = redis.call('ZPOPMIN', KEYS[1])
+if #popped == 0 then
+    return nil
+end
+redis.call('HSET', KEYS[2], popped[1], ARGV[1])
+return {popped[1], redis.call('HGET', KEYS[3], popped[1])}
+"""
+
+def _local_renew_lease(client, keys, args):
+    if client.get(keys[0]) != args[0]:
+        return 0
+    return client.pexpire(keys[0], args[1])
+
+def _local_claim_job(client, keys, args):
+    popped = client.zpopmin(keys[0], 1)
+    if not popped:
+        return None
+    job_id = popped[0][0]
+    client.hset(keys[1], job_id, args[0])
+    return [job_id, client.hget(keys[2], job_id)]
+
+_LOCAL_SCRIPTS = {_RENEW_LEASE: _local_renew_lease, _CLAIM_JOB: _local_claim_job}
+
+_local_redis = {}
+
+def redis_client(url):
+    """按URL创建Redis客户端，memory:// 返回进程内替身"""
+    if url.startswith("memory://"):
+        return _local_redis.setdefault(url, LocalRedis())
+    try:
+        import redis
+    except ImportError:
+        raise RuntimeError("SHARED_BACKEND=redis 需要安装 redis 包(pip install redis)")
+    return redis.Redis.from_url(url, decode_responses=True)
+
+class LocalBackend:
+    """
+    单进程部署：任务只在本进程内排队和执行，本进程始终负责清理
+    """
+
+    shared = False
+    mode = "local"
+
+    def __init__(self):
+        self.worker_id = f"{socket.gethostname()}-{os.getpid()}"
+        self.is_leader = True
+
+    def heartbeat(self):
+        pass
+
+    def try_lead(self):
+        return True
+
+    def state_dir(self):
+        """本进程私有状态(缓存文件和索引)的目录，单进程部署直接使用 TEMP_DIR"""
+        return settings.TEMP_DIR
+
+    def stats(self):
+        return {"mode": self.mode, "worker_id": self.worker_id, "leader": True}
+
+    def close(self):
+        pass
+
+class _SharedBackend:
+    """多工作进程共享后端的公共部分：工作进程标识、心跳和主进程状态"""
+
+    shared = True
+    mode = None
+
+    def __init__(self):
+        self.worker_id = f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+        self.is_leader = False
+        self._state_dir = None
+        self._state_lock_file = None
+        self._state_lock = threading.Lock()
+
+    def state_dir(self):
+        """
+        本进程私有状态(缓存文件和索引)的目录: TEMP_DIR/_workers/<主机名>-<序号>
+
+        各工作进程共享 TEMP_DIR，缓存索引写到同一个文件会互相覆盖，因此每个进程使用自己的目录。
+        同一主机上的进程通过文件锁占用最小的空闲序号，重启后沿用原来的目录，不会因工作进程标识变化遗留旧目录。
+        """
+        with self._state_lock:
+            if self._state_dir is None:
+                import fcntl
+                root = os.path.join(settings.TEMP_DIR, "_workers")
+                os.makedirs(root, exist_ok=True)
+                slot = 0
+                while True:
+                    path = os.path.join(root, f"{socket.gethostname()}-{slot}")
+                    lock_file = open(f"{path}.lock", "a")
+                    try:
+                        fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+                        break
+                    except OSError:
+                        lock_file.close()
+                        slot += 1
+                os.makedirs(path, exist_ok=True)
+                self._state_lock_file = lock_file
+                self._state_dir = path
+                logger.info(f"工作进程 {self.worker_id} 使用私有状态目录: {path}")
+            return self._state_dir
+
+    def _release_state_dir(self):
+        with self._state_lock:
+            if self._state_lock_file is not None:
+                # 关闭文件即释放锁，目录留给之后占用该序号的进程
+                self._state_lock_file.close()
+                self._state_lock_file = None
+                self._state_dir = None
+
+    def stats(self):
+        return {
+            "mode": self.mode,
+            "worker_id": self.worker_id,
+            "leader": self.is_leader,
+            "queued": self.queue_length()
+        }
+
+class SqliteBackend(_SharedBackend):
+    """
+    单机多工作进程：共享同一个 TEMP_DIR
+
+    - 清理主进程通过文件锁(flock)选举，持锁进程退出时锁自动释放，由其他进程接替
+    - 工作队列和工作进程心跳保存在 SQLite 数据库中，领取任务在写事务中完成，不会被重复领取
+    """
+
+    mode = "sqlite"
+
+    def __init__(self, temp_dir):
+        super().__init__()
+        self.db_path = os.path.join(temp_dir, "_coord.db")
+        self.lock_path = os.path.join(temp_dir, "_leader.lock")
+        self._lock_file = None
+        self._conn = None
+        self._lock = threading.RLock()
+
+    def _connection(self):
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.db_path) or ".", exist_ok=True)
+            conn = sqlite3.connect(self.db_path, timeout=30, check_same_thread=False, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS queue ("
+                "job_id TEXT PRIMARY KEY, "
+                "priority INTEGER NOT NULL, "
+                "enqueued_at REAL NOT NULL, "
+                "payload TEXT NOT NULL, "
+                "owner TEXT)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_queue_pick ON queue(owner, priority, enqueued_at)")
+            conn.execute("CREATE TABLE IF NOT EXISTS workers (worker_id TEXT PRIMARY KEY, heartbeat_at REAL NOT NULL)")
+            self._conn = conn
+        return self._conn
+
+    def heartbeat(self):
+        with self._lock:
+            self._connection().execute(
+                "INSERT OR REPLACE INTO workers (worker_id, heartbeat_at) VALUES (?, ?)",
+                (self.worker_id, time.time())
+            )
+
+    def try_lead(self):
+        """尝试获取主进程文件锁，获取后一直持有到进程退出"""
+        if self._lock_file is None:
+            import fcntl
+            lock_file = open(self.lock_path, "a")
+            try:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                lock_file.close()
+                return False
+            self._lock_file = lock_file
+            self.is_leader = True
+            logger.info(f"工作进程 {self.worker_id} 成为清理主进程")
+        return True
+
+    def enqueue(self, job_id, payload, priority=0):
+        with self._lock:
+            self._connection().execute(
+                "INSERT INTO queue (job_id, priority, enqueued_at, payload) VALUES (?, ?, ?, ?)",
+                (job_id, priority, time.time(), json.dumps(payload, ensure_ascii=False))
+            )
+
+    def queue_length(self):
+        with self._lock:
+            return self._connection().execute("SELECT COUNT(*) FROM queue WHERE owner IS NULL").fetchone()[0]
+
+    def claim(self):
+        """领取优先级最高、提交最早的任务，没有可领取的任务时返回None"""
+        with self._lock:
+            conn = self._connection()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = conn.execute(
+                    "SELECT job_id, payload FROM queue WHERE owner IS NULL "
+                    "ORDER BY priority DESC, enqueued_at LIMIT 1"
+                ).fetchone()
+                if row is not None:
+                    conn.execute("UPDATE queue SET owner = ? WHERE job_id = ?", (self.worker_id, row[0]))
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+        return (row[0], json.loads(row[1])) if row else None
+
+    def ack(self, job_id):
+        with self._lock:
+            self._connection().execute("DELETE FROM queue WHERE job_id = ?", (job_id,))
+
+    def orphaned_jobs(self):
+        """已被领取但领取方心跳超时的任务，并清理过期的心跳记录"""
+        cutoff = time.time() - settings.WORKER_TIMEOUT_SECONDS
+        with self._lock:
+            conn = self._connection()
+            rows = conn.execute(
+                "SELECT job_id, payload FROM queue WHERE owner IS NOT NULL AND owner NOT IN "
+                "(SELECT worker_id FROM workers WHERE heartbeat_at > ?)", (cutoff,)
+            ).fetchall()
+            conn.execute("DELETE FROM workers WHERE heartbeat_at <= ?", (cutoff,))
+        return [(job_id, json.loads(payload)) for job_id, payload in rows]
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.execute("DELETE FROM workers WHERE worker_id = ?", (self.worker_id,))
+                self._conn.close()
+                self._conn = None
+        if self._lock_file is not None:
+            # 关闭文件即释放锁
+            self._lock_file.close()
+            self._lock_file = None
+            self.is_leader = False
+        self._release_state_dir()
+
+class RedisBackend(_SharedBackend):
+    """
+    多机部署：通过Redis(或兼容服务)共享工作队列、工作进程心跳和主进程租约
+
+    - 主进程租约: SET NX PX，持有者用Lua脚本比较后续期，超时未续期时由其他进程接替
+    - 工作队列: 有序集合按优先级和提交时间排序，弹出和登记领取方在同一个Lua脚本中执行，每个任务只被一个进程领取
+    多机部署时 TEMP_DIR 需要位于各节点共享的存储上
+    """
+
+    mode = "redis"
+
+    def __init__(self, url, prefix):
+        super().__init__()
+        self.client = redis_client(url)
+        self.prefix = prefix
+
+    def _key(self, name):
+        return f"{self.prefix}{name}"
+
+    def heartbeat(self):
+        self.client.set(self._key(f"worker:{self.worker_id}"), time.time(),
+                        px=settings.WORKER_TIMEOUT_SECONDS * 1000)
+
+    def try_lead(self):
+        """获取或续期主进程租约"""
+        key = self._key("leader")
+        ttl = settings.WORKER_TIMEOUT_SECONDS * 1000
+        if self.client.set(key, self.worker_id, nx=True, px=ttl):
+            logger.info(f"工作进程 {self.worker_id} 成为清理主进程")
+            self.is_leader = True
+        else:
+            # 读取和续期在同一个脚本中执行，租约在两者之间过期并被其他进程获取时不会误续期
+            self.is_leader = bool(self.client.eval(_RENEW_LEASE, 1, key, self.worker_id, ttl))
+        return self.is_leader
+
+    def enqueue(self, job_id, payload, priority=0):
+        # 分数越小越先领取：优先级高的在前，同优先级按提交时间(毫秒)先后
+        score = -priority * 1e13 + time.time() * 1000
+        pipe = self.client.pipeline(transaction=False)
+        pipe.hset(self._key("jobs"), job_id, json.dumps(payload, ensure_ascii=False))
+        pipe.zadd(self._key("queue"), {job_id: score})
+        pipe.execute()
+
+    def queue_length(self):
+        return self.client.zcard(self._key("queue"))
+
+    def claim(self):
+        claimed = self.client.eval(_CLAIM_JOB, 3, self._key("queue"), self._key("claims"), self._key("jobs"),
+                                   self.worker_id)
+        if not claimed:
+            return None
+        job_id, payload = claimed
+        if payload is None:
+            self.ack(job_id)
+            return None
+        return job_id, json.loads(payload)
+
+    def ack(self, job_id):
+        pipe = self.client.pipeline(transaction=False)
+        pipe.hdel(self._key("jobs"), job_id)
+        pipe.hdel(self._key("claims"), job_id)
+        pipe.zrem(self._key("queue"), job_id)
+        pipe.execute()
+
+    def orphaned_jobs(self):
+        orphaned = []
+        alive = {}
+        for job_id, owner in self.client.hgetall(self._key("claims")).items():
+            if owner not in alive:
+                alive[owner] = bool(self.client.exists(self._key(f"worker:{owner}")))
+            if not alive[owner]:
+                payload = self.client.hget(self._key("jobs"), job_id)
+                orphaned.append((job_id, json.loads(payload) if payload else {}))
+        return orphaned
+
+    def close(self):
+        try:
+            self.client.delete(self._key(f"worker:{self.worker_id}"))
+            if self.is_leader and self.client.get(self._key("leader")) == self.worker_id:
+                self.client.delete(self._key("leader"))
+        except Exception as e:
+            logger.warning(f"注销工作进程失败: {str(e)}")
+        self.is_leader = False
+        self._release_state_dir()
+
+def create_backend():
+    """按 SHARED_BACKEND 创建部署后端"""
+    if settings.SHARED_BACKEND == "sqlite":
+        return SqliteBackend(settings.TEMP_DIR)
+    if settings.SHARED_BACKEND == "redis":
+        return RedisBackend(settings.REDIS_URL, settings.REDIS_PREFIX)
+    return LocalBackend()
+
+# 创建单例
+backend = create_backend()
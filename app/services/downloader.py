@@ -0,0 +1,236 @@
+import os
+import re
+import json
+import time
+import asyncio
+import logging
+import aiohttp
+from app.core.config import settings
+from app.services import ffmpeg_runner
+
+# 配置日志
+logger = logging.getLogger("downloader")
+
+# 每次从响应中读取的块大小
+_CHUNK_SIZE = 1024 * 1024
+
+_CONTENT_RANGE_PATTERN = re.compile(r"bytes\s+(\d+)-(\d+)/(\d+)")
+
+async def _write_at(fd, data, offset):
+    """在CPU线程池中把数据写入文件的指定位置，不阻塞事件循环"""
+    write = asyncio.get_running_loop().run_in_executor(ffmpeg_runner.cpu_executor, os.pwrite, fd, data, offset)
+    try:
+        await asyncio.shield(write)
+    except asyncio.CancelledError:
+        # 被取消时等待进行中的写入完成，调用方之后才能安全地关闭文件描述符
+        await write
+        raise
+
+class SegmentedDownloader:
+    """
+    分段并发下载器
+
+    - 服务端支持Range时，将文件按字节范围切分为多段并发下载，写入预分配的文件
+    - 各段的下载进度保存在旁路状态文件(<文件名>.parts)中，下载失败后重试时从已完成的位置继续
+    - 服务端不支持Range时退化为单连接顺序下载
+    - 所有下载共用一个连接池会话
+    """
+
+    def __init__(self):
+        # 连接池会话，首次调用时在事件循环中创建
+        self._session = None
+
+    def _get_session(self):
+        """获取复用连接的aiohttp会话，连接数受 DOWNLOAD_MAX_CONNECTIONS 限制"""
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(limit=settings.DOWNLOAD_MAX_CONNECTIONS)
+            self._session = aiohttp.ClientSession(connector=connector)
+        return self._session
+
+    def session(self):
+        """下载共用的连接池会话，提交任务时查询源文件校验信息的HEAD请求也复用该会话"""
+        return self._get_session()
+
+    async def close(self):
+        """关闭连接池"""
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+
+    async def download(self, url, file_path):
+        """
+        下载文件到 file_path，失败时保留已下载部分，再次调用同一路径时断点续传
+
+        Returns:
+            下载统计: 模式、分段数、文件大小、尝试次数、下载字节数、重试下载字节数、耗时和吞吐量。
+            重试下载字节数只统计之前的尝试已经下载过、本次重新传输的字节：分段下载从已写入位置续传，不重复下载；
+            单连接下载无法续传，重试时从头开始，与之前尝试重叠的部分计入
+        """
+        state_path = f"{file_path}.parts"
+        state = self._load_state(state_path)
+        started = time.monotonic()
+        session = self._get_session()
+        timeout = aiohttp.ClientTimeout(total=settings.DOWNLOAD_TIMEOUT)
+
+        # 请求第一个字节，同时判断是否支持Range并获取文件大小和校验信息
+        async with session.get(url, headers={"Range": "bytes=0-0"}, timeout=timeout) as response:
+            if response.status not in (200, 206):
+                raise Exception(f"下载失败，HTTP状态码: {response.status}")
+            match = _CONTENT_RANGE_PATTERN.match(response.headers.get("Content-Range", ""))
+            size = int(match.group(3)) if response.status == 206 and match else None
+            validators = {
+                "etag": response.headers.get("ETag"),
+                "last_modified": response.headers.get("Last-Modified")
+            }
+
+        if state and (state["url"] != url or state["size"] != size or state["validators"] != validators
+                      or not os.path.exists(file_path)):
+            logger.info(f"源文件已变化或下载文件缺失，重新开始下载: {url}")
+            state = None
+        if state is None:
+            state = {
+                "url": url,
+                "size": size,
+                "validators": validators,
+                "segments": self._plan_segments(size) if size else [],
+                "attempts": 0,
+                "bytes_downloaded": 0,
+                "bytes_retried": 0,
+                # 单连接下载的尝试中最多收到的字节数，之后的尝试中这部分为重复下载
+                "stream_bytes": 0
+            }
+        elif size:
+            logger.info(f"从上次中断的位置继续下载: {file_path}, "
+                        f"已完成 {self._completed_bytes(state)}/{size} 字节")
+        state["attempts"] += 1
+        fetched_before = state.get("stream_bytes", 0)
+        attempt_bytes = 0
+
+        def on_bytes(count):
+            nonlocal attempt_bytes
+            if not size:
+                state["bytes_retried"] += max(0, min(attempt_bytes + count, fetched_before) - attempt_bytes)
+            attempt_bytes += count
+            state["bytes_downloaded"] += count
+
+        try:
+            if size:
+                await self._download_ranges(session, url, file_path, state, timeout, on_bytes)
+            else:
+                logger.info(f"服务端不支持Range，使用单连接下载: {url}")
+                await self._download_stream(session, url, file_path, timeout, on_bytes)
+        except BaseException:
+            # 单连接下载无法续传，仍保存状态以累计尝试次数和重试字节数
+            if not size:
+                state["stream_bytes"] = max(fetched_before, attempt_bytes)
+            self._save_state(state_path, state)
+            raise
+
+        if os.path.exists(state_path):
+            os.remove(state_path)
+        duration = time.monotonic() - started
+        return {
+            "mode": "range" if size else "stream",
+            "segments": len(state["segments"]) or 1,
+            "size_bytes": size if size else attempt_bytes,
+            "attempts": state["attempts"],
+            "bytes_downloaded": state["bytes_downloaded"],
+            "bytes_retried": state["bytes_retried"],
+            "duration_seconds": round(duration, 3),
+            "throughput_mbps": round(attempt_bytes * 8 / duration / 1000000, 3) if duration > 0 else 0.0
+        }
+
+    @staticmethod
+    def _plan_segments(size):
+        """按 DOWNLOAD_SEGMENTS 和最小分段大小切分字节范围，返回 [[起始, 结束(含), 已写入位置]]"""
+        min_segment = settings.DOWNLOAD_MIN_SEGMENT_MB * 1024 * 1024
+        count = max(1, min(settings.DOWNLOAD_SEGMENTS, size // max(min_segment, 1)))
+        step = -(-size // count)
+        return [[start, min(start + step, size) - 1, start] for start in range(0, size, step)]
+
+    @staticmethod
+    def _completed_bytes(state):
+        return sum(position - start for start, _, position in state["segments"])
+
+    async def _download_ranges(self, session, url, file_path, state, timeout, on_bytes):
+        """并发下载各分段未完成的部分，直接写入文件中对应的位置"""
+        if not os.path.exists(file_path):
+            self._preallocate(file_path, state["size"])
+        fd = os.open(file_path, os.O_WRONLY)
+        try:
+            segment_tasks = [
+                asyncio.create_task(self._download_segment(session, url, fd, segment, timeout, on_bytes))
+                for segment in state["segments"] if segment[2] <= segment[1]
+            ]
+            try:
+                await asyncio.gather(*segment_tasks)
+            except BaseException:
+                # 任一分段失败时停止其余分段，已下载的进度保留用于续传
+                for task in segment_tasks:
+                    task.cancel()
+                await asyncio.gather(*segment_tasks, return_exceptions=True)
+                raise
+        finally:
+            os.close(fd)
+
+    @staticmethod
+    async def _download_segment(session, url, fd, segment, timeout, on_bytes):
+        _, end, position = segment
+        headers = {"Range": f"bytes={position}-{end}"}
+        async with session.get(url, headers=headers, timeout=timeout) as response:
+            if response.status != 206:
+                raise Exception(f"分段下载失败，HTTP状态码: {response.status}")
+            while segment[2] <= end:
+                chunk = await response.content.read(min(_CHUNK_SIZE, end - segment[2] + 1))
+                if not chunk:
+                    raise Exception(f"分段下载提前结束: {segment[2]}/{end + 1}")
+                await _write_at(fd, chunk, segment[2])
+                segment[2] += len(chunk)
+                on_bytes(len(chunk))
+
+    @staticmethod
+    async def _download_stream(session, url, file_path, timeout, on_bytes):
+        """单连接顺序下载整个文件"""
+        async with session.get(url, timeout=timeout) as response:
+            if response.status != 200:
+                raise Exception(f"下载失败，HTTP状态码: {response.status}")
+            with open(file_path, 'wb') as f:
+                offset = 0
+                while True:
+                    chunk = await response.content.read(_CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    await _write_at(f.fileno(), chunk, offset)
+                    offset += len(chunk)
+                    on_bytes(len(chunk))
+
+    @staticmethod
+    def _preallocate(file_path, size):
+        """预先分配文件空间，避免并发写入各段时文件反复扩展"""
+        with open(file_path, 'wb') as f:
+            try:
+                os.posix_fallocate(f.fileno(), 0, size)
+            except (AttributeError, OSError):
+                # 平台或文件系统不支持时退化为稀疏文件
+                f.truncate(size)
+
+    @staticmethod
+    def _load_state(state_path):
+        try:
+            with open(state_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logger.warning(f"读取下载进度失败，重新开始下载: {str(e)}")
+            return None
+
+    @staticmethod
+    def _save_state(state_path, state):
+        try:
+            with open(state_path, 'w', encoding='utf-8') as f:
+                json.dump(state, f)
+        except Exception as e:
+            logger.warning(f"保存下载进度失败: {str(e)}")
+
+# 创建单例
+downloader = SegmentedDownloader()
@@ -0,0 +1,134 @@
+import re
+import json
+import asyncio
+import logging
+from contextvars import ContextVar
+from concurrent.futures import ThreadPoolExecutor
+import ffmpeg
+from ffmpeg.dag import topo_sort
+from ffmpeg.nodes import OutputNode, get_stream_spec_nodes
+from app.core.config import settings
+from app.services import metrics
+
+# 配置日志
+logger = logging.getLogger("ffmpeg_runner")
+
+# CPU密集型的Python工作(哈希计算、目录删除等)使用的专用线程池，与默认线程池隔离
+cpu_executor = ThreadPoolExecutor(max_workers=settings.CPU_WORKERS, thread_name_prefix="cpu-worker")
+
+# 同时运行的ffmpeg/ffprobe进程数上限
+_process_slots = asyncio.Semaphore(settings.FFMPEG_MAX_PROCESSES)
+# 远程视频探测使用独立的进程槽位，主要耗时在网络等待，不与任务的ffmpeg进程争用
+_remote_probe_slots = asyncio.Semaphore(settings.REMOTE_PROBE_CONCURRENCY)
+
+# 当前阶段的ffmpeg线程预算，任务内并发执行的阶段由 VideoProcessor 分配，未设置时使用 FFMPEG_THREADS_PER_JOB
+thread_budget = ContextVar("thread_budget", default=None)
+
+# ffmpeg -benchmark 在结束时输出的本进程CPU时间
+_BENCH_PATTERN = re.compile(rb"bench: utime=([\d.]+)s stime=([\d.]+)s")
+
+def _output_files(stream):
+    """按ffmpeg-python生成命令时的顺序列出各输出文件"""
+    sorted_nodes, _ = topo_sort(get_stream_spec_nodes(stream))
+    return [node.kwargs["filename"] for node in sorted_nodes if isinstance(node, OutputNode)]
+
+def _with_thread_budget(args, threads, output_files):
+    """
+    将线程预算分配给各输入(解码)和各输出(编码)，并限制滤镜线程数；同时开启 -benchmark 以获取进程的CPU时间
+
+    ffmpeg的 -threads 是按输入/输出文件生效的选项：放在 -i 之前限制解码线程，
+    放在输出文件的选项中限制编码线程，各输出的选项以该输出的文件名结束。
+    多个输入(如seek模式每个时间点一个输入)或多个输出时平分预算，解码、滤镜、编码各自合计不超过预算。
+    -filter_threads 只作用于简单滤镜，滤镜图(-filter_complex)由 -filter_complex_threads 限制。
+    """
+    input_threads = str(max(1, threads // max(args.count("-i"), 1)))
+    output_threads = str(max(1, threads // max(len(output_files), 1)))
+    budgeted = [args[0], "-benchmark", "-filter_threads", str(threads), "-filter_complex_threads", str(threads)]
+    # 输入和滤镜图之后是第一个输出的选项
+    outputs_start = 1
+    for i, arg in enumerate(args[1:], 1):
+        if arg in ("-i", "-filter_complex"):
+            outputs_start = i + 2
+    for arg in args[1:outputs_start]:
+        if arg == "-i":
+            budgeted += ["-threads", input_threads]
+        budgeted.append(arg)
+    pending = list(output_files)
+    budgeted += ["-threads", output_threads]
+    for arg in args[outputs_start:]:
+        budgeted.append(arg)
+        if pending and arg == pending[0]:
+            pending.pop(0)
+            # 下一个输出的选项
+            if pending:
+                budgeted += ["-threads", output_threads]
+    return budgeted
+
+async def _exec(args, slots=_process_slots):
+    """在进程槽位内异步执行命令，返回 (返回码, stdout, stderr)"""
+    async with slots:
+        process = await asyncio.create_subprocess_exec(
+            *args,
+            stdin=asyncio.subprocess.DEVNULL,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE
+        )
+        try:
+            stdout, stderr = await process.communicate()
+        except asyncio.CancelledError:
+            # 任务被取消时结束子进程，避免残留
+            if process.returncode is None:
+                process.kill()
+                await process.wait()
+            raise
+        return process.returncode, stdout, stderr
+
+async def run(stream, threads=None):
+    """
+    异步执行ffmpeg-python构建的命令，不占用线程池线程
+
+    Args:
+        stream: ffmpeg-python的输出流
+        threads: 本次调用的线程预算，默认使用当前阶段的预算(thread_budget)或 FFMPEG_THREADS_PER_JOB
+
+    Returns:
+        (stdout, stderr)
+
+    Raises:
+        ffmpeg.Error: ffmpeg返回非零状态码
+    """
+    threads = threads or thread_budget.get() or settings.FFMPEG_THREADS_PER_JOB
+    args = _with_thread_budget(stream.compile(), threads, _output_files(stream))
+    returncode, stdout, stderr = await _exec(args)
+    stage = metrics.current_stage.get()
+    match = _BENCH_PATTERN.search(stderr)
+    if match:
+        cpu_seconds = float(match.group(1)) + float(match.group(2))
+        metrics.ffmpeg_cpu.inc(cpu_seconds, stage=stage)
+        metrics.record_task_metric("ffmpeg_cpu_seconds", stage, cpu_seconds)
+    metrics.ffmpeg_runs.inc(stage=stage, result="ok" if returncode == 0 else "error")
+    if returncode != 0:
+        raise ffmpeg.Error("ffmpeg", stdout, stderr)
+    return stdout, stderr
+
+async def probe(source, remote=False, **kwargs):
+    """
+    异步版本的 ffmpeg.probe，返回格式和流信息
+
+    Args:
+        remote: 探测远程URL时为True，使用独立的进程槽位
+        kwargs: ffprobe的输入选项
+    """
+    args = ["ffprobe", "-show_format", "-show_streams", "-of", "json"]
+    for key, value in kwargs.items():
+        args += [f"-{key}", str(value)]
+    args.append(source)
+    returncode, stdout, stderr = await _exec(args, _remote_probe_slots if remote else _process_slots)
+    metrics.ffmpeg_runs.inc(stage=metrics.current_stage.get(), result="ok" if returncode == 0 else "error")
+    if returncode != 0:
+        raise ffmpeg.Error("ffprobe", stdout, stderr)
+    return json.loads(stdout.decode("utf-8"))
+
+async def run_cpu(func, *args):
+    """在专用CPU线程池中执行阻塞函数"""
+    return await asyncio.get_event_loop().run_in_executor(cpu_executor, func, *args)
@@ -0,0 +1,182 @@
+import math
+import threading
+from contextvars import ContextVar
+
+# 当前协程所属的流水线阶段，由 Pipeline 在各阶段任务中设置，用于按阶段归集ffmpeg CPU时间
+current_stage = ContextVar("current_stage", default="none")
+
+# 当前任务的指标累加器(字典)，由 VideoProcessor 在任务开始时设置，阶段任务继承
+task_metrics = ContextVar("task_metrics", default=None)
+
+# 耗时直方图的默认分桶(秒)
+DURATION_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800)
+# 字节数直方图的默认分桶
+BYTES_BUCKETS = (1e3, 1e4, 1e5, 1e6, 1e7, 1e8, 1e9, 1e10)
+
+def _format_value(value):
+    if value == math.inf:
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _format_labels(labelnames, values, extra=()):
+    pairs = list(zip(labelnames, values)) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+class _Metric:
+    type_name = "untyped"
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def _samples(self):
+        return [(self.name, key, (), value) for key, value in self._values.items()]
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type_name}"]
+        for sample_name, key, extra, value in self._samples():
+            lines.append(f"{sample_name}{_format_labels(self.labelnames, key, extra)} {_format_value(value)}")
+        return "\n".join(lines)
+
+class Counter(_Metric):
+    """只增不减的计数器"""
+    type_name = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+class Gauge(_Metric):
+    """可增可减的当前值，也可以设置回调函数在输出时取值"""
+    type_name = "gauge"
+
+    def __init__(self, name, documentation, labelnames=(), function=None):
+        super().__init__(name, documentation, labelnames)
+        # 回调返回数值，或 {标签值元组: 数值}
+        self._function = function
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def _samples(self):
+        if self._function is None:
+            return super()._samples()
+        values = self._function()
+        if not isinstance(values, dict):
+            values = {(): values}
+        return [(self.name, key, (), value) for key, value in values.items()]
+
+class Histogram(_Metric):
+    """累积分桶直方图"""
+    type_name = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DURATION_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = {"counts": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state["counts"][i] += 1
+                    break
+            state["sum"] += value
+            state["count"] += 1
+
+    def _samples(self):
+        samples = []
+        for key, state in self._values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets, state["counts"]):
+                cumulative += count
+                samples.append((f"{self.name}_bucket", key, (("le", _format_value(bound)),), cumulative))
+            samples.append((f"{self.name}_sum", key, (), state["sum"]))
+            samples.append((f"{self.name}_count", key, (), state["count"]))
+        return samples
+
+class Registry:
+    """最小化的指标注册表，按Prometheus文本格式输出"""
+
+    def __init__(self):
+        self._metrics = {}
+
+    def register(self, metric):
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self.register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=(), function=None):
+        return self.register(Gauge(name, documentation, labelnames, function))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DURATION_BUCKETS):
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self):
+        return "\n".join(metric.render() for metric in self._metrics.values()) + "\n"
+
+def record_task_metric(section, key, amount):
+    """向当前任务的指标累加器中累加一个值，不在任务上下文中时忽略"""
+    metrics = task_metrics.get()
+    if metrics is not None:
+        values = metrics.setdefault(section, {})
+        values[key] = round(values.get(key, 0) + amount, 6)
+
+def record_stage_bytes(stage, size):
+    """记录阶段产出的字节数，同时写入当前任务的指标"""
+    stage_bytes.observe(size, stage=stage)
+    record_task_metric("stage_bytes", stage, size)
+
+# 创建单例
+registry = Registry()
+
+stage_duration = registry.histogram(
+    "video_stage_duration_seconds", "各流水线阶段的耗时", ["stage"])
+stage_bytes = registry.histogram(
+    "video_stage_bytes", "各流水线阶段产出的字节数", ["stage"], buckets=BYTES_BUCKETS)
+stage_in_flight = registry.gauge(
+    "video_stage_in_flight", "正在执行的流水线阶段数", ["stage"])
+stage_errors = registry.counter(
+    "video_stage_errors_total", "各流水线阶段的失败次数", ["stage"])
+queue_wait = registry.histogram(
+    "video_queue_wait_seconds", "任务在调度队列中的等待时间")
+task_duration = registry.histogram(
+    "video_task_duration_seconds", "任务从开始执行到结束的总耗时", ["status"])
+tasks_finished = registry.counter(
+    "video_tasks_total", "已结束的任务数", ["status"])
+ffmpeg_cpu = registry.counter(
+    "ffmpeg_cpu_seconds_total", "ffmpeg进程消耗的CPU时间(用户态+内核态)", ["stage"])
+ffmpeg_runs = registry.counter(
+    "ffmpeg_runs_total", "ffmpeg/ffprobe进程执行次数", ["stage", "result"])
+download_retried_bytes = registry.counter(
+    "video_download_retried_bytes_total", "下载重试时重新传输的字节数")
+submissions = registry.counter(
+    "video_submissions_total", "提交请求数及合并到已有任务的请求数", ["kind"])
@@ -0,0 +1,91 @@
+import asyncio
+import time
+import logging
+from app.services import metrics
+
+# 配置日志
+logger = logging.getLogger("pipeline")
+
+class Pipeline:
+    """由若干阶段组成的小型依赖图，没有依赖关系的阶段并发执行"""
+
+    def __init__(self, name="pipeline", on_stage=None):
+        """
+        Args:
+            name: 流水线名称，用于日志和任务命名
+            on_stage: 可选回调 on_stage(阶段名, 状态)，状态为 running/done/failed
+        """
+        self.name = name
+        self.on_stage = on_stage
+        self.stages = {}
+        # 各阶段耗时，格式: {阶段名: {"start": 相对开始时间(秒), "duration": 耗时(秒)}}
+        self.timings = {}
+
+    def add_stage(self, name, func, deps=()):
+        """
+        添加一个阶段
+
+        Args:
+            name: 阶段名称
+            func: 异步函数，接收已完成依赖阶段的结果字典 {阶段名: 结果}
+            deps: 依赖的阶段名称列表
+        """
+        for dep in deps:
+            if dep not in self.stages:
+                raise ValueError(f"阶段 {name} 依赖的阶段 {dep} 不存在")
+        self.stages[name] = (func, tuple(deps))
+        return self
+
+    def _emit(self, name, state):
+        if self.on_stage is not None:
+            try:
+                self.on_stage(name, state)
+            except Exception as e:
+                logger.warning(f"阶段状态回调执行失败: {str(e)}")
+
+    async def run(self):
+        """执行所有阶段，返回 {阶段名: 结果}；任一阶段失败时取消其余阶段并抛出该异常"""
+        started = time.monotonic()
+        stage_tasks = {}
+
+        async def run_stage(name, func, deps):
+            dep_results = {}
+            for dep in deps:
+                dep_results[dep] = await stage_tasks[dep]
+            stage_start = time.monotonic()
+            # 阶段任务内的ffmpeg调用按该阶段归集CPU时间
+            metrics.current_stage.set(name)
+            metrics.stage_in_flight.inc(stage=name)
+            self._emit(name, "running")
+            try:
+                result = await func(dep_results)
+                self._emit(name, "done")
+                return result
+            except Exception:
+                metrics.stage_errors.inc(stage=name)
+                self._emit(name, "failed")
+                raise
+            finally:
+                duration = time.monotonic() - stage_start
+                metrics.stage_in_flight.dec(stage=name)
+                metrics.stage_duration.observe(duration, stage=name)
+                self.timings[name] = {
+                    "start": round(stage_start - started, 3),
+                    "duration": round(duration, 3)
+                }
+
+        # 按添加顺序创建任务，依赖总是先于被依赖者添加
+        for name, (func, deps) in self.stages.items():
+            stage_tasks[name] = asyncio.create_task(run_stage(name, func, deps), name=f"{self.name}:{name}")
+
+        try:
+            await asyncio.gather(*stage_tasks.values())
+        except BaseException:
+            for task in stage_tasks.values():
+                task.cancel()
+            await asyncio.gather(*stage_tasks.values(), return_exceptions=True)
+            raise
+        finally:
+            self.timings["total"] = {"start": 0.0, "duration": round(time.monotonic() - started, 3)}
+
+        return {name: task.result() for name, task in stage_tasks.items()}
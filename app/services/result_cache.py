@@ -0,0 +1,161 @@
+import os
+import json
+import time
+import hashlib
+import logging
+from collections import OrderedDict
+import aiohttp
+from app.core.config import settings
+from app.services.backend import backend
+from app.services.downloader import downloader
+
+# 配置日志
+logger = logging.getLogger("result_cache")
+
+async def fetch_source_validators(url):
+    """
+    通过HEAD请求获取源文件的校验信息(ETag/Last-Modified/Content-Length)
+
+    Returns:
+        校验信息字典，服务端不支持HEAD或没有返回任何校验信息时返回空字典
+    """
+    try:
+        timeout = aiohttp.ClientTimeout(total=settings.SOURCE_HEAD_TIMEOUT)
+        # 复用下载器的连接池，批量提交时不必为每个任务重新建立连接
+        async with downloader.session().head(url, allow_redirects=True, timeout=timeout) as response:
+            if response.status != 200:
+                logger.warning(f"获取源文件信息失败，HTTP状态码: {response.status}")
+                return {}
+            validators = {
+                "etag": response.headers.get("ETag"),
+                "last_modified": response.headers.get("Last-Modified"),
+                "content_length": response.headers.get("Content-Length")
+            }
+            return {k: v for k, v in validators.items() if v}
+    except Exception as e:
+        logger.warning(f"获取源文件信息失败: {str(e)}")
+        return {}
+
+def identifies_content(validators):
+    """
+    校验信息能否标识源文件内容：需要ETag或Last-Modified
+
+    只有Content-Length时，源文件被同样大小的文件原地替换后无法区分，不能据此复用结果；
+    Content-Length仍作为缓存键的一部分
+    """
+    return bool(validators.get("etag") or validators.get("last_modified"))
+
+class ResultCache:
+    """
+    以源文件URL、校验信息和帧参数为键的处理结果缓存
+
+    缓存只维护索引，不直接删除文件：被淘汰的条目不再命中，其任务目录由
+    VideoProcessor._cleanup_old_files 在保留期过后按最后访问时间清理，
+    因此刚刚命中返回的文件不会被删除。
+    """
+
+    def __init__(self):
+        self.index_path = os.path.join(settings.TEMP_DIR, "_result_cache.json")
+        # key -> {"task_id", "result", "size_bytes"}，按最近使用顺序排列
+        self.entries = OrderedDict()
+        # task_id -> 引用该任务的缓存键集合
+        self.task_keys = {}
+        self.total_bytes = 0
+
+    @staticmethod
+    def make_key(url, validators, params):
+        """根据URL、源文件校验信息和处理参数生成缓存键"""
+        payload = json.dumps(
+            {"url": url, "validators": validators, "params": params},
+            sort_keys=True, ensure_ascii=False
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def load(self):
+        """从磁盘加载缓存索引，丢弃任务目录已不存在的条目；由 VideoProcessor 启动预热时在后台线程中调用"""
+        # 共享后端下每个工作进程使用各自的索引文件，只引用本进程完成的任务
+        self.index_path = os.path.join(backend.state_dir(), "_result_cache.json")
+        if not os.path.exists(self.index_path):
+            return
+        try:
+            with open(self.index_path, 'r', encoding='utf-8') as f:
+                for key, entry in json.load(f):
+                    if os.path.isdir(os.path.join(settings.TEMP_DIR, entry["task_id"])):
+                        self._add(key, entry)
+            logger.info(f"成功加载了 {len(self.entries)} 个结果缓存条目")
+        except Exception as e:
+            logger.error(f"加载结果缓存索引失败: {str(e)}")
+
+    def _save(self):
+        """将缓存索引保存到磁盘"""
+        try:
+            tmp_path = self.index_path + ".tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(list(self.entries.items()), f, ensure_ascii=False)
+            os.replace(tmp_path, self.index_path)
+        except Exception as e:
+            logger.error(f"保存结果缓存索引失败: {str(e)}")
+
+    def get(self, key):
+        """查询缓存，命中时返回条目并标记为最近使用"""
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        if not os.path.isdir(os.path.join(settings.TEMP_DIR, entry["task_id"])):
+            # 文件已被清理，条目失效
+            self._remove(key)
+            self._save()
+            return None
+        entry["last_hit"] = time.time()
+        self.entries.move_to_end(key)
+        return entry
+
+    def put(self, key, task_id, result, size_bytes):
+        """写入缓存条目，并按条目数和字节预算淘汰最久未使用的条目"""
+        if key in self.entries:
+            self._remove(key)
+        self._add(key, {
+            "task_id": task_id,
+            "result": result,
+            "size_bytes": size_bytes,
+            "last_hit": time.time()
+        })
+        self._evict()
+        self._save()
+
+    def holds(self, task_id):
+        """任务目录是否仍被缓存引用，被引用的目录不应被定期清理删除"""
+        return task_id in self.task_keys
+
+    def discard(self, task_id):
+        """移除引用指定任务的缓存条目"""
+        keys = list(self.task_keys.get(task_id, ()))
+        for key in keys:
+            self._remove(key)
+        if keys:
+            self._save()
+
+    def _add(self, key, entry):
+        self.entries[key] = entry
+        self.task_keys.setdefault(entry["task_id"], set()).add(key)
+        self.total_bytes += entry.get("size_bytes", 0)
+
+    def _remove(self, key):
+        entry = self.entries.pop(key)
+        keys = self.task_keys.get(entry["task_id"])
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self.task_keys[entry["task_id"]]
+        self.total_bytes -= entry.get("size_bytes", 0)
+
+    def _evict(self):
+        max_bytes = settings.RESULT_CACHE_MAX_MB * 1024 * 1024
+        while self.entries and (len(self.entries) > settings.RESULT_CACHE_MAX_ENTRIES or
+                                self.total_bytes > max_bytes):
+            key, entry = next(iter(self.entries.items()))
+            self._remove(key)
+            logger.info(f"结果缓存淘汰任务 {entry['task_id']}, 当前缓存占用: {self.total_bytes / (1024 * 1024):.2f}MB")
+
+# 创建单例
+result_cache = ResultCache()
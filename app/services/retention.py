@@ -0,0 +1,70 @@
+import heapq
+import logging
+from collections import OrderedDict
+
+# 配置日志
+logger = logging.getLogger("retention")
+
+class RetentionIndex:
+    """
+    已结束任务的过期索引
+
+    - 按过期时间组织的最小堆，每次清理只弹出已到期的条目，不再遍历全部任务
+    - 按最后使用时间排序的任务大小表，用于磁盘配额超限时从最久未使用的任务开始淘汰
+    任务被再次访问时直接压入新的堆条目，旧条目在弹出时按最后使用时间识别并丢弃
+    """
+
+    def __init__(self, retention_seconds):
+        self.retention_seconds = retention_seconds
+        self._heap = []
+        # {task_id: 最后使用时间戳}
+        self._last_used = {}
+        # {task_id: 任务目录字节数}，按最后使用时间从旧到新排列
+        self._sizes = OrderedDict()
+        self.total_bytes = 0
+
+    def __len__(self):
+        return len(self._last_used)
+
+    def __contains__(self, task_id):
+        return task_id in self._last_used
+
+    def size_of(self, task_id):
+        return self._sizes.get(task_id, 0)
+
+    def track(self, task_id, last_used, size_bytes=0):
+        """登记或刷新任务的最后使用时间和大小"""
+        self._last_used[task_id] = last_used
+        heapq.heappush(self._heap, (last_used + self.retention_seconds, task_id))
+        self.total_bytes += (size_bytes or 0) - self._sizes.pop(task_id, 0)
+        self._sizes[task_id] = size_bytes or 0
+
+    def defer(self, task_id, now):
+        """暂不清理该任务(如仍被结果缓存引用)，一个保留期后再检查"""
+        if task_id in self._last_used:
+            heapq.heappush(self._heap, (now + self.retention_seconds, task_id))
+
+    def forget(self, task_id):
+        """移除任务，堆中残留的条目在弹出时丢弃"""
+        self._last_used.pop(task_id, None)
+        self.total_bytes -= self._sizes.pop(task_id, 0)
+
+    def pop_expired(self, now):
+        """弹出所有已到期的任务ID"""
+        expired = []
+        while self._heap and self._heap[0][0] <= now:
+            expires_at, task_id = heapq.heappop(self._heap)
+            last_used = self._last_used.get(task_id)
+            # 已移除或之后又被访问过的旧条目
+            if last_used is None or last_used + self.retention_seconds > now:
+                continue
+            expired.append(task_id)
+        return expired
+
+    def next_expiry(self):
+        """最近一个条目的过期时间戳，没有条目时返回None"""
+        return self._heap[0][0] if self._heap else None
+
+    def oldest(self):
+        """按最后使用时间从旧到新返回任务ID"""
+        return list(self._sizes)
@@ -0,0 +1,170 @@
+import asyncio
+import itertools
+import time
+import logging
+from collections import deque
+from contextlib import asynccontextmanager
+from app.core.config import settings
+
+# 配置日志
+logger = logging.getLogger("scheduler")
+
+class QueueFullError(Exception):
+    """等待队列已满，调用方应稍后重试"""
+
+class Ticket:
+    """一个排队中的任务，被调度执行时 ready 被设置"""
+
+    def __init__(self, seq, client_id, priority, cost):
+        self.seq = seq
+        self.client_id = client_id
+        self.priority = priority
+        self.cost = cost
+        self.enqueued_at = time.monotonic()
+        self.wait_seconds = None
+        self.ready = asyncio.Event()
+
+class JobScheduler:
+    """
+    有界优先级队列和工作者调度，替代全局信号量
+
+    每次有工作者空闲时按以下规则挑选下一个任务:
+    1. 优先级(数值越大越优先)
+    2. 同优先级内选择累计已分配成本最少的提交方(API Key)，避免单个提交方占满工作者
+    3. 该提交方的任务中选择等待加权后成本最小的任务，短任务不会被长任务堵住，
+       长任务的有效成本随等待时间下降，也不会被一直饿死
+    """
+
+    def __init__(self, max_workers, max_queue):
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self._queue = []
+        self._seq = itertools.count()
+        self._running = 0
+        # 每个提交方累计已分配的成本
+        self._client_service = {}
+        # 统计信息
+        self._submitted = 0
+        self._rejected = 0
+        self._started = 0
+        self._completed = 0
+        self._recent_waits = deque(maxlen=1000)
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+
+    @property
+    def queue_depth(self):
+        return len(self._queue)
+
+    @property
+    def running(self):
+        return self._running
+
+    def check_capacity(self):
+        """工作者全部占用且等待队列已满时抛出 QueueFullError，提交方可以在准备任务之前先检查"""
+        if self._running >= self.max_workers and len(self._queue) >= self.max_queue:
+            self._rejected += 1
+            raise QueueFullError(f"任务队列已满({self.max_queue})，请稍后重试")
+
+    def enqueue(self, priority=0, client_id="default", cost=1.0):
+        """
+        登记一个任务，队列已满时抛出 QueueFullError
+
+        Args:
+            priority: 优先级，数值越大越先执行
+            client_id: 提交方标识，用于公平调度
+            cost: 预估成本(媒体时长秒数)，越小越先执行
+        """
+        self.check_capacity()
+
+        if client_id not in self._client_service:
+            # 新提交方从当前最小累计成本起步，避免凭借零累计成本长期插队
+            self._client_service[client_id] = min(self._client_service.values(), default=0.0)
+
+        ticket = Ticket(next(self._seq), client_id, priority, max(cost, 1.0))
+        self._queue.append(ticket)
+        self._submitted += 1
+        self._dispatch()
+        return ticket
+
+    @asynccontextmanager
+    async def run(self, ticket):
+        """等待任务被调度后占用一个工作者，退出时释放并调度下一个任务"""
+        try:
+            await ticket.ready.wait()
+        except asyncio.CancelledError:
+            if ticket.ready.is_set():
+                self._release()
+            else:
+                self._queue.remove(ticket)
+            raise
+        try:
+            yield ticket
+        finally:
+            self._completed += 1
+            self._release()
+
+    def _pick(self):
+        """按优先级、提交方公平性和等待加权成本挑选下一个任务"""
+        now = time.monotonic()
+        top_priority = max(ticket.priority for ticket in self._queue)
+        candidates = [ticket for ticket in self._queue if ticket.priority == top_priority]
+        client_id = min(
+            {ticket.client_id for ticket in candidates},
+            key=lambda client: self._client_service[client]
+        )
+
+        def effective_cost(ticket):
+            waited = now - ticket.enqueued_at
+            return (ticket.cost / (1 + waited / settings.SCHEDULER_AGING_SECONDS), ticket.seq)
+
+        return min((ticket for ticket in candidates if ticket.client_id == client_id), key=effective_cost)
+
+    def _dispatch(self):
+        while self._queue and self._running < self.max_workers:
+            ticket = self._pick()
+            self._queue.remove(ticket)
+            self._start(ticket)
+
+    def _start(self, ticket):
+        self._running += 1
+        self._started += 1
+        self._client_service[ticket.client_id] += ticket.cost
+        ticket.wait_seconds = time.monotonic() - ticket.enqueued_at
+        self._recent_waits.append(ticket.wait_seconds)
+        self._wait_total += ticket.wait_seconds
+        self._wait_max = max(self._wait_max, ticket.wait_seconds)
+        ticket.ready.set()
+
+    def _release(self):
+        self._running -= 1
+        self._dispatch()
+
+    def stats(self):
+        """返回队列深度、执行中任务数和等待时间统计"""
+        waits = sorted(self._recent_waits)
+
+        def percentile(p):
+            if not waits:
+                return 0.0
+            return round(waits[min(len(waits) - 1, int(len(waits) * p))], 3)
+
+        return {
+            "queue_depth": self.queue_depth,
+            "queue_capacity": self.max_queue,
+            "running": self._running,
+            "max_workers": self.max_workers,
+            "submitted": self._submitted,
+            "rejected": self._rejected,
+            "completed": self._completed,
+            "wait_seconds": {
+                "avg": round(self._wait_total / self._started, 3) if self._started else 0.0,
+                "max": round(self._wait_max, 3),
+                "p50": percentile(0.5),
+                "p95": percentile(0.95),
+                "p99": percentile(0.99)
+            }
+        }
+
+# 创建单例
+scheduler = JobScheduler(settings.MAX_CONCURRENT_TASKS, settings.MAX_QUEUED_TASKS)
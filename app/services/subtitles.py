@@ -0,0 +1,123 @@
+import os
+import json
+import bisect
+
+# 带时间戳的转录文件，相对任务目录
+SEGMENTS_FILE = "transcript.jsonl"
+SRT_FILE = "transcript.srt"
+VTT_FILE = "transcript.vtt"
+
+def _field(segment, name):
+    # openai客户端返回对象，直接请求接口返回字典
+    return segment.get(name) if isinstance(segment, dict) else getattr(segment, name, None)
+
+def normalize_segments(raw_segments, offset=0.0):
+    """
+    将ASR返回的分句统一为 [{"start", "end", "text"}]，时间加上偏移量(秒)，丢弃空文本
+
+    Args:
+        raw_segments: verbose_json响应中的segments，可以是字典或对象
+        offset: 分段识别时该段音频在整段音频中的起始时间
+    """
+    segments = []
+    for segment in raw_segments or []:
+        text = (_field(segment, "text") or "").strip()
+        if not text:
+            continue
+        start = float(_field(segment, "start") or 0.0) + offset
+        end = max(float(_field(segment, "end") or 0.0) + offset, start)
+        segments.append({"start": round(start, 3), "end": round(end, 3), "text": text})
+    return segments
+
+def original_time(time_sec, kept_ranges, is_start=False):
+    """
+    将裁剪静音后音频上的时间映射回原音频时间
+
+    Args:
+        kept_ranges: 按时间排序的保留区间[(开始秒, 结束秒)]
+        is_start: 分句开始时间正好落在两个区间的拼接点时映射到后一个区间的开头，结束时间映射到前一个区间的结尾
+    """
+    offset = 0.0
+    for start, end in kept_ranges:
+        length = end - start
+        if time_sec < offset + length or (not is_start and time_sec == offset + length):
+            return start + max(time_sec - offset, 0.0)
+        offset += length
+    # 超出裁剪后总时长(ASR时间戳的舍入误差)时落在最后一个区间的结尾
+    return kept_ranges[-1][1] if kept_ranges else time_sec
+
+def remap_segments(segments, kept_ranges):
+    """将分句时间从裁剪静音后的音频映射回原音频，跨越裁剪点的分句结束时间落在后面的区间中"""
+    return [
+        dict(segment, start=round(original_time(segment["start"], kept_ranges, is_start=True), 3),
+             end=round(original_time(segment["end"], kept_ranges), 3))
+        for segment in segments
+    ]
+
+def dumps_segments(segments):
+    """序列化为JSON Lines，每行一个分句"""
+    return "".join(json.dumps(segment, ensure_ascii=False) + "\n" for segment in segments)
+
+def loads_segments(data):
+    return [json.loads(line) for line in data.splitlines() if line.strip()]
+
+def _timestamp(seconds, separator):
+    millis = int(round(seconds * 1000))
+    hours, millis = divmod(millis, 3600000)
+    minutes, millis = divmod(millis, 60000)
+    secs, millis = divmod(millis, 1000)
+    return f"{hours:02d}:{minutes:02d}:{secs:02d}{separator}{millis:03d}"
+
+def to_srt(segments):
+    blocks = [
+        f"{i}\n{_timestamp(s['start'], ',')} --> {_timestamp(s['end'], ',')}\n{s['text']}\n"
+        for i, s in enumerate(segments, 1)
+    ]
+    return "\n".join(blocks)
+
+def to_vtt(segments):
+    blocks = [f"{_timestamp(s['start'], '.')} --> {_timestamp(s['end'], '.')}\n{s['text']}\n" for s in segments]
+    return "WEBVTT\n\n" + "\n".join(blocks)
+
+def write_segment_files(output_dir, segments):
+    """写出 transcript.jsonl / transcript.srt / transcript.vtt，返回写出的文件路径"""
+    paths = []
+    for name, content in ((SEGMENTS_FILE, dumps_segments(segments)), (SRT_FILE, to_srt(segments)),
+                          (VTT_FILE, to_vtt(segments))):
+        path = os.path.join(output_dir, name)
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(content)
+        paths.append(path)
+    return paths
+
+def frame_windows(frame_times, segments, window_seconds, duration=None):
+    """
+    为每个帧时间点取出前后各 window_seconds/2 秒内的分句，下游按帧调用模型时只需带上对应的文本
+
+    分句按开始时间有序，二分查找后只扫描窗口附近的分句。
+
+    Args:
+        duration: 视频时长(秒)，窗口和分句结束时间不超过该时长；None时不限制
+
+    Returns:
+        与帧一一对应的 [{"time", "start", "end", "text"}]，窗口内没有分句时text为空字符串
+    """
+    half = window_seconds / 2
+    limit = float(duration) if duration else float("inf")
+    starts = [segment["start"] for segment in segments]
+    # 分句最长持续时间，用于确定需要向前回看多远
+    longest = max((segment["end"] - segment["start"] for segment in segments), default=0.0)
+    windows = []
+    for time_sec in frame_times:
+        low, high = max(time_sec - half, 0.0), min(time_sec + half, limit)
+        first = bisect.bisect_left(starts, low - longest)
+        last = bisect.bisect_right(starts, high)
+        selected = [s for s in segments[first:last] if s["end"] >= low and s["start"] <= high]
+        windows.append({
+            "time": round(float(time_sec), 3),
+            "start": selected[0]["start"] if selected else round(low, 3),
+            # ASR时间戳的舍入误差可能使最后一句略超出视频时长
+            "end": round(min(max(s["end"] for s in selected), limit), 3) if selected else round(high, 3),
+            "text": " ".join(s["text"] for s in selected)
+        })
+    return windows
@@ -0,0 +1,416 @@
+import os
+import json
+import sqlite3
+import asyncio
+import logging
+import threading
+from datetime import datetime
+from app.core.config import settings
+from app.services import ffmpeg_runner
+
+# 配置日志
+logger = logging.getLogger("task_store")
+
+# 任务记录中以ISO字符串形式持久化的时间字段
+DATETIME_FIELDS = ("created_at", "last_accessed_at")
+
+# 任务状态，RedisTaskStore 按状态维护索引
+TASK_STATUSES = ("queued", "processing", "completed", "failed")
+
+# 迁移旧版JSON记录时每批写入的条数
+_IMPORT_BATCH_SIZE = 500
+
+def _encode(task_info):
+    """将任务信息序列化为JSON，datetime转换为ISO格式字符串"""
+    task_data = task_info.copy()
+    for field in DATETIME_FIELDS:
+        if isinstance(task_data.get(field), datetime):
+            task_data[field] = task_data[field].isoformat()
+    return json.dumps(task_data, ensure_ascii=False)
+
+def _decode(data):
+    """反序列化任务信息，ISO格式字符串转换为datetime"""
+    task_info = json.loads(data)
+    for field in DATETIME_FIELDS:
+        if isinstance(task_info.get(field), str):
+            task_info[field] = datetime.fromisoformat(task_info[field])
+    return task_info
+
+def _iso(value):
+    return value.isoformat() if isinstance(value, datetime) else value
+
+def _row(task_id, task_info):
+    """生成写入tasks表的一行，索引列从任务信息中提取"""
+    return (task_id, task_info.get("status", ""), _iso(task_info.get("created_at")),
+            _iso(task_info.get("last_accessed_at")), task_info.get("size_bytes"), _encode(task_info))
+
+_UPSERT_COLUMNS = "(task_id, status, created_at, last_accessed_at, size_bytes, data) VALUES (?, ?, ?, ?, ?, ?)"
+
+class TaskStore:
+    """
+    任务记录存储的公共部分
+
+    - 写入先进入内存缓冲，同一任务的多次更新合并，定时在CPU线程池中批量提交
+    - 读取时优先返回缓冲中尚未提交的记录，迁移完成前回退到旧版JSON记录目录
+    - 存储访问是阻塞的磁盘或网络IO，事件循环中通过 aget 读取，不直接调用 get
+    具体存储由子类实现: SqliteTaskStore(单机) / RedisTaskStore(多机共享)
+    """
+
+    def __init__(self, legacy_dir=None):
+        """
+        Args:
+            legacy_dir: 旧版JSON任务记录目录，迁移完成前读取时回退到该目录
+        """
+        self.legacy_dir = legacy_dir
+        self._lock = threading.RLock()
+        # 待写入的任务 {task_id: 任务信息}，None 表示待删除
+        self._pending = {}
+        self._flush_handle = None
+
+    def get(self, task_id):
+        """读取任务信息，不存在时返回None"""
+        with self._lock:
+            if task_id in self._pending:
+                return self._pending[task_id]
+            data = self._read(task_id)
+        if data is not None:
+            return _decode(data)
+        return self._read_legacy(task_id)
+
+    async def aget(self, task_id):
+        """在事件循环中读取任务信息，缓冲中没有时在CPU线程池中查询存储"""
+        with self._lock:
+            if task_id in self._pending:
+                return self._pending[task_id]
+        return await ffmpeg_runner.run_cpu(self.get, task_id)
+
+    async def aflush(self):
+        """在事件循环中提交缓冲中的变更"""
+        await ffmpeg_runner.run_cpu(self.flush)
+
+    def save(self, task_id, task_info):
+        """登记任务信息待写入，在下一次批量提交时落盘"""
+        with self._lock:
+            self._pending[task_id] = task_info
+        self._schedule_flush()
+
+    def delete(self, task_id):
+        """删除任务记录"""
+        with self._lock:
+            self._pending[task_id] = None
+        self._schedule_flush()
+
+    def _schedule_flush(self):
+        if self._flush_handle is not None:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            # 不在事件循环中(如迁移线程)时直接写入
+            self.flush()
+            return
+        self._flush_handle = loop.call_later(settings.TASK_STORE_FLUSH_MS / 1000, self._flush_in_executor)
+
+    def _flush_in_executor(self):
+        # 提交期间产生的新变更在本次提交开始前仍会并入，之后的变更重新安排提交
+        asyncio.get_running_loop().run_in_executor(ffmpeg_runner.cpu_executor, self.flush)
+
+    def flush(self):
+        """将缓冲中的所有变更一次性提交"""
+        with self._lock:
+            self._flush_handle = None
+            if not self._pending:
+                return
+            pending, self._pending = self._pending, {}
+            try:
+                self._write(pending)
+            except Exception as e:
+                # 提交失败时放回缓冲，期间产生的新变更优先
+                pending.update(self._pending)
+                self._pending = pending
+                logger.error(f"批量写入任务记录失败: {str(e)}")
+
+    def fail_interrupted(self, message):
+        """服务重启前未完成的任务已无法继续执行，标记为失败"""
+        task_ids = self.ids_by_status(["queued", "processing"])
+        for task_id in task_ids:
+            task_info = self.get(task_id)
+            task_info.update({"status": "failed", "message": message})
+            self.save(task_id, task_info)
+        return len(task_ids)
+
+    def _read_legacy(self, task_id):
+        """迁移完成前从旧版JSON记录目录读取"""
+        if not self.legacy_dir:
+            return None
+        file_path = os.path.join(self.legacy_dir, f"{task_id}.json")
+        try:
+            with open(file_path, 'r', encoding='utf-8') as f:
+                return _decode(f.read())
+        except FileNotFoundError:
+            return None
+
+    def import_legacy(self, interrupted_message=None):
+        """
+        将旧版JSON任务记录分批导入，导入后删除原文件，返回导入数量
+
+        Args:
+            interrupted_message: 若提供，未完成的旧任务导入时标记为失败并使用该消息
+        """
+        if not self.legacy_dir or not os.path.isdir(self.legacy_dir):
+            return 0
+        imported = 0
+        batch = []
+
+        def write_batch():
+            with self._lock:
+                # 已存在的记录(迁移期间被更新过)以存储中的为准
+                self._insert_missing([(task_id, task_info) for task_id, task_info, _ in batch])
+            for _, _, file_path in batch:
+                os.remove(file_path)
+
+        for file_name in os.listdir(self.legacy_dir):
+            if not file_name.endswith('.json'):
+                continue
+            task_id = file_name[:-5]
+            file_path = os.path.join(self.legacy_dir, file_name)
+            try:
+                with open(file_path, 'r', encoding='utf-8') as f:
+                    task_info = _decode(f.read())
+            except Exception as e:
+                logger.error(f"读取旧版任务记录 {task_id} 失败: {str(e)}")
+                continue
+            if interrupted_message and task_info.get("status") in ["queued", "processing"]:
+                task_info.update({"status": "failed", "message": interrupted_message})
+            batch.append((task_id, task_info, file_path))
+            if len(batch) >= _IMPORT_BATCH_SIZE:
+                write_batch()
+                imported += len(batch)
+                batch = []
+        if batch:
+            write_batch()
+            imported += len(batch)
+
+        try:
+            os.rmdir(self.legacy_dir)
+        except OSError:
+            pass
+        return imported
+
+    def close(self):
+        """提交缓冲中的变更并关闭存储"""
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+        self.flush()
+        with self._lock:
+            self._close()
+
+class SqliteTaskStore(TaskStore):
+    """
+    基于SQLite(WAL模式)的任务记录存储，替代每个任务一个JSON文件
+
+    - 按 status 和 created_at 建索引，启动时不加载全部记录，按需查询
+    - 缓冲中的变更在一个事务中提交
+    """
+
+    def __init__(self, db_path, legacy_dir=None):
+        """
+        Args:
+            db_path: 数据库文件路径
+            legacy_dir: 旧版JSON任务记录目录，迁移完成前读取时回退到该目录
+        """
+        super().__init__(legacy_dir)
+        self.db_path = db_path
+        self._conn = None
+
+    def _connection(self):
+        """首次使用时打开数据库并建表"""
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.db_path) or ".", exist_ok=True)
+            # 多个工作进程共用数据库时写事务可能需要等待其他进程提交
+            conn = sqlite3.connect(self.db_path, timeout=30, check_same_thread=False, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS tasks ("
+                "task_id TEXT PRIMARY KEY, "
+                "status TEXT NOT NULL, "
+                "created_at TEXT, "
+                "last_accessed_at TEXT, "
+                "size_bytes INTEGER, "
+                "data TEXT NOT NULL)"
+            )
+            columns = [row[1] for row in conn.execute("PRAGMA table_info(tasks)")]
+            if "size_bytes" not in columns:
+                conn.execute("ALTER TABLE tasks ADD COLUMN size_bytes INTEGER")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_tasks_status ON tasks(status)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_tasks_created_at ON tasks(created_at)")
+            self._conn = conn
+        return self._conn
+
+    def _read(self, task_id):
+        row = self._connection().execute(
+            "SELECT data FROM tasks WHERE task_id = ?", (task_id,)
+        ).fetchone()
+        return row[0] if row is not None else None
+
+    def _write(self, pending):
+        upserts = [_row(task_id, info) for task_id, info in pending.items() if info is not None]
+        deletes = [(task_id,) for task_id, info in pending.items() if info is None]
+        conn = self._connection()
+        try:
+            conn.execute("BEGIN")
+            if upserts:
+                conn.executemany(f"INSERT OR REPLACE INTO tasks {_UPSERT_COLUMNS}", upserts)
+            if deletes:
+                conn.executemany("DELETE FROM tasks WHERE task_id = ?", deletes)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def _insert_missing(self, records):
+        conn = self._connection()
+        conn.execute("BEGIN")
+        conn.executemany(f"INSERT OR IGNORE INTO tasks {_UPSERT_COLUMNS}",
+                         [_row(task_id, task_info) for task_id, task_info in records])
+        conn.execute("COMMIT")
+
+    def ids_by_status(self, statuses):
+        """按状态查询任务ID"""
+        self.flush()
+        placeholders = ",".join("?" * len(statuses))
+        with self._lock:
+            rows = self._connection().execute(
+                f"SELECT task_id FROM tasks WHERE status IN ({placeholders})", tuple(statuses)
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def usage_by_status(self, statuses):
+        """
+        查询指定状态任务的最后使用时间和目录大小，按最后使用时间从旧到新排列
+
+        Returns:
+            [(task_id, 最后使用时间, 字节数)]，只读取索引列，不解析任务数据
+        """
+        self.flush()
+        placeholders = ",".join("?" * len(statuses))
+        with self._lock:
+            rows = self._connection().execute(
+                f"SELECT task_id, COALESCE(last_accessed_at, created_at) AS last_used, size_bytes FROM tasks "
+                f"WHERE status IN ({placeholders}) ORDER BY last_used",
+                tuple(statuses)
+            ).fetchall()
+        return [
+            (task_id, datetime.fromisoformat(last_used) if last_used else datetime.now(), size_bytes or 0)
+            for task_id, last_used, size_bytes in rows
+        ]
+
+    def count(self):
+        """任务记录总数"""
+        self.flush()
+        with self._lock:
+            return self._connection().execute("SELECT COUNT(*) FROM tasks").fetchone()[0]
+
+    def _close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+class RedisTaskStore(TaskStore):
+    """
+    基于Redis的任务记录存储，供多机部署共享
+
+    - 任务数据保存在一个哈希中，按状态分别维护以最后使用时间为分数的有序集合，代替SQLite的索引列
+    - 缓冲中的变更通过一个管道批量提交
+    """
+
+    def __init__(self, client, prefix, legacy_dir=None):
+        """
+        Args:
+            client: Redis客户端(或 backend.LocalRedis 替身)
+            prefix: 键前缀
+            legacy_dir: 旧版JSON任务记录目录，迁移完成前读取时回退到该目录
+        """
+        super().__init__(legacy_dir)
+        self.client = client
+        self.prefix = prefix
+
+    def _key(self, name):
+        return f"{self.prefix}{name}"
+
+    @staticmethod
+    def _last_used(task_info):
+        value = task_info.get("last_accessed_at") or task_info.get("created_at")
+        if isinstance(value, str):
+            value = datetime.fromisoformat(value)
+        return value.timestamp() if isinstance(value, datetime) else 0.0
+
+    def _read(self, task_id):
+        return self.client.hget(self._key("tasks"), task_id)
+
+    def _write(self, pending):
+        pipe = self.client.pipeline(transaction=False)
+        for task_id, task_info in pending.items():
+            # 状态可能变化，先从所有状态集合中移除
+            for status in TASK_STATUSES:
+                pipe.zrem(self._key(f"tasks:{status}"), task_id)
+            if task_info is None:
+                pipe.hdel(self._key("tasks"), task_id)
+                pipe.hdel(self._key("task_sizes"), task_id)
+                continue
+            pipe.hset(self._key("tasks"), task_id, _encode(task_info))
+            pipe.hset(self._key("task_sizes"), task_id, task_info.get("size_bytes") or 0)
+            pipe.zadd(self._key(f"tasks:{task_info.get('status', '')}"), {task_id: self._last_used(task_info)})
+        pipe.execute()
+
+    def _insert_missing(self, records):
+        missing = {task_id: task_info for task_id, task_info in records
+                   if self.client.hget(self._key("tasks"), task_id) is None}
+        if missing:
+            self._write(missing)
+
+    def ids_by_status(self, statuses):
+        """按状态查询任务ID"""
+        self.flush()
+        task_ids = []
+        for status in statuses:
+            task_ids.extend(self.client.zrange(self._key(f"tasks:{status}"), 0, -1))
+        return task_ids
+
+    def usage_by_status(self, statuses):
+        """
+        查询指定状态任务的最后使用时间和目录大小，按最后使用时间从旧到新排列
+
+        Returns:
+            [(task_id, 最后使用时间, 字节数)]，只读取状态集合和大小表，不解析任务数据
+        """
+        self.flush()
+        entries = []
+        for status in statuses:
+            entries.extend(self.client.zrange(self._key(f"tasks:{status}"), 0, -1, withscores=True))
+        entries.sort(key=lambda entry: entry[1])
+        sizes = self.client.hgetall(self._key("task_sizes"))
+        return [
+            (task_id, datetime.fromtimestamp(score) if score else datetime.now(), int(sizes.get(task_id) or 0))
+            for task_id, score in entries
+        ]
+
+    def count(self):
+        """任务记录总数"""
+        self.flush()
+        return self.client.hlen(self._key("tasks"))
+
+    def _close(self):
+        pass
+
+def create_task_store():
+    """按 SHARED_BACKEND 创建任务记录存储，redis 部署时与其他节点共享"""
+    legacy_dir = os.path.join(settings.TEMP_DIR, "_tasks_record")
+    if settings.SHARED_BACKEND == "redis":
+        from app.services.backend import redis_client
+        return RedisTaskStore(redis_client(settings.REDIS_URL), settings.REDIS_PREFIX, legacy_dir=legacy_dir)
+    return SqliteTaskStore(os.path.join(settings.TEMP_DIR, "_tasks.db"), legacy_dir=legacy_dir)
+
+# 创建单例
+task_store = create_task_store()
@@ -0,0 +1,162 @@
+import os
+import json
+import hashlib
+import logging
+from collections import OrderedDict
+from app.core.config import settings
+from app.services.backend import backend
+from app.services.subtitles import dumps_segments, loads_segments
+
+# 配置日志
+logger = logging.getLogger("transcript_cache")
+
+class TranscriptCache:
+    """
+    跨任务复用的转录文本缓存，带时间戳的分句以JSON Lines另存为 <主键>.jsonl
+
+    转录结果只与音频内容和ASR模型有关，与帧参数无关。主键为音频内容哈希+模型名，
+    另外记录源文件指纹(URL+校验信息+模型名)到主键的别名，命中别名时可以连音频提取也省掉。
+    """
+
+    def __init__(self):
+        self.cache_dir = os.path.join(settings.TEMP_DIR, "_transcripts")
+        self.index_path = os.path.join(self.cache_dir, "index.json")
+        # 主键 -> 文本字节数，按最近使用顺序排列
+        self.entries = OrderedDict()
+        # 别名(源文件指纹) -> 主键
+        self.aliases = {}
+        self.total_bytes = 0
+
+    @staticmethod
+    def audio_key(audio_hash, model):
+        """根据音频内容哈希和模型名生成主键"""
+        return hashlib.sha256(f"audio:{audio_hash}:{model}".encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def source_key(url, validators, model):
+        """根据源文件URL、校验信息和模型名生成别名键"""
+        payload = json.dumps({"url": url, "validators": validators, "model": model}, sort_keys=True)
+        return hashlib.sha256(f"source:{payload}".encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def file_hash(path):
+        """计算文件内容的sha256，按块读取避免占用大量内存"""
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            while True:
+                chunk = f.read(1024 * 1024)
+                if not chunk:
+                    break
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.txt")
+
+    def _segments_path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.jsonl")
+
+    def load(self):
+        """从磁盘加载缓存索引，丢弃文件已不存在的条目；由 VideoProcessor 启动预热时在后台线程中调用"""
+        # 共享后端下每个工作进程使用各自的缓存目录和索引
+        self.cache_dir = os.path.join(backend.state_dir(), "_transcripts")
+        self.index_path = os.path.join(self.cache_dir, "index.json")
+        os.makedirs(self.cache_dir, exist_ok=True)
+        if not os.path.exists(self.index_path):
+            return
+        try:
+            with open(self.index_path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            for key, size in data.get("entries", []):
+                if os.path.exists(self._path(key)):
+                    self.entries[key] = size
+                    self.total_bytes += size
+            self.aliases = {alias: key for alias, key in data.get("aliases", {}).items() if key in self.entries}
+            logger.info(f"成功加载了 {len(self.entries)} 个转录缓存条目")
+        except Exception as e:
+            logger.error(f"加载转录缓存索引失败: {str(e)}")
+
+    def _save(self):
+        """将缓存索引保存到磁盘"""
+        try:
+            tmp_path = self.index_path + ".tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump({"entries": list(self.entries.items()), "aliases": self.aliases}, f)
+            os.replace(tmp_path, self.index_path)
+        except Exception as e:
+            logger.error(f"保存转录缓存索引失败: {str(e)}")
+
+    def get(self, key):
+        """
+        按主键或别名查询转录结果，未命中返回None
+
+        Returns:
+            {"text": 文本, "segments": 分句}，没有保存分句的旧条目segments为空列表
+        """
+        key = self.aliases.get(key, key)
+        if key not in self.entries:
+            return None
+        try:
+            with open(self._path(key), 'r', encoding='utf-8') as f:
+                transcript = f.read()
+            segments = []
+            if os.path.exists(self._segments_path(key)):
+                with open(self._segments_path(key), 'r', encoding='utf-8') as f:
+                    segments = loads_segments(f.read())
+        except (OSError, ValueError):
+            self._remove(key)
+            self._save()
+            return None
+        self.entries.move_to_end(key)
+        return {"text": transcript, "segments": segments}
+
+    def put(self, key, transcription, aliases=()):
+        """写入转录结果，并按字节预算淘汰最久未使用的条目"""
+        try:
+            data = transcription["text"].encode("utf-8")
+            with open(self._path(key), 'wb') as f:
+                f.write(data)
+            size = len(data)
+            if transcription["segments"]:
+                segments_data = dumps_segments(transcription["segments"]).encode("utf-8")
+                with open(self._segments_path(key), 'wb') as f:
+                    f.write(segments_data)
+                size += len(segments_data)
+            elif os.path.exists(self._segments_path(key)):
+                os.remove(self._segments_path(key))
+        except OSError as e:
+            logger.error(f"写入转录缓存失败: {str(e)}")
+            return
+        if key in self.entries:
+            self.total_bytes -= self.entries.pop(key)
+        self.entries[key] = size
+        self.total_bytes += size
+        for alias in aliases:
+            self.aliases[alias] = key
+        self._evict()
+        self._save()
+
+    def add_alias(self, alias, key):
+        """为已有条目添加别名"""
+        if key in self.entries:
+            self.aliases[alias] = key
+            self._save()
+
+    def _remove(self, key):
+        self.total_bytes -= self.entries.pop(key, 0)
+        self.aliases = {alias: k for alias, k in self.aliases.items() if k != key}
+        for path in (self._path(key), self._segments_path(key)):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def _evict(self):
+        max_bytes = settings.TRANSCRIPT_CACHE_MAX_MB * 1024 * 1024
+        while len(self.entries) > 1 and self.total_bytes > max_bytes:
+            key = next(iter(self.entries))
+            self._remove(key)
+            logger.info(f"转录缓存淘汰条目 {key}, 当前缓存占用: {self.total_bytes / (1024 * 1024):.2f}MB")
+
+# 创建单例
+transcript_cache = TranscriptCache()
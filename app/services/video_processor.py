@@ -1,148 +1,298 @@
 import os
+import re
 import asyncio
-import aiohttp
 import uuid
 import time
 import logging
 import json
+import hashlib
 from datetime import datetime, timedelta
 import shutil
 from pathlib import Path
 import ffmpeg
-import openai
 from tenacity import retry, stop_after_attempt, wait_exponential
 from app.core.config import settings
-from app.services.asr_service import asr_service  # 导入ASR服务
+from app.services.asr_service import asr_service, parse_silences  # 导入ASR服务
+from app.services.pipeline import Pipeline
+from app.services.result_cache import result_cache, fetch_source_validators, identifies_content
+from app.services.transcript_cache import transcript_cache
+from app.services.scheduler import scheduler, QueueFullError
+from app.services.task_store import task_store
+from app.services.retention import RetentionIndex
+from app.services.downloader import downloader
+from app.services.backend import backend
+from app.services.artifacts import write_precompressed
+from app.services.subtitles import (
+    SEGMENTS_FILE, SRT_FILE, VTT_FILE, write_segment_files, frame_windows, original_time, remap_segments
+)
+from app.services import ffmpeg_runner
+from app.services import metrics
 
 # 配置日志
 logging.basicConfig(level=logging.INFO, 
                     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger("video_processor")
 
-# 信号量控制并发
-semaphore = asyncio.Semaphore(settings.MAX_CONCURRENT_TASKS)
-
-# 存储任务状态
+# 未结束(排队中/处理中)任务的状态，已结束的任务只保存在任务存储中
 tasks = {}
 
+def _input_options(source):
+    """返回ffmpeg/ffprobe读取该输入所需的参数，远程URL开启断线重连和读写超时"""
+    if source.startswith(("http://", "https://")):
+        return {
+            "reconnect": 1,
+            "reconnect_streamed": 1,
+            "reconnect_delay_max": 5,
+            "rw_timeout": settings.DOWNLOAD_TIMEOUT * 1000000
+        }
+    return {}
+
+# 解析关键帧选择时metadata过滤器输出的时间戳和场景变化分数
+_PTS_TIME_PATTERN = re.compile(r"Parsed_metadata.*pts_time:(\S+)")
+_SCENE_SCORE_PATTERN = re.compile(r"lavfi\.scene_score=([\d.]+)")
+# 解析select模式下showinfo过滤器输出的实际写出帧的时间戳
+_SHOWINFO_PTS_PATTERN = re.compile(r"Parsed_showinfo.*pts_time:(\S+)")
+
+def _dhash(gray):
+    """9x8灰度图的差异哈希：逐行比较相邻像素，得到64位指纹"""
+    bits = 0
+    for row in range(8):
+        for col in range(8):
+            bits = (bits << 1) | (gray[row * 9 + col] > gray[row * 9 + col + 1])
+    return bits
+
+def _hamming(a, b):
+    return bin(a ^ b).count("1")
+
+def _is_duplicate(a, b):
+    """两帧的差异哈希是否近似相同；纯色或低细节画面的哈希为0，不同画面也会相同，不参与比较"""
+    return a != 0 and b != 0 and _hamming(a, b) <= settings.FRAME_DEDUPE_DISTANCE
+
+def frame_output_options(frame_output=None):
+    """合并请求中的帧输出参数和默认配置，返回完整的输出参数"""
+    options = {
+        "max_dimension": settings.FRAME_MAX_DIMENSION or None,
+        "format": settings.FRAME_FORMAT,
+        "quality": settings.FRAME_QUALITY or None,
+        "contact_sheet_columns": None
+    }
+    options.update({key: value for key, value in (frame_output or {}).items() if value is not None})
+    return options
+
+def _apply_frame_output(stream, output_file, options, **kwargs):
+    """在同一个滤镜图中按最大边长缩放(不放大)，并按格式和质量设置编码参数"""
+    if options["max_dimension"]:
+        size = options["max_dimension"]
+        stream = stream.filter(
+            'scale', f"min(iw,{size})", f"min(ih,{size})", force_original_aspect_ratio='decrease'
+        )
+    if options["format"] == "webp":
+        kwargs["vcodec"] = "libwebp"
+        if options["quality"]:
+            kwargs["quality"] = options["quality"]
+    elif options["quality"]:
+        # 将1-100的质量映射为mjpeg的qscale(2最好，31最差)
+        kwargs["q:v"] = round(2 + (100 - options["quality"]) * 29 / 99)
+    return stream.output(output_file, **kwargs)
+
+# 送入ASR的音频格式 -> (扩展名, 编码参数)，统一为16k采样率单声道
+_AUDIO_FORMATS = {
+    "mp3": ("mp3", {"format": "mp3", "acodec": "libmp3lame"}),
+    "flac": ("flac", {"format": "flac", "acodec": "flac"}),
+    "wav": ("wav", {"format": "wav", "acodec": "pcm_s16le"}),
+    "opus": ("ogg", {"format": "ogg", "acodec": "libopus", "application": "voip"}),
+}
+# 直接复制音轨时源音频编码 -> (扩展名, 容器格式)
+_AUDIO_COPY_CONTAINERS = {
+    "aac": ("m4a", "ipod"),
+    "mp3": ("mp3", "mp3"),
+    "opus": ("ogg", "ogg"),
+    "vorbis": ("ogg", "ogg"),
+    "flac": ("flac", "flac"),
+}
+# 裁剪静音时每段语音两端保留的时长(秒)，避免切掉字词的开头和结尾
+_TRIM_PADDING_SECONDS = 0.3
+
+def _audio_encode_options():
+    """按 ASR_AUDIO_FORMAT 返回 (扩展名, ffmpeg输出参数)"""
+    ext, options = _AUDIO_FORMATS.get(settings.ASR_AUDIO_FORMAT, _AUDIO_FORMATS["mp3"])
+    options = dict(options, ar=16000, ac=1)
+    if options["acodec"] == "libopus":
+        options["audio_bitrate"] = f"{settings.ASR_AUDIO_OPUS_KBPS}k"
+    return ext, options
+
+def _speech_ranges(silences, duration):
+    """由静音区间得到需要保留的区间[(开始秒, 结束秒)]，静音两端各保留一小段"""
+    ranges = []
+    cursor = 0.0
+    for start, end in silences:
+        # 开头和结尾的静音整段裁掉
+        cut_start = start + _TRIM_PADDING_SECONDS if start > 0 else 0.0
+        cut_end = end - _TRIM_PADDING_SECONDS if end < duration else duration
+        if cut_end <= cut_start:
+            continue
+        if cut_start > cursor:
+            ranges.append((cursor, cut_start))
+        cursor = max(cursor, cut_end)
+    if cursor < duration:
+        ranges.append((cursor, duration))
+    # 整段都是静音时保留原音频
+    return ranges or [(0.0, duration)]
+
 class VideoProcessor:
     def __init__(self):
         # 确保临时目录存在
         os.makedirs(settings.TEMP_DIR, exist_ok=True)
         
-        # 确保任务记录目录存在
-        self.tasks_record_dir = os.path.join(settings.TEMP_DIR, "_tasks_record")
-        os.makedirs(self.tasks_record_dir, exist_ok=True)
+        # 后台执行中的任务及等待任务状态变化的事件
+        self._jobs = {}
+        self._task_events = {}
+        
+        # 正在提交或执行的任务 {URL和参数的哈希: 任务ID的future}，用于合并相同的并发请求
+        self._in_flight = {}
+        self._flight_requests = 0
+        self._flight_coalesced = 0
+        
+        # 已结束任务的过期索引和磁盘占用
+        self._retention = RetentionIndex(settings.TEMP_FILE_RETENTION_MINUTES * 60)
+        
+        # 导入模块时不读取任务记录也不创建后台任务，由 start() 在事件循环中启动
+        self._warmup = None
+        self._migration = None
+        self._background = []
+        # 不需要等待结果的后台协程(磁盘配额检查等)，保留引用直到结束，避免执行中被垃圾回收
+        self._detached = set()
         
-        # 加载已有任务记录
-        self._load_tasks_from_disk()
+        # 共享后端下从共享队列领取任务，本进程提交了任务或有任务结束时立即唤醒领取循环
+        self._claim_wakeup = asyncio.Event()
+    
+    @property
+    def ready(self):
+        """启动预热是否已完成，未完成时 /readyz 返回503"""
+        return self._warmup is not None and self._warmup.done()
+    
+    def start(self):
+        """
+        在事件循环中启动后台工作，由应用生命周期调用，重复调用无影响
         
-        # 启动定期清理任务
-        asyncio.create_task(self._cleanup_old_files())
+        - 预热：处理服务重启前中断的任务、加载结果缓存和转录缓存索引，在后台线程中执行
+        - 定期清理，共享后端下只有被选为主进程的工作进程执行清理
+        - 共享后端下从共享队列领取任务的循环
+        """
+        if self._warmup is not None:
+            return
+        self._warmup = asyncio.create_task(self._warm_up())
+        self._background.append(asyncio.create_task(self._cleanup_old_files()))
+        if backend.shared:
+            self._background.append(asyncio.create_task(self._coordinate()))
+    
+    async def wait_ready(self):
+        """等待启动预热完成，未经生命周期启动(如直接调用)时在这里启动"""
+        self.start()
+        await asyncio.shield(self._warmup)
+    
+    async def stop(self):
+        """停止后台工作，已提交的任务不在这里等待"""
+        for task in [self._warmup, self._migration] + self._background + list(self._detached):
+            if task is not None and not task.done():
+                task.cancel()
+        await asyncio.gather(*self._background, *self._detached, return_exceptions=True)
+        self._background = []
+    
+    async def _warm_up(self):
+        """启动预热，完成前提交任务会等待，避免新任务被当作中断的任务标记为失败"""
+        started = time.monotonic()
+        await ffmpeg_runner.run_cpu(self._load_tasks)
+        if task_store.legacy_dir and os.path.isdir(task_store.legacy_dir):
+            self._migration = asyncio.create_task(self._migrate_legacy_records())
+        await asyncio.gather(
+            ffmpeg_runner.run_cpu(result_cache.load),
+            ffmpeg_runner.run_cpu(transcript_cache.load)
+        )
+        logger.info(f"启动预热完成，耗时 {time.monotonic() - started:.3f}秒")
+    
+    def _load_tasks(self):
+        """启动时只按状态索引处理中断的任务，其余任务记录在查询时按需读取"""
+        # 共享后端下其他工作进程可能正在执行任务，中断的任务由主进程按心跳超时识别
+        if not backend.shared:
+            try:
+                interrupted = task_store.fail_interrupted("处理失败: 服务重启，任务已中断")
+                if interrupted:
+                    logger.info(f"已将 {interrupted} 个服务重启前未完成的任务标记为失败")
+            except Exception as e:
+                logger.error(f"加载任务记录失败: {str(e)}", exc_info=True)
     
-    def _load_tasks_from_disk(self):
-        """从磁盘加载任务记录"""
+    async def _migrate_legacy_records(self):
+        """将旧版每个任务一个JSON文件的记录导入任务存储"""
         try:
-            logger.info("正在从磁盘加载任务记录...")
-            loaded_count = 0
-            
-            # 遍历任务记录目录中的所有JSON文件
-            for file_name in os.listdir(self.tasks_record_dir):
-                if file_name.endswith('.json'):
-                    task_id = file_name[:-5]  # 去掉.json后缀
-                    file_path = os.path.join(self.tasks_record_dir, file_name)
-                    
-                    try:
-                        with open(file_path, 'r', encoding='utf-8') as f:
-                            task_info = json.load(f)
-                            
-                            # 转换字符串时间为datetime对象
-                            if 'created_at' in task_info and isinstance(task_info['created_at'], str):
-                                task_info['created_at'] = datetime.fromisoformat(task_info['created_at'])
-                            
-                            # 添加到内存中的任务字典
-                            tasks[task_id] = task_info
-                            loaded_count += 1
-                    except Exception as e:
-                        logger.error(f"加载任务记录 {task_id} 失败: {str(e)}")
-            
-            logger.info(f"成功从磁盘加载了 {loaded_count} 个任务记录")
+            logger.info("正在迁移旧版任务记录...")
+            imported = await ffmpeg_runner.run_cpu(task_store.import_legacy, "处理失败: 服务重启，任务已中断")
+            logger.info(f"成功迁移了 {imported} 个旧版任务记录")
         except Exception as e:
-            logger.error(f"加载任务记录失败: {str(e)}", exc_info=True)
+            logger.error(f"迁移旧版任务记录失败: {str(e)}", exc_info=True)
     
-    def _save_task_to_disk(self, task_id, task_info):
-        """将任务信息保存到磁盘"""
+    def _save_task(self, task_id, task_info):
+        """登记任务信息，由任务存储批量写入"""
         try:
-            file_path = os.path.join(self.tasks_record_dir, f"{task_id}.json")
-            
-            # 创建任务信息的副本，避免修改原始数据
-            task_data = task_info.copy()
-            
-            # 将datetime对象转换为ISO格式字符串
-            if 'created_at' in task_data and isinstance(task_data['created_at'], datetime):
-                task_data['created_at'] = task_data['created_at'].isoformat()
-            
-            with open(file_path, 'w', encoding='utf-8') as f:
-                json.dump(task_data, f, ensure_ascii=False, indent=2)
-                
+            task_store.save(task_id, task_info)
             return True
         except Exception as e:
-            logger.error(f"保存任务 {task_id} 到磁盘失败: {str(e)}")
+            logger.error(f"保存任务 {task_id} 失败: {str(e)}")
             return False
     
+    async def _load_retention_index(self):
+        """从任务存储的索引列构建过期索引，缺少大小记录的旧任务在后台线程中统计目录大小"""
+        def load():
+            rows = []
+            for task_id, last_used, size_bytes in task_store.usage_by_status(["completed", "failed"]):
+                if not size_bytes:
+                    size_bytes = self._dir_size(os.path.join(settings.TEMP_DIR, task_id))
+                rows.append((task_id, last_used.timestamp(), size_bytes))
+            return rows
+        
+        for task_id, last_used, size_bytes in await ffmpeg_runner.run_cpu(load):
+            self._retention.track(task_id, last_used, size_bytes)
+        logger.info(f"已加载 {len(self._retention)} 个已结束任务的过期索引, "
+                    f"占用空间: {self._retention.total_bytes / (1024 * 1024):.2f}MB")
+    
     async def _cleanup_old_files(self):
-        """定期清理过期的临时文件"""
+        """定期清理过期的任务，只处理过期索引中已到期的条目"""
+        await self._warmup
+        if self._migration is not None:
+            await self._migration
+        if not backend.shared:
+            try:
+                await self._load_retention_index()
+            except Exception as e:
+                logger.error(f"加载过期索引失败: {str(e)}", exc_info=True)
+        
         while True:
             try:
+                if backend.shared:
+                    if not backend.is_leader and not await ffmpeg_runner.run_cpu(backend.try_lead):
+                        # 非主进程跳过本轮清理，主进程退出后由接替的进程清理
+                        await asyncio.sleep(settings.CLEANUP_INTERVAL_MINUTES * 60)
+                        continue
+                    # 任务可能由任意工作进程完成或访问，每轮从共享的任务存储重建过期索引
+                    self._retention = RetentionIndex(settings.TEMP_FILE_RETENTION_MINUTES * 60)
+                    await self._load_retention_index()
                 logger.info("开始执行定期清理任务...")
-                now = datetime.now()
-                cutoff = now - timedelta(minutes=settings.TEMP_FILE_RETENTION_MINUTES)
-                logger.info(f"清理截止时间: {cutoff.isoformat()}, 将清理早于此时间的任务")
-                
-                # 记录当前任务总数
-                total_tasks = len(tasks)
+                now = time.time()
                 cleaned_tasks = 0
                 
-                for task_id, task_info in list(tasks.items()):
-                    # 只清理已完成或失败的任务，正在处理的任务不清理
-                    if (task_info.get("status") in ["completed", "failed"] and 
-                        task_info.get("created_at") and task_info["created_at"] < cutoff):
-                        
-                        # 记录将被删除的任务信息
-                        task_created_at = task_info["created_at"].isoformat() if isinstance(task_info["created_at"], datetime) else task_info["created_at"]
-                        logger.info(f"发现过期任务: {task_id}, 创建时间: {task_created_at}, 状态: {task_info['status']}")
-                        
-                        # 删除过期任务的文件
-                        task_dir = os.path.join(settings.TEMP_DIR, task_id)
-                        if os.path.exists(task_dir):
-                            # 记录删除前的文件大小
-                            dir_size = sum(os.path.getsize(os.path.join(dirpath, filename)) 
-                                          for dirpath, _, filenames in os.walk(task_dir) 
-                                          for filename in filenames)
-                            dir_size_mb = dir_size / (1024 * 1024)
-                            
-                            shutil.rmtree(task_dir)
-                            logger.info(f"已删除任务目录: {task_dir}, 释放空间: {dir_size_mb:.2f}MB")
-                        else:
-                            logger.warning(f"任务目录不存在: {task_dir}")
-                        
-                        # 从内存中的任务列表中移除
-                        tasks.pop(task_id, None)
-                        
-                        # 删除任务记录文件
-                        task_record_file = os.path.join(self.tasks_record_dir, f"{task_id}.json")
-                        if os.path.exists(task_record_file):
-                            os.remove(task_record_file)
-                            logger.info(f"已删除任务记录文件: {task_record_file}")
-                        
-                        cleaned_tasks += 1
-                        logger.info(f"已从任务列表中移除任务: {task_id}")
+                for task_id in self._retention.pop_expired(now):
+                    # 仍被结果缓存引用的任务由缓存按LRU和容量预算淘汰后再清理
+                    if result_cache.holds(task_id):
+                        self._retention.defer(task_id, now)
+                        continue
+                    await self._remove_task(task_id, "已过期")
+                    cleaned_tasks += 1
+                
+                evicted_tasks = await self._enforce_disk_quota()
                 
                 # 记录清理结果摘要
-                if cleaned_tasks > 0:
-                    logger.info(f"清理任务完成: 共检查 {total_tasks} 个任务, 清理了 {cleaned_tasks} 个过期任务")
-                else:
-                    logger.info(f"清理任务完成: 共检查 {total_tasks} 个任务, 没有发现过期任务")
+                logger.info(f"清理任务完成: 清理了 {cleaned_tasks} 个过期任务, 按磁盘配额淘汰了 {evicted_tasks} 个任务, "
+                            f"剩余 {len(self._retention)} 个任务, 占用空间: {self._retention.total_bytes / (1024 * 1024):.2f}MB")
                     
             except Exception as e:
                 logger.error(f"清理任务执行出错: {str(e)}", exc_info=True)
@@ -154,40 +304,91 @@ class VideoProcessor:
             # 根据配置的分钟数进行休眠
             await asyncio.sleep(settings.CLEANUP_INTERVAL_MINUTES * 60)
     
+    async def _enforce_disk_quota(self, exclude=None):
+        """任务文件总大小超出 TEMP_DIR_MAX_MB 时，从最久未使用的已结束任务开始淘汰"""
+        if settings.TEMP_DIR_MAX_MB <= 0 or not backend.is_leader:
+            return 0
+        budget = settings.TEMP_DIR_MAX_MB * 1024 * 1024
+        evicted = 0
+        for task_id in self._retention.oldest():
+            if self._retention.total_bytes <= budget:
+                break
+            # 刚完成的任务和已被其他清理流程删除的任务跳过
+            if task_id == exclude or task_id not in self._retention:
+                continue
+            # 超出配额时结果缓存引用的任务也一并淘汰
+            result_cache.discard(task_id)
+            await self._remove_task(task_id, "超出磁盘配额")
+            evicted += 1
+        return evicted
+    
+    async def _remove_task(self, task_id, reason):
+        """删除任务记录和任务目录，目录删除在后台线程中执行，不阻塞事件循环"""
+        size_mb = self._retention.size_of(task_id) / (1024 * 1024)
+        self._retention.forget(task_id)
+        task_store.delete(task_id)
+        
+        task_dir = os.path.join(settings.TEMP_DIR, task_id)
+        if os.path.exists(task_dir):
+            await ffmpeg_runner.run_cpu(shutil.rmtree, task_dir, True)
+            logger.info(f"已删除任务 {task_id} ({reason}), 释放空间: {size_mb:.2f}MB")
+        else:
+            logger.warning(f"任务目录不存在: {task_dir}")
+    
     @retry(stop=stop_after_attempt(settings.MAX_RETRIES), 
            wait=wait_exponential(multiplier=settings.RETRY_DELAY))
     async def _download_video(self, url, file_path):
-        """下载视频文件，带重试机制"""
+        """下载视频文件，带重试机制；支持Range时分段并发下载，重试时从中断处继续"""
         try:
-            async with aiohttp.ClientSession() as session:
-                async with session.get(url, timeout=settings.DOWNLOAD_TIMEOUT) as response:
-                    if response.status != 200:
-                        raise Exception(f"下载失败，HTTP状态码: {response.status}")
-                    
-                    with open(file_path, 'wb') as f:
-                        while True:
-                            chunk = await response.content.read(1024 * 1024)  # 1MB chunks
-                            if not chunk:
-                                break
-                            f.write(chunk)
-            return True
+            return await downloader.download(url, file_path)
         except Exception as e:
             logger.error(f"下载视频失败: {str(e)}")
             raise
     
-    async def _extract_audio(self, video_path, audio_path):
-        """提取音频为MP3格式，16k采样率，单声道"""
+    async def _extract_audio(self, video_path, output_base, copy_path=None, probe=None):
+        """提取送入ASR的音频
+
+        - 源音频编码在 ASR_AUDIO_COPY_CODECS 中时直接复制音轨，不解码也不编码
+        - 否则转为 ASR_AUDIO_FORMAT 格式，16k采样率，单声道
+        - 开启 ASR_TRIM_SILENCE 时先解码为PCM并在同一次解码中检测静音，再只编码保留的语音区间
+
+        Args:
+            output_base: 输出路径(不含扩展名)，扩展名由输出格式决定
+            copy_path: 可选，在同一次读取中将源视频原样复制保存到该路径(stream模式下保留源视频)
+            probe: 可选，源视频的ffprobe结果，用于判断源音频编码
+
+        Returns:
+            {"path": 音频路径, "mode": copy/encode/trim, "kept_ranges": 保留区间(仅trim), ...}
+        """
         try:
-            loop = asyncio.get_event_loop()
-            process = await loop.run_in_executor(None, lambda: (
+            source = ffmpeg.input(video_path, **_input_options(video_path))
+            copy_outputs = [source.output(copy_path, format='matroska', c='copy')] if copy_path else []
+            ext, encode_options = _audio_encode_options()
+            
+            if settings.ASR_TRIM_SILENCE:
+                return await self._extract_audio_trimmed(source, output_base, ext, encode_options, copy_outputs)
+            
+            source_codec = None
+            if probe is not None:
+                source_codec = next(
+                    (s.get("codec_name") for s in probe.get("streams", []) if s.get("codec_type") == "audio"), None
+                )
+            copy_codecs = [c.strip() for c in settings.ASR_AUDIO_COPY_CODECS.split(",") if c.strip()]
+            if source_codec in copy_codecs and source_codec in _AUDIO_COPY_CONTAINERS:
+                ext, container = _AUDIO_COPY_CONTAINERS[source_codec]
+                audio_path = f"{output_base}.{ext}"
+                output = source.audio.output(audio_path, format=container, acodec='copy')
+                mode = "copy"
+            else:
+                audio_path = f"{output_base}.{ext}"
+                output = source.audio.output(audio_path, **encode_options)
+                mode = "encode"
+            await ffmpeg_runner.run(
                 ffmpeg
-                .input(video_path)
-                .output(audio_path, format='mp3', acodec='libmp3lame', 
-                        ar=16000, ac=1)
+                .merge_outputs(output, *copy_outputs)
                 .overwrite_output()
-                .run(quiet=False, capture_stderr=True)
-            ))
-            return True
+            )
+            return {"path": audio_path, "mode": mode, "source_codec": source_codec}
         except ffmpeg.Error as e:
             logger.error(f"提取音频失败: {str(e.stderr.decode())}")
             raise
@@ -195,43 +396,105 @@ class VideoProcessor:
             logger.error(f"提取音频失败: {str(e)}")
             raise
     
-    async def _extract_frames(self, video_path, output_dir, start_seconds=300, interval_seconds=300, max_frames=8):
-        """从视频中提取帧，根据传入的起始时间(秒)、间隔(秒)和最大帧数"""
+    async def _extract_audio_trimmed(self, source, output_base, ext, encode_options, copy_outputs):
+        """解码为16k单声道PCM并检测静音，再只将语音区间编码为目标格式，裁掉的静音不再编码和上传"""
+        pcm_path = f"{output_base}.full.wav"
+        audio_path = f"{output_base}.{ext}"
         try:
-            # 获取视频时长
-            probe = await asyncio.get_event_loop().run_in_executor(
-                None, lambda: ffmpeg.probe(video_path)
+            stream = (
+                source.audio
+                .filter('aformat', sample_rates=16000, channel_layouts='mono')
+                .filter('silencedetect', noise=f"{settings.ASR_SILENCE_NOISE_DB}dB",
+                        d=settings.ASR_TRIM_MIN_SILENCE_SECONDS)
+            )
+            _, stderr = await ffmpeg_runner.run(
+                ffmpeg
+                .merge_outputs(stream.output(pcm_path, format='wav', acodec='pcm_s16le'), *copy_outputs)
+                .overwrite_output()
+            )
+            duration = float((await ffmpeg_runner.probe(pcm_path))['format']['duration'])
+            kept = _speech_ranges(parse_silences(stderr.decode(errors="ignore"), duration), duration)
+            expr = "+".join(f"between(t,{start:.3f},{end:.3f})" for start, end in kept)
+            await ffmpeg_runner.run(
+                ffmpeg
+                .input(pcm_path)
+                .audio
+                .filter('aselect', expr)
+                .filter('asetpts', 'N/SR/TB')
+                .output(audio_path, **encode_options)
+                .overwrite_output()
             )
+        finally:
+            if os.path.exists(pcm_path):
+                os.remove(pcm_path)
+        
+        speech_seconds = sum(end - start for start, end in kept)
+        logger.info(f"静音裁剪: 原音频 {duration:.1f}秒，保留 {len(kept)} 段语音共 {speech_seconds:.1f}秒")
+        return {
+            "path": audio_path,
+            "mode": "trim",
+            "source_seconds": round(duration, 3),
+            "speech_seconds": round(speech_seconds, 3),
+            "kept_ranges": [(round(start, 3), round(end, 3)) for start, end in kept]
+        }
+    
+    async def _extract_frames(self, video_path, output_dir, start_seconds=300, interval_seconds=300, max_frames=8,
+                              probe=None, mode=None, output=None):
+        """从视频中提取帧，根据传入的起始时间(秒)、间隔(秒)和最大帧数
+
+        Args:
+            probe: 已有的ffmpeg.probe结果，传入时不再重复探测视频
+            mode: 提取模式(seek/select/per_frame/keyframe)，默认使用配置FRAME_EXTRACT_MODE；
+                  keyframe模式忽略起始时间和间隔，从关键帧中挑选内容差异最大的帧
+            output: 帧输出参数(最大边长、格式、质量、拼图列数)，见 frame_output_options
+
+        Returns:
+            实际写出的各帧时间点(秒)，第i个对应 frame_<i+1>.<格式>
+        """
+        try:
+            # 获取视频时长，优先复用调用方的探测结果
+            if probe is None:
+                probe = await ffmpeg_runner.probe(video_path, **_input_options(video_path))
             duration = float(probe['format']['duration'])
+            mode = mode or settings.FRAME_EXTRACT_MODE
             
-            logger.info(f"视频帧提取参数: 起始时间={start_seconds}秒, 间隔={interval_seconds}秒, 最大帧数={max_frames}")
+            logger.info(f"视频帧提取参数: 起始时间={start_seconds}秒, 间隔={interval_seconds}秒, 最大帧数={max_frames}, 模式={mode}")
             
             frame_times = []
-            current_time = start_seconds
+            if mode == "keyframe":
+                frame_times = await self._select_keyframes(video_path, max_frames, duration)
+                logger.info(f"从关键帧中选出 {len(frame_times)} 帧: {frame_times}")
+            
+            if not frame_times:
+                # 固定间隔采样，keyframe模式没有选出任何帧时也退回到该方式
+                current_time = start_seconds
+                while current_time < duration and len(frame_times) < max_frames:
+                    frame_times.append(current_time)
+                    current_time += interval_seconds
             
-            while current_time < duration and len(frame_times) < max_frames:
-                frame_times.append(current_time)
-                current_time += interval_seconds
+            if not frame_times:
+                return []
+            
+            output = frame_output_options(output)
+            ext = output["format"]
+            output_files = [os.path.join(output_dir, f"frame_{i+1}.{ext}") for i in range(len(frame_times))]
             
             # 提取帧
-            for i, time_sec in enumerate(frame_times):
-                output_file = os.path.join(output_dir, f"frame_{i+1}.jpg")
-                
+            if mode == "per_frame":
+                await self._extract_frames_per_frame(video_path, frame_times, output_files, output)
+            elif mode == "select":
+                frame_times = await self._extract_frames_select(video_path, frame_times, output_dir, output)
+            else:
                 try:
-                    await asyncio.get_event_loop().run_in_executor(
-                        None, lambda: (
-                            ffmpeg
-                            .input(video_path, ss=time_sec)
-                            .output(output_file, vframes=1)
-                            .overwrite_output()
-                            .run(quiet=False, capture_stderr=True)
-                        )
-                    )
+                    await self._extract_frames_seek(video_path, frame_times, output_files, output)
                 except ffmpeg.Error as e:
-                    logger.error(f"提取第 {i+1} 帧失败 (时间点: {time_sec}秒): {str(e.stderr.decode())}")
-                    raise
+                    logger.warning(f"单进程帧提取失败，回退到逐帧模式: {str(e.stderr.decode())}")
+                    await self._extract_frames_per_frame(video_path, frame_times, output_files, output)
             
-            return len(frame_times)
+            if output["contact_sheet_columns"] and frame_times:
+                await self._build_contact_sheet(output_dir, len(frame_times), output)
+            
+            return frame_times
         except ffmpeg.Error as e:
             logger.error(f"视频探测失败: {str(e.stderr.decode())}")
             raise
@@ -239,79 +502,713 @@ class VideoProcessor:
             logger.error(f"提取视频帧失败: {str(e)}")
             raise
     
-    async def _transcribe_audio(self, audio_path, output_path=None):
-        """将音频转换为文本，使用ASR服务"""
+    async def _select_keyframes(self, video_path, max_frames, duration):
+        """
+        单次解码只输出关键帧(I帧)，按场景变化分数从高到低挑选，并用感知哈希去除近似重复的帧
+        
+        ffmpeg把每个关键帧缩小为9x8灰度图通过管道输出，用于计算差异哈希，不需要解码全分辨率图片。
+        选出的帧不足 max_frames 时补入全片均匀分布的时间点。
+        
+        Returns:
+            选中帧的时间点(秒)，按时间排序
+        """
+        stdout, stderr = await ffmpeg_runner.run(
+            ffmpeg
+            .input(video_path, skip_frame='nokey', **_input_options(video_path))
+            .video
+            # 第一帧没有场景分数，单独选中
+            .filter('select', 'gte(scene,0)+eq(n,0)')
+            .filter('metadata', mode='print', key='lavfi.scene_score')
+            .filter('scale', 9, 8, flags='area')
+            .filter('format', 'gray')
+            .output('pipe:', format='rawvideo', fps_mode='vfr')
+        )
+        
+        # 每个关键帧对应 [时间点, 场景分数]
+        candidates = []
+        for line in stderr.decode('utf-8', errors='ignore').splitlines():
+            match = _PTS_TIME_PATTERN.search(line)
+            if match:
+                candidates.append([float(match.group(1)), 0.0])
+                continue
+            match = _SCENE_SCORE_PATTERN.search(line)
+            if match and candidates:
+                candidates[-1][1] = float(match.group(1))
+        hashes = [_dhash(stdout[i:i + 72]) for i in range(0, len(stdout) - 71, 72)]
+        if candidates:
+            # 视频开头视为一个新场景
+            candidates[0][1] = 1.0
+        
+        selected = []
+        ranked = sorted(zip(candidates, hashes), key=lambda item: -item[0][1])
+        for (time_sec, _), frame_hash in ranked:
+            if not any(_is_duplicate(frame_hash, kept) for _, kept in selected):
+                selected.append((time_sec, frame_hash))
+                if len(selected) >= max_frames:
+                    break
+        logger.info(f"共解码 {len(hashes)} 个关键帧，去重后选出 {len(selected)} 帧")
+        
+        # 关键帧不足(如整段只有一个关键帧)或大多被去重时按均匀间隔补足，优先跳过与已选帧过近的时间点
+        times = [time_sec for time_sec, _ in selected]
+        even_times = [round(duration * (i + 0.5) / max_frames, 3) for i in range(max_frames)]
+        for min_gap in (duration / max(max_frames, 1) / 2, 0.0):
+            for time_sec in even_times:
+                if len(times) >= max_frames:
+                    break
+                if time_sec not in times and all(abs(time_sec - kept) >= min_gap for kept in times):
+                    times.append(time_sec)
+        return sorted(times)
+    
+    async def _extract_frames_seek(self, video_path, frame_times, output_files, output):
+        """单个ffmpeg进程内为每个时间点打开一个快速定位的输入，一次写出全部帧"""
+        outputs = [
+            _apply_frame_output(
+                ffmpeg.input(video_path, ss=time_sec, **_input_options(video_path)).video,
+                output_file, output, vframes=1
+            )
+            for time_sec, output_file in zip(frame_times, output_files)
+        ]
+        await ffmpeg_runner.run(
+            ffmpeg
+            .merge_outputs(*outputs)
+            .overwrite_output()
+        )
+    
+    async def _extract_frames_select(self, video_path, frame_times, output_dir, output):
+        """
+        单次顺序解码，用select过滤器选出每个时间点之后的第一帧，适合短视频或密集采样
+
+        Returns:
+            实际写出的各帧时间点(秒)。多个时间点落在同一帧上时只写出一帧，输出会少于请求数，
+            因此按showinfo输出的帧时间戳返回，保证第i个时间点对应 frame_<i+1>
+        """
+        # 每个时间点只选中跨过该时间点的那一帧
+        expr = "+".join(
+            f"gte(t,{time_sec})*not(gte(prev_pts*TB,{time_sec}))" for time_sec in frame_times
+        )
+        seek_to = max(0, frame_times[0] - 1)
+        ext = output["format"]
+        _, stderr = await ffmpeg_runner.run(
+            _apply_frame_output(
+                ffmpeg
+                .input(video_path, ss=seek_to, **_input_options(video_path))
+                .video
+                .filter('select', expr)
+                .filter('showinfo'),
+                os.path.join(output_dir, f"frame_%d.{ext}"), output,
+                vframes=len(frame_times), fps_mode='vfr'
+            )
+            .global_args('-copyts')
+            .overwrite_output()
+        )
+        written = [
+            round(float(match.group(1)), 3)
+            for match in map(_SHOWINFO_PTS_PATTERN.search, stderr.decode('utf-8', errors='ignore').splitlines())
+            if match
+        ][:len(frame_times)]
+        frame_count = 0
+        while os.path.exists(os.path.join(output_dir, f"frame_{frame_count+1}.{ext}")):
+            frame_count += 1
+        if len(written) != frame_count:
+            # 无法解析帧时间戳时退回到按请求顺序对应，落在同一帧上的时间点可能错位
+            logger.warning(f"select模式解析到 {len(written)} 个帧时间戳，实际写出 {frame_count} 帧")
+            written = frame_times[:frame_count]
+        return written
+    
+    async def _extract_frames_per_frame(self, video_path, frame_times, output_files, output):
+        """每个时间点单独启动一个ffmpeg进程提取(旧实现，保留用于回退和性能对比)"""
+        for i, (time_sec, output_file) in enumerate(zip(frame_times, output_files)):
+            try:
+                await ffmpeg_runner.run(
+                    _apply_frame_output(
+                        ffmpeg.input(video_path, ss=time_sec, **_input_options(video_path)).video,
+                        output_file, output, vframes=1
+                    )
+                    .overwrite_output()
+                )
+            except ffmpeg.Error as e:
+                logger.error(f"提取第 {i+1} 帧失败 (时间点: {time_sec}秒): {str(e.stderr.decode())}")
+                raise
+    
+    async def _build_contact_sheet(self, output_dir, frame_count, output):
+        """用tile滤镜将已提取(已缩放)的帧按列数拼成一张拼图 contact_sheet.<格式>"""
+        ext = output["format"]
+        columns = min(output["contact_sheet_columns"], frame_count)
+        rows = -(-frame_count // columns)
+        await ffmpeg_runner.run(
+            _apply_frame_output(
+                ffmpeg
+                .input(os.path.join(output_dir, f"frame_%d.{ext}"), framerate=1, start_number=1)
+                .filter('tile', f"{columns}x{rows}", padding=4, margin=4),
+                os.path.join(output_dir, f"contact_sheet.{ext}"),
+                # 拼图只按格式和质量编码，帧已经缩放过
+                dict(output, max_dimension=None),
+                vframes=1
+            )
+            .overwrite_output()
+        )
+    
+    async def _transcribe_audio(self, audio_path, output_path=None, on_progress=None):
+        """
+        将音频转换为文本，使用ASR服务；配置了ASR_CHUNK_SECONDS时分段并发识别
+
+        Returns:
+            转录结果 {"text": 文本, "segments": 带时间戳的分句}
+        """
         try:
             logger.info(f"调用ASR服务处理音频: {audio_path}")
             
-            # 使用run_in_executor在线程池中执行阻塞操作
-            loop = asyncio.get_event_loop()
-            transcript = await loop.run_in_executor(
-                None, 
-                lambda: asr_service.transcribe(audio_path, output_path)
-            )
+            if settings.ASR_CHUNK_SECONDS > 0:
+                return await asr_service.transcribe_chunked(audio_path, output_path, on_progress=on_progress)
+            
+            if settings.ASR_CLIENT_MODE != "sync":
+                return await asr_service.atranscribe(audio_path, output_path)
             
-            return transcript
+            # 在有界的CPU线程池中执行阻塞的同步请求
+            return await ffmpeg_runner.run_cpu(asr_service.transcribe, audio_path, output_path)
         except Exception as e:
             logger.error(f"调用ASR服务失败: {str(e)}", exc_info=True)
             raise
     
-    async def process_video(self, url, start_seconds=None, interval_seconds=None, max_frames=8):
-        """处理视频的主函数
+    async def _probe_remote(self, url):
+        """
+        直接探测远程视频，ffprobe只通过Range请求读取容器头部(如moov)，不下载整个文件
+
+        Returns:
+            ffprobe结果，探测失败或超时时返回None，由调用方退回到下载后再探测
+        """
+        try:
+            probe = await asyncio.wait_for(
+                ffmpeg_runner.probe(url, remote=True, **_input_options(url)),
+                timeout=settings.PROBE_TIMEOUT
+            )
+            float(probe["format"]["duration"])
+            return probe
+        except Exception as e:
+            logger.warning(f"探测远程视频失败，将在下载后探测: {url}, {str(e)}")
+            return None
+    
+    async def get_metadata(self, url):
+        """
+        获取远程视频的元数据(时长、码率、各路流的编码参数)，不下载视频
+        
+        Returns:
+            元数据字典，包含探测耗时 probe_ms
+            
+        Raises:
+            ffmpeg.Error: 探测失败
+        """
+        started = time.monotonic()
+        probe = await asyncio.wait_for(
+            ffmpeg_runner.probe(url, remote=True, **_input_options(url)),
+            timeout=settings.PROBE_TIMEOUT
+        )
+        probe_ms = round((time.monotonic() - started) * 1000, 1)
+        
+        def number(value, cast=float):
+            try:
+                return cast(value)
+            except (TypeError, ValueError):
+                return None
+        
+        def frame_rate(value):
+            num, _, den = (value or "").partition("/")
+            if number(num) and number(den):
+                return round(float(num) / float(den), 3)
+            return None
+        
+        fmt = probe.get("format", {})
+        streams = []
+        for stream in probe.get("streams", []):
+            info = {
+                "index": stream.get("index"),
+                "codec_type": stream.get("codec_type"),
+                "codec_name": stream.get("codec_name"),
+                "bit_rate": number(stream.get("bit_rate"), int),
+                "duration": number(stream.get("duration"))
+            }
+            if stream.get("codec_type") == "video":
+                info.update({
+                    "width": stream.get("width"),
+                    "height": stream.get("height"),
+                    "frame_rate": frame_rate(stream.get("avg_frame_rate"))
+                })
+            elif stream.get("codec_type") == "audio":
+                info.update({
+                    "sample_rate": number(stream.get("sample_rate"), int),
+                    "channels": stream.get("channels")
+                })
+            streams.append(info)
+        
+        return {
+            "url": url,
+            "duration": number(fmt.get("duration")),
+            "size_bytes": number(fmt.get("size"), int),
+            "bit_rate": number(fmt.get("bit_rate"), int),
+            "format_name": fmt.get("format_name"),
+            "streams": streams,
+            "probe_ms": probe_ms
+        }
+    
+    async def submit_video(self, url, start_seconds=None, interval_seconds=None, max_frames=8,
+                           priority=0, client_id="default", frame_mode=None, frame_output=None):
+        """提交视频处理任务，立即返回任务ID，处理流程在后台执行
         
         Args:
             url: 视频URL
             start_seconds: 从第几秒开始提取帧，默认自动计算
             interval_seconds: 每隔几秒提取一帧，默认自动计算
             max_frames: 最多提取几帧，默认8帧
+            priority: 调度优先级，数值越大越先执行
+            client_id: 提交方标识，调度时按提交方公平分配
+            frame_mode: 帧提取模式(seek/select/per_frame/keyframe)，默认使用配置FRAME_EXTRACT_MODE
+            frame_output: 帧输出参数{max_dimension, format, quality, contact_sheet_columns}，缺省项使用配置
             
         Returns:
-            包含文件访问URL的JSON字符串
+            任务ID，命中结果缓存时返回已完成的缓存任务ID，相同URL和参数的任务正在执行时返回该任务ID
+            
+        Raises:
+            QueueFullError: 等待队列已满
         """
-        async with semaphore:
-            task_id = str(uuid.uuid4())
-            task_dir = os.path.join(settings.TEMP_DIR, task_id)
-            os.makedirs(task_dir, exist_ok=True)
+        await self.wait_ready()
+        params = {
+            "start_seconds": start_seconds,
+            "interval_seconds": interval_seconds,
+            "max_frames": max_frames,
+            "frame_mode": frame_mode,
+            "frame_output": frame_output_options(frame_output)
+        }
+        
+        # 相同URL和参数的任务正在提交或执行时直接共用该任务，不重复下载和识别
+        flight_key = hashlib.sha256(
+            json.dumps({"url": url, "params": params}, sort_keys=True).encode("utf-8")
+        ).hexdigest()
+        self._flight_requests += 1
+        metrics.submissions.inc(kind="total")
+        pending = self._in_flight.get(flight_key)
+        if pending is not None:
+            self._flight_coalesced += 1
+            metrics.submissions.inc(kind="coalesced")
+            task_id = await asyncio.shield(pending)
+            logger.info(f"合并相同的并发请求到任务 {task_id}: {url}")
+            return task_id
+        
+        pending = asyncio.get_running_loop().create_future()
+        self._in_flight[flight_key] = pending
+        try:
+            task_id = await self._submit(
+                url, params, start_seconds, interval_seconds, max_frames,
+                priority, client_id, frame_mode, frame_output
+            )
+        except asyncio.CancelledError:
+            self._in_flight.pop(flight_key, None)
+            pending.cancel()
+            raise
+        except Exception as e:
+            self._in_flight.pop(flight_key, None)
+            pending.set_exception(e)
+            # 没有其他等待方时避免"异常未被获取"的警告
+            pending.exception()
+            raise
+        pending.set_result(task_id)
+        
+        job = self._jobs.get(task_id)
+        if job is not None:
+            job.add_done_callback(lambda _: self._in_flight.pop(flight_key, None))
+        elif backend.shared and (await self.get_task_status(task_id))["status"] in ["queued", "processing"]:
+            # 共享后端下任务在共享队列中排队或由其他工作进程执行，结束后再移除，期间相同请求仍合并到该任务
+            watcher = self._spawn(self.wait_for_result(task_id), f"等待任务 {task_id} 结束")
+            watcher.add_done_callback(lambda _: self._in_flight.pop(flight_key, None))
+        else:
+            # 命中结果缓存，任务已完成
+            self._in_flight.pop(flight_key, None)
+        return task_id
+    
+    async def process_batch(self, items, client_id="default"):
+        """批量处理视频，按完成顺序逐条产出结果，不等待最慢的任务
+        
+        同时提交到调度队列的任务数不超过 BATCH_CONCURRENCY，一个任务结束后再提交下一条，
+        下载连接池、ASR连接池和ffmpeg进程配额由所有任务共用
+        
+        Args:
+            items: 每条为 process_video 的关键字参数字典(含 url)
+            client_id: 提交方标识，调度时按提交方公平分配
             
-            # 初始化任务状态（仅用于内部处理）
-            tasks[task_id] = {
-                "status": "processing",
-                "created_at": datetime.now(),
+        Yields:
+            (序号, 任务ID, 结果)，失败时结果为 {"error": ...}，未能提交时任务ID为None
+        """
+        done = asyncio.Queue()
+        pending = iter(enumerate(items))
+        
+        async def worker():
+            for index, item in pending:
+                task_id = None
+                try:
+                    task_id = await self._submit_when_queued(dict(item, client_id=client_id))
+                    result = await self.wait_for_result(task_id)
+                except Exception as e:
+                    logger.error(f"批量任务第 {index} 条处理失败: {str(e)}")
+                    result = {"error": f"处理失败: {str(e)}"}
+                await done.put((index, task_id, result))
+        
+        workers = [asyncio.create_task(worker()) for _ in range(min(settings.BATCH_CONCURRENCY, len(items)))]
+        try:
+            for _ in range(len(items)):
+                yield await done.get()
+        finally:
+            # 调用方提前结束(如客户端断开)时不再提交剩余条目，已提交的任务继续在后台执行
+            for task in workers:
+                task.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+    
+    async def _submit_when_queued(self, kwargs):
+        """提交任务，等待队列已满时退避重试，直到超过 PROCESSING_TIMEOUT"""
+        deadline = time.monotonic() + settings.PROCESSING_TIMEOUT
+        delay = 1
+        while True:
+            try:
+                return await self.submit_video(**kwargs)
+            except QueueFullError:
+                if time.monotonic() + delay > deadline:
+                    raise
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 30)
+    
+    def coalescing_stats(self):
+        """返回请求合并统计：提交次数、合并到已有任务的次数和命中率"""
+        return {
+            "requests": self._flight_requests,
+            "coalesced": self._flight_coalesced,
+            "hit_rate": round(self._flight_coalesced / self._flight_requests, 4) if self._flight_requests else 0.0,
+            "in_flight": len(self._in_flight)
+        }
+    
+    async def _check_queue_capacity(self):
+        """队列已满时抛出 QueueFullError"""
+        if backend.shared:
+            if await ffmpeg_runner.run_cpu(backend.queue_length) >= settings.MAX_QUEUED_TASKS:
+                raise QueueFullError(f"任务队列已满({settings.MAX_QUEUED_TASKS})，请稍后重试")
+        else:
+            scheduler.check_capacity()
+    
+    async def _submit(self, url, params, start_seconds, interval_seconds, max_frames,
+                      priority, client_id, frame_mode, frame_output):
+        """查询结果缓存，未命中时创建任务并登记到调度队列"""
+        # 查询结果缓存，只有能拿到源文件的ETag或Last-Modified时才使用缓存，避免源文件变化后返回旧结果
+        validators = {}
+        if settings.RESULT_CACHE_ENABLED or settings.TRANSCRIPT_CACHE_ENABLED:
+            validators = await fetch_source_validators(url)
+        
+        cache_key = None
+        if settings.RESULT_CACHE_ENABLED:
+            if identifies_content(validators):
+                cache_key = result_cache.make_key(url, validators, params)
+                entry = result_cache.get(cache_key)
+                if entry:
+                    logger.info(f"命中结果缓存，直接返回任务 {entry['task_id']} 的结果: {url}")
+                    await self._touch_task(entry["task_id"])
+                    return entry["task_id"]
+        
+        # 队列已满时在探测之前直接拒绝，不为不会被执行的任务发起远程探测
+        await self._check_queue_capacity()
+        
+        # 下载前直接探测远程视频，用真实时长规划帧参数和估算调度成本
+        probe = None
+        if settings.PROBE_BEFORE_SCHEDULE:
+            probe = await self._probe_remote(url)
+        
+        # 登记到调度队列，探测期间队列可能已满，此时仍直接抛出异常，不创建任务
+        cost = self._estimate_cost(validators, probe)
+        if backend.shared:
+            await self._check_queue_capacity()
+        else:
+            ticket = scheduler.enqueue(priority=priority, client_id=client_id, cost=cost)
+        
+        task_id = str(uuid.uuid4())
+        
+        # 初始化任务状态
+        tasks[task_id] = {
+            "status": "queued",
+            "created_at": datetime.now(),
+            "url": url,
+            "message": "任务已提交，等待处理",
+            "frame_params": {
+                "max_frames": max_frames,
+                "mode": frame_mode or settings.FRAME_EXTRACT_MODE,
+                "output": frame_output_options(frame_output),
+                "video_duration": float(probe["format"]["duration"]) if probe else None
+            },
+            "schedule": {
+                "priority": priority,
+                "estimated_cost": cost
+            },
+            "result": {}
+        }
+        
+        # 保存任务信息到磁盘
+        self._save_task(task_id, tasks[task_id])
+        
+        if backend.shared:
+            # 任务记录先提交，再放入共享队列，由有空闲容量的工作进程(可能是本进程)领取执行
+            tasks.pop(task_id)
+            await task_store.aflush()
+            await ffmpeg_runner.run_cpu(backend.enqueue, task_id, {
                 "url": url,
-                "message": "任务已创建",
-                "frame_params": {
-                    "max_frames": max_frames
-                },
-                "result": {}
-            }
+                "start_seconds": start_seconds,
+                "interval_seconds": interval_seconds,
+                "max_frames": max_frames,
+                "priority": priority,
+                "client_id": client_id,
+                "cost": cost,
+                "validators": validators,
+                "cache_key": cache_key,
+                "probe": probe,
+                "frame_mode": frame_mode,
+                "frame_output": frame_output_options(frame_output)
+            }, priority)
+            self._claim_wakeup.set()
+            return task_id
+        
+        # 在后台执行，保留引用避免任务被垃圾回收
+        job = asyncio.create_task(self._run_task(
+            task_id, ticket, url, start_seconds, interval_seconds, max_frames, validators, cache_key, probe,
+            frame_mode, frame_output_options(frame_output)
+        ))
+        self._jobs[task_id] = job
+        job.add_done_callback(lambda _: self._jobs.pop(task_id, None))
+        return task_id
+    
+    async def _start_claimed(self, task_id, job):
+        """在本进程中执行从共享队列领取的任务"""
+        task_info = await task_store.aget(task_id)
+        if task_info is None or task_info["status"] != "queued":
+            # 任务记录已被删除或已由主进程标记为失败
+            await ffmpeg_runner.run_cpu(backend.ack, task_id)
+            return
+        task_info["worker_id"] = backend.worker_id
+        tasks[task_id] = task_info
+        self._save_task(task_id, task_info)
+        
+        ticket = scheduler.enqueue(priority=job["priority"], client_id=job["client_id"], cost=job["cost"])
+        job_task = asyncio.create_task(self._run_task(
+            task_id, ticket, job["url"], job["start_seconds"], job["interval_seconds"], job["max_frames"],
+            job["validators"], job["cache_key"], job["probe"], job["frame_mode"], job["frame_output"]
+        ))
+        self._jobs[task_id] = job_task
+        
+        def finished(_):
+            self._jobs.pop(task_id, None)
+            self._claim_wakeup.set()
+            try:
+                backend.ack(task_id)
+            except Exception as e:
+                logger.error(f"确认共享队列任务 {task_id} 失败: {str(e)}")
+        job_task.add_done_callback(finished)
+    
+    async def _coordinate(self):
+        """共享后端下的工作进程循环：定期心跳和竞选清理主进程，本进程有空闲容量时从共享队列领取任务"""
+        logger.info(f"工作进程 {backend.worker_id} 使用共享后端: {backend.mode}")
+        last_heartbeat = 0.0
+        while True:
+            try:
+                now = time.monotonic()
+                # 共享后端的调用是阻塞的网络或磁盘IO，在CPU线程池中执行，不阻塞事件循环
+                if now - last_heartbeat >= settings.WORKER_HEARTBEAT_SECONDS:
+                    last_heartbeat = now
+                    await ffmpeg_runner.run_cpu(backend.heartbeat)
+                    if await ffmpeg_runner.run_cpu(backend.try_lead):
+                        await ffmpeg_runner.run_cpu(self._recover_orphaned_jobs)
+                
+                # 领取的任务数不超过本进程的工作者数，其余任务留给其他工作进程
+                while scheduler.running + scheduler.queue_depth < settings.MAX_CONCURRENT_TASKS:
+                    claimed = await ffmpeg_runner.run_cpu(backend.claim)
+                    if claimed is None:
+                        break
+                    logger.info(f"从共享队列领取任务 {claimed[0]}")
+                    await self._start_claimed(*claimed)
+            except Exception as e:
+                logger.error(f"共享队列处理出错: {str(e)}", exc_info=True)
+            # 不用wait_for：停止时的取消恰好与超时同时发生会被吞掉(Python 3.11)，循环无法退出
+            waiter = asyncio.ensure_future(self._claim_wakeup.wait())
+            try:
+                await asyncio.wait([waiter], timeout=settings.SHARED_POLL_MS / 1000)
+            finally:
+                waiter.cancel()
+            self._claim_wakeup.clear()
+    
+    def _recover_orphaned_jobs(self):
+        """由主进程执行：领取方心跳超时的任务已随进程中断，标记为失败并移出队列"""
+        for task_id, _ in backend.orphaned_jobs():
+            task_info = task_store.get(task_id)
+            if task_info is not None and task_info["status"] in ["queued", "processing"]:
+                task_info.update({"status": "failed", "message": "处理失败: 工作进程退出，任务已中断"})
+                self._save_task(task_id, task_info)
+                logger.info(f"任务 {task_id} 的工作进程已退出，标记为失败")
+            backend.ack(task_id)
+    
+    async def process_video(self, url, start_seconds=None, interval_seconds=None, max_frames=8,
+                            priority=0, client_id="default", frame_mode=None, frame_output=None):
+        """处理视频的主函数，提交任务并等待其完成
+        
+        Args:
+            url: 视频URL
+            start_seconds: 从第几秒开始提取帧，默认自动计算
+            interval_seconds: 每隔几秒提取一帧，默认自动计算
+            max_frames: 最多提取几帧，默认8帧
+            priority: 调度优先级，数值越大越先执行
+            client_id: 提交方标识，调度时按提交方公平分配
+            frame_mode: 帧提取模式(seek/select/per_frame/keyframe)，默认使用配置FRAME_EXTRACT_MODE
+            frame_output: 帧输出参数{max_dimension, format, quality, contact_sheet_columns}，缺省项使用配置
             
-            # 保存任务信息到磁盘
-            self._save_task_to_disk(task_id, tasks[task_id])
+        Returns:
+            包含文件访问URL的JSON字符串
+        """
+        task_id = await self.submit_video(
+            url,
+            start_seconds=start_seconds,
+            interval_seconds=interval_seconds,
+            max_frames=max_frames,
+            priority=priority,
+            client_id=client_id,
+            frame_mode=frame_mode,
+            frame_output=frame_output
+        )
+        return await self.wait_for_result(task_id)
+    
+    async def wait_for_result(self, task_id):
+        """等待任务结束，成功时返回结果，失败时返回错误信息"""
+        while True:
+            job = self._jobs.get(task_id)
+            if job is not None:
+                # 调用方取消等待时不影响后台任务继续执行
+                await asyncio.shield(job)
+            status = await self.get_task_status(task_id)
+            if not backend.shared or status["status"] not in ["queued", "processing"]:
+                break
+            # 任务尚未被领取或在其他工作进程中执行
+            await self.wait_for_update(task_id, since=status)
+        if status["status"] == "completed":
+            return status["result"]
+        return {"error": status["message"]}
+    
+    def watch(self, task_id):
+        """返回在任务下一次状态变化时被设置的事件，在读取状态之前调用可避免错过读取之后发生的变化"""
+        return self._task_events.setdefault(task_id, asyncio.Event())
+    
+    async def wait_for_update(self, task_id, timeout=None, event=None, since=None):
+        """等待任务状态发生变化，超时返回False
+        
+        Args:
+            event: 读取状态前通过 watch 获得的事件，缺省时只等待调用之后的变化
+            since: 调用方最后读到的任务状态，共享后端下任务不在本进程执行时，轮询任务存储直到状态与之不同
+        """
+        event = event or self.watch(task_id)
+        if backend.shared and since is not None and task_id not in tasks:
+            # 任务尚未被领取或在其他工作进程中执行，本进程收不到状态变化通知，轮询任务存储
+            deadline = None if timeout is None else time.monotonic() + timeout
+            while task_id not in self._jobs:
+                if event.is_set() or await self.get_task_status(task_id) != since:
+                    return True
+                interval = settings.SHARED_POLL_MS / 1000
+                if deadline is not None:
+                    interval = min(interval, deadline - time.monotonic())
+                    if interval <= 0:
+                        return False
+                await asyncio.sleep(interval)
+            # 任务已被本进程领取，之后的变化通过事件通知
+        try:
+            await asyncio.wait_for(event.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+    
+    def _notify(self, task_id):
+        """唤醒所有等待该任务状态变化的协程"""
+        event = self._task_events.pop(task_id, None)
+        if event is not None:
+            event.set()
+    
+    def _update_task(self, task_id, **fields):
+        """更新任务状态，保存到任务存储并通知等待方"""
+        task_info = tasks[task_id]
+        task_info.update(fields)
+        self._save_task(task_id, task_info)
+        if task_info["status"] in ["completed", "failed"]:
+            # 已结束的任务不再常驻内存，之后的查询从任务存储读取
+            tasks.pop(task_id, None)
+        self._notify(task_id)
+    
+    @staticmethod
+    def _estimate_cost(validators, probe=None):
+        """估算任务的调度成本(媒体时长秒数)，没有时长信息时按文件大小和假定码率估算"""
+        if probe is not None:
+            return float(probe["format"]["duration"])
+        content_length = validators.get("content_length")
+        if content_length and content_length.isdigit():
+            return int(content_length) * 8 / (settings.SCHEDULER_ASSUMED_BITRATE_KBPS * 1000)
+        # 大小未知时按中等长度视频处理
+        return 600.0
+    
+    async def _run_task(self, task_id, ticket, url, start_seconds, interval_seconds, max_frames, validators, cache_key,
+                        remote_probe=None, frame_mode=None, frame_output=None):
+        """等待调度器分配工作者后执行任务的处理流水线"""
+        frame_output = frame_output_options(frame_output)
+        async with scheduler.run(ticket):
+            # 本任务的指标累加器，各阶段任务继承该上下文，ffmpeg CPU时间和阶段产出字节数累加到这里
+            task_metric_values = {"queue_wait_seconds": round(ticket.wait_seconds, 3)}
+            metrics.task_metrics.set(task_metric_values)
+            metrics.queue_wait.observe(ticket.wait_seconds)
+            tasks[task_id]["schedule"]["queue_wait_seconds"] = round(ticket.wait_seconds, 3)
+            self._update_task(task_id, status="processing", message="任务处理中")
+            task_dir = os.path.join(settings.TEMP_DIR, task_id)
+            os.makedirs(task_dir, exist_ok=True)
             
             video_path = os.path.join(task_dir, "video.mp4")
-            audio_path = os.path.join(task_dir, "audio.mp3")
+            # stream模式保存的源视频副本，容器统一用mkv以兼容任意编码
+            stream_copy_path = os.path.join(task_dir, "video.mkv")
+            # 音频扩展名由输出格式决定(见 _extract_audio)
+            audio_base = os.path.join(task_dir, "audio")
             frames_dir = os.path.join(task_dir, "frames")
             transcript_path = os.path.join(task_dir, "transcript.txt")
             os.makedirs(frames_dir, exist_ok=True)
             
-            try:
-                # 下载视频
+            streaming = settings.INGEST_MODE == "stream"
+            
+            # 查询转录缓存：同一源文件此前已经转录过时，跳过音频提取和语音识别
+            source_transcript_key = None
+            cached_transcript = None
+            if settings.TRANSCRIPT_CACHE_ENABLED and identifies_content(validators):
+                source_transcript_key = transcript_cache.source_key(url, validators, settings.ASR_MODEL)
+                cached_transcript = transcript_cache.get(source_transcript_key)
+                if cached_transcript is not None:
+                    logger.info(f"命中转录缓存，跳过语音识别: {url}")
+            
+            # 各阶段的依赖关系: 下载 -> (探测 -> 帧提取) 与 (音频提取 -> 语音识别) 并发执行
+            # 音频(及之后的识别)与帧提取并发执行，各占任务线程预算的一半
+            stage_threads = max(1, settings.FFMPEG_THREADS_PER_JOB // 2)
+            
+            async def download_stage(_):
+                if streaming:
+                    # 流式模式不落盘，后续阶段直接由ffmpeg读取URL
+                    logger.info(f"流式处理视频，跳过下载: {url}")
+                    return url
                 logger.info(f"开始下载视频: {url}")
-                await self._download_video(url, video_path)
-                logger.info(f"视频下载完成: {video_path}")
-                
-                # 提取音频
-                logger.info(f"开始提取音频: {video_path} -> {audio_path}")
-                await self._extract_audio(video_path, audio_path)
-                logger.info("音频提取完成")
+                download_stats = await self._download_video(url, video_path)
+                logger.info(f"视频下载完成: {video_path}, 下载统计: {download_stats}")
+                metrics.record_stage_bytes("download", download_stats["size_bytes"])
+                metrics.download_retried_bytes.inc(download_stats["bytes_retried"])
+                self._update_task(task_id, download_stats=download_stats)
+                return video_path
+            
+            async def probe_stage(deps):
+                nonlocal start_seconds, interval_seconds
+                # 探测视频信息，结果同时用于自动计算参数和帧提取；提交时已探测过远程视频则直接复用
+                probe = remote_probe
+                if probe is None:
+                    probe = await ffmpeg_runner.probe(deps["download"], **_input_options(deps["download"]))
+                duration = float(probe['format']['duration'])
                 
-                # 获取视频时长，用于自动计算参数
                 if start_seconds is None or interval_seconds is None:
-                    probe = await asyncio.get_event_loop().run_in_executor(
-                        None, lambda: ffmpeg.probe(video_path)
-                    )
-                    duration = float(probe['format']['duration'])
-                    
                     # 自动计算参数
                     calculated_interval = int(duration / (max_frames + 1))
                     
@@ -327,30 +1224,122 @@ class VideoProcessor:
                 tasks[task_id]["frame_params"].update({
                     "start_seconds": start_seconds,
                     "interval_seconds": interval_seconds,
-                    "video_duration": duration if 'duration' in locals() else None
+                    "video_duration": duration
                 })
-                self._save_task_to_disk(task_id, tasks[task_id])
-                
-                # 提取视频帧
+                self._update_task(task_id)
+                return probe
+            
+            async def frames_stage(deps):
+                ffmpeg_runner.thread_budget.set(stage_threads)
                 logger.info(f"开始提取视频帧到目录: {frames_dir}")
-                frame_count = await self._extract_frames(
-                    video_path, 
+                frame_times = await self._extract_frames(
+                    deps["download"], 
                     frames_dir, 
                     start_seconds=start_seconds,
                     interval_seconds=interval_seconds,
-                    max_frames=max_frames
+                    max_frames=max_frames,
+                    probe=deps["probe"],
+                    mode=frame_mode,
+                    output=frame_output
                 )
-                logger.info(f"视频帧提取完成，共提取 {frame_count} 帧")
+                logger.info(f"视频帧提取完成，共提取 {len(frame_times)} 帧")
+                metrics.record_stage_bytes("frames", await ffmpeg_runner.run_cpu(self._dir_size, frames_dir))
+                return frame_times
+            
+            async def audio_stage(deps):
+                ffmpeg_runner.thread_budget.set(stage_threads)
+                copy_path = stream_copy_path if streaming and settings.KEEP_SOURCE_VIDEO else None
+                # 已有缓存的转录文本时不再需要音频，除非还要借音频这次读取保存源视频
+                if cached_transcript is not None and copy_path is None:
+                    return None
+                logger.info(f"开始提取音频: {deps['download']} -> {audio_base}")
+                audio = await self._extract_audio(deps["download"], audio_base, copy_path=copy_path, probe=deps["probe"])
+                audio["size_bytes"] = os.path.getsize(audio["path"])
+                logger.info(f"音频提取完成: {audio['path']}, 方式: {audio['mode']}")
+                metrics.record_stage_bytes("audio", audio["size_bytes"])
+                self._update_task(task_id, audio_stats={k: v for k, v in audio.items() if k not in ("path", "kept_ranges")})
+                return audio
+            
+            async def release_source_stage(_):
+                # 音频和帧都已提取完毕，按配置丢弃本地源视频
+                if not streaming and not settings.KEEP_SOURCE_VIDEO and os.path.exists(video_path):
+                    os.remove(video_path)
+                    logger.info(f"已删除源视频文件: {video_path}")
+            
+            async def asr_stage(deps):
+                ffmpeg_runner.thread_budget.set(stage_threads)
+                transcription = cached_transcript
+                audio_key = None
+                if transcription is None and settings.TRANSCRIPT_CACHE_ENABLED:
+                    # 按音频内容查询转录缓存，不同URL指向同一视频时也能复用
+                    audio_hash = await ffmpeg_runner.run_cpu(transcript_cache.file_hash, deps["audio"]["path"])
+                    audio_key = transcript_cache.audio_key(audio_hash, settings.ASR_MODEL)
+                    transcription = transcript_cache.get(audio_key)
+                    if transcription is not None:
+                        logger.info(f"按音频内容命中转录缓存，跳过语音识别")
+                        if source_transcript_key:
+                            transcript_cache.add_alias(source_transcript_key, audio_key)
+                
+                # 裁剪过静音的音频上的时间需要映射回原视频时间
+                kept_ranges = deps["audio"].get("kept_ranges") if deps["audio"] else None
+                
+                def on_progress(done, total, covered_seconds):
+                    # 分段识别进度只保存在内存中，部分转录文本见 transcript.partial.txt
+                    if kept_ranges:
+                        covered_seconds = original_time(covered_seconds, kept_ranges)
+                    tasks[task_id]["transcript_progress"] = {
+                        "chunks_done": done,
+                        "chunks_total": total,
+                        "transcribed_seconds": round(covered_seconds, 3)
+                    }
+                    self._notify(task_id)
+                
+                if transcription is None:
+                    logger.info(f"开始将音频转换为文本...")
+                    transcription = await self._transcribe_audio(deps["audio"]["path"], transcript_path, on_progress=on_progress)
+                    logger.info(f"音频转文本完成，文本长度: {len(transcription['text'])}")
+                    if kept_ranges:
+                        # 缓存中保存原视频时间轴上的分句，命中缓存时不需要保留区间
+                        transcription["segments"] = remap_segments(transcription["segments"], kept_ranges)
+                    if audio_key:
+                        transcript_cache.put(
+                            audio_key, transcription,
+                            aliases=[source_transcript_key] if source_transcript_key else []
+                        )
                 
-                # 音频转文本
-                logger.info(f"开始将音频转换为文本...")
-                transcript = await self._transcribe_audio(audio_path, transcript_path)
-                logger.info(f"音频转文本完成，文本长度: {len(transcript)}")
+                segments = transcription["segments"]
                 
-                # 保存文本到文件
+                # 保存文本和带时间戳的分句(JSON Lines/SRT/VTT)，同时保存预压缩版本供静态文件服务直接返回
+                # ASR接口不返回分句(json格式)时只保存文本
                 with open(transcript_path, 'w', encoding='utf-8') as f:
-                    f.write(transcript)
-                logger.info(f"音频转文本完成，已保存到: {transcript_path}")
+                    f.write(transcription["text"])
+                paths = [transcript_path] + (write_segment_files(task_dir, segments) if segments else [])
+                for path in paths:
+                    await ffmpeg_runner.run_cpu(write_precompressed, path)
+                logger.info(f"音频转文本完成，已保存到: {transcript_path}, 分句数: {len(segments)}")
+                metrics.record_stage_bytes("asr", sum(os.path.getsize(path) for path in paths))
+                return segments
+            
+            def on_stage(stage, state):
+                # 阶段状态只保存在内存中用于进度查询，避免频繁写盘
+                tasks[task_id].setdefault("stages", {})[stage] = state
+                self._notify(task_id)
+            
+            pipeline = (
+                Pipeline(name=task_id, on_stage=on_stage)
+                .add_stage("download", download_stage)
+                .add_stage("probe", probe_stage, deps=["download"])
+                .add_stage("audio", audio_stage, deps=["download", "probe"])
+                .add_stage("frames", frames_stage, deps=["download", "probe"])
+                .add_stage("asr", asr_stage, deps=["audio", "probe"])
+                .add_stage("release_source", release_source_stage, deps=["audio", "frames"])
+            )
+            
+            try:
+                results = await pipeline.run()
+                frame_times = results["frames"]
+                frame_count = len(frame_times)
+                logger.info(f"任务 {task_id} 各阶段耗时: {pipeline.timings}")
                 
                 # 构建文件访问URL
                 base_url = f"{settings.FILE_ACCESS_BASE_URL}/{task_id}"
@@ -360,61 +1349,127 @@ class VideoProcessor:
                     "transcript_url": f"{base_url}/transcript.txt",
                     "frames_urls": []
                 }
+                if results["asr"]:
+                    result.update({
+                        "segments_url": f"{base_url}/{SEGMENTS_FILE}",
+                        "srt_url": f"{base_url}/{SRT_FILE}",
+                        "vtt_url": f"{base_url}/{VTT_FILE}"
+                    })
                 
                 # 添加所有帧的URL
+                ext = frame_output["format"]
                 for i in range(1, frame_count + 1):
-                    result["frames_urls"].append(f"{base_url}/frames/frame_{i}.jpg")
+                    result["frames_urls"].append(f"{base_url}/frames/frame_{i}.{ext}")
+                if frame_output["contact_sheet_columns"] and frame_count:
+                    result["contact_sheet_url"] = f"{base_url}/frames/contact_sheet.{ext}"
+                if settings.FRAME_TRANSCRIPT_WINDOW_SECONDS > 0 and results["asr"]:
+                    # 与frames_urls一一对应的帧时间点及其前后的转录文本
+                    result["frame_transcripts"] = frame_windows(
+                        frame_times, results["asr"], settings.FRAME_TRANSCRIPT_WINDOW_SECONDS,
+                        duration=float(results["probe"]["format"]["duration"])
+                    )
                 
                 # 更新任务状态（仅用于内部记录）
-                tasks[task_id].update({
-                    "status": "completed",
-                    "message": "处理完成",
-                    "result": result
-                })
+                size_bytes = await ffmpeg_runner.run_cpu(self._dir_size, task_dir)
+                if cache_key:
+                    result_cache.put(cache_key, task_id, result, size_bytes)
                 
-                # 保存更新后的任务信息到磁盘
-                self._save_task_to_disk(task_id, tasks[task_id])
+                # 保存更新后的任务信息到磁盘并通知等待方
+                self._update_task(
+                    task_id,
+                    status="completed",
+                    message="处理完成",
+                    stage_timings=pipeline.timings,
+                    size_bytes=size_bytes,
+                    metrics=task_metric_values,
+                    result=result
+                )
+                metrics.tasks_finished.inc(status="completed")
+                metrics.task_duration.observe(pipeline.timings["total"]["duration"], status="completed")
+                self._track_retention(task_id, time.time(), size_bytes)
+                # 磁盘配额检查在后台执行，不延迟返回结果
+                self._spawn(self._enforce_disk_quota(exclude=task_id), "磁盘配额检查")
                 
                 return result
                 
             except Exception as e:
                 logger.error(f"任务 {task_id} 处理失败: {str(e)}", exc_info=True)
-                tasks[task_id].update({
-                    "status": "failed",
-                    "message": f"处理失败: {str(e)}"
-                })
-                # 保存失败状态到磁盘
-                self._save_task_to_disk(task_id, tasks[task_id])
+                # 保存失败状态到磁盘并通知等待方
+                size_bytes = await ffmpeg_runner.run_cpu(self._dir_size, task_dir)
+                self._update_task(
+                    task_id,
+                    status="failed",
+                    message=f"处理失败: {str(e)}",
+                    stage_timings=pipeline.timings,
+                    size_bytes=size_bytes,
+                    metrics=task_metric_values
+                )
+                metrics.tasks_finished.inc(status="failed")
+                metrics.task_duration.observe(pipeline.timings.get("total", {}).get("duration", 0), status="failed")
+                self._track_retention(task_id, time.time(), size_bytes)
                 return {"error": f"处理失败: {str(e)}"}
 
-    def get_task_status(self, task_id):
+    async def _touch_task(self, task_id):
+        """记录任务结果被再次访问的时间，定期清理按该时间重新计算保留期"""
+        task_info = await task_store.aget(task_id)
+        if task_info is not None:
+            task_info["last_accessed_at"] = datetime.now()
+            self._save_task(task_id, task_info)
+            self._track_retention(task_id, task_info["last_accessed_at"].timestamp(), task_info.get("size_bytes", 0))
+    
+    def _spawn(self, coro, description):
+        """在后台执行不需要等待结果的协程，保留引用直到结束并记录异常"""
+        task = asyncio.create_task(coro)
+        self._detached.add(task)
+        
+        def finished(_):
+            self._detached.discard(task)
+            if not task.cancelled() and task.exception() is not None:
+                logger.error(f"后台{description}失败: {str(task.exception())}", exc_info=task.exception())
+        task.add_done_callback(finished)
+        return task
+    
+    def _track_retention(self, task_id, last_used, size_bytes):
+        """登记到过期索引；共享后端下只有主进程清理，其余进程的索引不会被消费，不登记以免条目无限增长"""
+        if backend.shared and not backend.is_leader:
+            return
+        self._retention.track(task_id, last_used, size_bytes)
+    
+    @staticmethod
+    def _dir_size(path):
+        """统计目录下所有文件的总字节数"""
+        return sum(os.path.getsize(os.path.join(dirpath, filename)) 
+                   for dirpath, _, filenames in os.walk(path) 
+                   for filename in filenames)
+    
+    async def get_task_status(self, task_id):
         """获取任务状态"""
-        if task_id not in tasks:
-            # 尝试从磁盘加载任务信息
-            task_record_file = os.path.join(self.tasks_record_dir, f"{task_id}.json")
-            if os.path.exists(task_record_file):
-                try:
-                    with open(task_record_file, 'r', encoding='utf-8') as f:
-                        task_info = json.load(f)
-                        # 将任务信息加载到内存中
-                        if 'created_at' in task_info and isinstance(task_info['created_at'], str):
-                            task_info['created_at'] = datetime.fromisoformat(task_info['created_at'])
-                        tasks[task_id] = task_info
-                        logger.info(f"从磁盘加载了任务 {task_id} 的信息")
-                except Exception as e:
-                    logger.error(f"从磁盘加载任务 {task_id} 失败: {str(e)}")
-                    return {"status": "not_found", "message": "任务不存在或无法加载"}
-            else:
+        task_info = tasks.get(task_id)
+        if task_info is None:
+            # 已结束的任务从任务存储读取
+            try:
+                task_info = await task_store.aget(task_id)
+            except Exception as e:
+                logger.error(f"读取任务 {task_id} 失败: {str(e)}")
+                return {"status": "not_found", "message": "任务不存在或无法加载"}
+            if task_info is None:
                 return {"status": "not_found", "message": "任务不存在"}
         
-        task_info = tasks[task_id]
         return {
             "task_id": task_id,
             "status": task_info["status"],
             "message": task_info["message"],
             "created_at": task_info["created_at"].isoformat() if isinstance(task_info["created_at"], datetime) else task_info["created_at"],
+            "stages": task_info.get("stages", {}),
+            "transcript_progress": task_info.get("transcript_progress"),
             "result": task_info.get("result", {})
         }
 
 # 创建单例
-video_processor = VideoProcessor()
\ No newline at end of file
+video_processor = VideoProcessor()
+
+# 注册由调度器提供的指标，在输出时取值
+metrics.registry.gauge(
+    "video_tasks_in_flight", "排队中和执行中的任务数", ["state"],
+    function=lambda: {("queued",): scheduler.queue_depth, ("running",): scheduler.running}
+)
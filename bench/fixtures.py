@@ -0,0 +1,110 @@
+import os
+import asyncio
+import threading
+import ffmpeg
+from aiohttp import web
+
+def generate_video(media_dir, duration, resolution, fps=25):
+    """
+    用ffmpeg的 testsrc 和 sine 源生成测试视频，已存在时直接复用
+
+    Args:
+        media_dir: 视频保存目录
+        duration: 时长(秒)
+        resolution: 分辨率，如 "1280x720"
+        fps: 帧率
+
+    Returns:
+        视频文件名
+    """
+    file_name = f"testsrc_{duration}s_{resolution}.mp4"
+    file_path = os.path.join(media_dir, file_name)
+    if os.path.exists(file_path):
+        return file_name
+
+    os.makedirs(media_dir, exist_ok=True)
+    video = ffmpeg.input(f"testsrc=size={resolution}:rate={fps}:duration={duration}", f="lavfi")
+    audio = ffmpeg.input(f"sine=frequency=440:sample_rate=44100:duration={duration}", f="lavfi")
+    # 先写入临时文件，中断时不会留下不完整的视频
+    tmp_path = f"{file_path}.tmp.mp4"
+    (
+        ffmpeg
+        .output(video, audio, tmp_path, vcodec="libx264", preset="veryfast", pix_fmt="yuv420p",
+                g=fps * 2, acodec="aac", movflags="+faststart")
+        .overwrite_output()
+        .run(quiet=True)
+    )
+    os.replace(tmp_path, file_path)
+    return file_name
+
+class FixtureServer:
+    """
+    测试用的本地HTTP服务，在独立线程的事件循环中运行，不占用被测服务的事件循环
+
+    - /media/<文件名>: 提供测试视频，支持Range请求
+    - /v1/audio/transcriptions: 模拟OpenAI兼容的语音识别接口，固定延迟后返回文本
+    """
+
+    def __init__(self, media_dir, asr_latency=0.5, host="127.0.0.1"):
+        self.media_dir = media_dir
+        self.asr_latency = asr_latency
+        self.host = host
+        self.port = None
+        self.asr_requests = 0
+        self._loop = None
+        self._runner = None
+        self._thread = None
+
+    @property
+    def base_url(self):
+        return f"http://{self.host}:{self.port}"
+
+    def media_url(self, file_name):
+        return f"{self.base_url}/media/{file_name}"
+
+    async def _transcribe(self, request):
+        data = await request.post()
+        audio = data["file"]
+        size = len(audio.file.read())
+        self.asr_requests += 1
+        await asyncio.sleep(self.asr_latency)
+        text = f"benchmark transcript for {audio.filename} ({size} bytes)"
+        if data.get("response_format") == "verbose_json":
+            # 按音频大小粗略估计时长，切分为固定长度的片段
+            duration = max(1.0, size / 16000)
+            segments = []
+            start = 0.0
+            while start < duration:
+                end = min(start + 5.0, duration)
+                segments.append({"id": len(segments), "start": round(start, 3), "end": round(end, 3),
+                                 "text": f"segment {len(segments)}"})
+                start = end
+            return web.json_response({"text": text, "duration": duration, "segments": segments})
+        return web.json_response({"text": text})
+
+    async def _start(self):
+        app = web.Application(client_max_size=1024 ** 3)
+        app.router.add_post("/v1/audio/transcriptions", self._transcribe)
+        app.router.add_static("/media", self.media_dir)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self.host, 0)
+        await site.start()
+        self.port = self._runner.addresses[0][1]
+
+    def start(self):
+        """在后台线程中启动服务，返回时端口已就绪"""
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name="bench-fixtures", daemon=True)
+        self._thread.start()
+        asyncio.run_coroutine_threadsafe(self._start(), self._loop).result()
+        return self
+
+    def stop(self):
+        if self._loop is None:
+            return
+        asyncio.run_coroutine_threadsafe(self._runner.cleanup(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
+        self._loop = None
@@ -0,0 +1,448 @@
+"""
+视频处理流水线性能测试
+
+在本地生成测试视频、启动提供视频和模拟语音识别接口的测试服务，然后分别直接调用
+process_video(direct) 和通过HTTP接口(http) 以不同并发度提交任务，统计各阶段耗时、
+吞吐量(任务数/分钟)、延迟分位数以及峰值内存和磁盘占用，结果写入JSON文件便于对比不同版本。
+
+用法:
+    python -m bench.run --durations 30,120 --resolutions 640x360,1280x720 --concurrency 1,4,8
+    python -m bench.run --modes http --env MAX_CONCURRENT_TASKS=8 --baseline bench/results/上次结果.json
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import socket
+import sqlite3
+import asyncio
+import logging
+import argparse
+import platform
+import resource
+import subprocess
+from datetime import datetime
+import aiohttp
+from bench.fixtures import FixtureServer, generate_video
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# 测试服务使用的API Key
+BENCH_API_KEY = "bench"
+
+# 资源采样间隔(秒)
+SAMPLE_INTERVAL = 0.2
+
+def percentile(values, p):
+    """线性插值计算分位数，p取0-100"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = (len(ordered) - 1) * p / 100
+    low = int(rank)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (rank - low)
+
+def summarize(values):
+    """汇总一组数值的均值、分位数和最大值"""
+    if not values:
+        return None
+    return {
+        "mean": round(sum(values) / len(values), 3),
+        "p50": round(percentile(values, 50), 3),
+        "p95": round(percentile(values, 95), 3),
+        "p99": round(percentile(values, 99), 3),
+        "max": round(max(values), 3)
+    }
+
+def dir_size(path):
+    """目录下所有文件的总字节数，采样期间文件被删除时忽略"""
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+def process_tree_rss(pid):
+    """进程及其所有子进程(ffmpeg等)当前的常驻内存字节数之和，依赖Linux的/proc"""
+    children = {}
+    rss = {}
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                stat = f.read()
+        except OSError:
+            continue
+        # 进程名可能包含空格，从最后一个右括号之后解析
+        fields = stat[stat.rfind(")") + 2:].split()
+        children.setdefault(int(fields[1]), []).append(int(entry))
+        rss[int(entry)] = int(fields[21]) * resource.getpagesize()
+    total = 0
+    pending = [pid]
+    while pending:
+        current = pending.pop()
+        total += rss.get(current, 0)
+        pending.extend(children.get(current, []))
+    return total
+
+class ResourceSampler:
+    """定期采样进程树内存和任务目录大小，记录本轮测试期间的峰值"""
+
+    def __init__(self, pid, temp_dir):
+        self.pid = pid
+        self.temp_dir = temp_dir
+        self.peak_rss = 0
+        self.peak_disk = 0
+        self._baseline_disk = 0
+        self._task = None
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            rss, disk = await loop.run_in_executor(
+                None, lambda: (process_tree_rss(self.pid), dir_size(self.temp_dir)))
+            self.peak_rss = max(self.peak_rss, rss)
+            self.peak_disk = max(self.peak_disk, disk - self._baseline_disk)
+            await asyncio.sleep(SAMPLE_INTERVAL)
+
+    def start(self):
+        self._baseline_disk = dir_size(self.temp_dir)
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+
+class DirectDriver:
+    """在当前进程中直接调用 video_processor，经过与HTTP服务相同的应用生命周期"""
+
+    mode = "direct"
+
+    def __init__(self, env):
+        self.env = env
+        self.temp_dir = env["TEMP_DIR"]
+        self.pid = os.getpid()
+        self._lifespan = None
+
+    async def start(self, verbose=False):
+        # 配置在导入时读取，必须先设置环境变量
+        os.environ.update(self.env)
+        from app import create_app
+        from app.services.video_processor import video_processor
+        from app.services.task_store import task_store
+        self._video_processor = video_processor
+        self._task_store = task_store
+        app = create_app()
+        self._lifespan = app.router.lifespan_context(app)
+        await self._lifespan.__aenter__()
+        if not verbose:
+            for name in list(logging.root.manager.loggerDict):
+                if name != "bench":
+                    logging.getLogger(name).setLevel(logging.WARNING)
+
+    async def stop(self):
+        if self._lifespan is not None:
+            await self._lifespan.__aexit__(None, None, None)
+
+    async def run_job(self, url, options):
+        task_id = await self._video_processor.submit_video(url, **options)
+        result = await self._video_processor.wait_for_result(task_id)
+        return task_id, "failed" if "error" in result else "completed"
+
+    async def task_record(self, task_id):
+        return self._task_store.get(task_id)
+
+class HttpDriver:
+    """在子进程中启动HTTP服务(bench/server.py)，通过 POST /api/tasks 提交任务并订阅事件流等待结束"""
+
+    mode = "http"
+
+    def __init__(self, env):
+        self.env = env
+        self.temp_dir = env["TEMP_DIR"]
+        self.pid = None
+        self._process = None
+        self._session = None
+        self._base_url = None
+        self._headers = {"Authorization": f"Bearer {BENCH_API_KEY}"}
+
+    async def start(self, verbose=False):
+        with socket.socket() as s:
+            s.bind(("127.0.0.1", 0))
+            port = s.getsockname()[1]
+        self._base_url = f"http://127.0.0.1:{port}"
+        os.makedirs(self.temp_dir, exist_ok=True)
+        log_file = open(os.path.join(os.path.dirname(self.temp_dir), "http_server.log"), "ab")
+        self._process = subprocess.Popen(
+            [sys.executable, "-m", "bench.server", str(port), "info" if verbose else "warning"],
+            cwd=REPO_DIR,
+            env=dict(os.environ, **self.env),
+            stdout=log_file,
+            stderr=subprocess.STDOUT
+        )
+        log_file.close()
+        self.pid = self._process.pid
+        self._session = aiohttp.ClientSession(
+            headers=self._headers, timeout=aiohttp.ClientTimeout(total=None, sock_connect=10))
+        deadline = time.monotonic() + 60
+        while True:
+            if self._process.poll() is not None:
+                raise RuntimeError(f"HTTP服务启动失败，退出码: {self._process.returncode}")
+            try:
+                async with self._session.get(f"{self._base_url}/") as response:
+                    if response.status == 200:
+                        return
+            except aiohttp.ClientError:
+                pass
+            if time.monotonic() > deadline:
+                raise RuntimeError("等待HTTP服务启动超时")
+            await asyncio.sleep(0.2)
+
+    async def stop(self):
+        if self._session is not None:
+            await self._session.close()
+        if self._process is not None and self._process.poll() is None:
+            self._process.terminate()
+            try:
+                self._process.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                self._process.kill()
+
+    async def run_job(self, url, options):
+        payload = dict(options, url=url)
+        async with self._session.post(f"{self._base_url}/api/tasks", json=payload) as response:
+            if response.status != 202:
+                raise RuntimeError(f"提交任务失败，HTTP状态码: {response.status}, {await response.text()}")
+            task_id = (await response.json())["task_id"]
+        status = None
+        async with self._session.get(f"{self._base_url}/api/tasks/{task_id}/events") as response:
+            async for line in response.content:
+                if line.startswith(b"data: "):
+                    status = json.loads(line[6:])["status"]
+                    if status in ("completed", "failed"):
+                        break
+        return task_id, status or "failed"
+
+    async def task_record(self, task_id):
+        """从服务的任务数据库读取记录，服务端批量写入有延迟，读不到时稍后重试"""
+        db_path = os.path.join(self.temp_dir, "_tasks.db")
+        for _ in range(20):
+            conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+            try:
+                row = conn.execute("SELECT data FROM tasks WHERE task_id = ?", (task_id,)).fetchone()
+            finally:
+                conn.close()
+            if row is not None:
+                record = json.loads(row[0])
+                if record.get("status") in ("completed", "failed"):
+                    return record
+            await asyncio.sleep(0.1)
+        return None
+
+def service_env(temp_dir, fixtures, args):
+    """被测服务的配置，默认关闭结果缓存和转录缓存，使每个任务都完整执行"""
+    env = {
+        "TEMP_DIR": temp_dir,
+        "API_KEY": BENCH_API_KEY,
+        "ASR_API_BASE_URL": f"{fixtures.base_url}/v1",
+        "ASR_API_KEY": "bench",
+        "ASR_MODEL": "bench",
+        "FILE_ACCESS_BASE_URL": "http://127.0.0.1/files",
+        "TASK_STORE_FLUSH_MS": "50"
+    }
+    if not args.cache:
+        env.update({"RESULT_CACHE_ENABLED": "false", "TRANSCRIPT_CACHE_ENABLED": "false"})
+    for item in args.env:
+        key, _, value = item.partition("=")
+        env[key] = value
+    return env
+
+async def run_level(driver, url, options, concurrency, jobs):
+    """以固定并发度执行一轮测试(闭环：每个客户端完成一个任务后立即提交下一个)"""
+    sampler = ResourceSampler(driver.pid, driver.temp_dir)
+    results = []
+    remaining = iter(range(jobs))
+
+    async def client():
+        for _ in remaining:
+            # 每个任务使用不同的URL，避免被合并到同一个任务
+            job_url = f"{url}?job={uuid.uuid4().hex}"
+            started = time.monotonic()
+            try:
+                task_id, status = await driver.run_job(job_url, options)
+            except Exception as e:
+                logging.getLogger("bench").error(f"任务执行出错: {str(e)}")
+                task_id, status = None, "error"
+            results.append({"task_id": task_id, "status": status, "latency": time.monotonic() - started})
+
+    sampler.start()
+    started = time.monotonic()
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    wall = time.monotonic() - started
+    await sampler.stop()
+
+    stage_durations = {}
+    ffmpeg_cpu = {}
+    queue_waits = []
+    for item in results:
+        if item["status"] != "completed":
+            continue
+        record = await driver.task_record(item["task_id"]) or {}
+        for stage, timing in (record.get("stage_timings") or {}).items():
+            stage_durations.setdefault(stage, []).append(timing["duration"])
+        task_metrics = record.get("metrics") or {}
+        if "queue_wait_seconds" in task_metrics:
+            queue_waits.append(task_metrics["queue_wait_seconds"])
+        for stage, seconds in (task_metrics.get("ffmpeg_cpu_seconds") or {}).items():
+            ffmpeg_cpu.setdefault(stage, []).append(seconds)
+
+    completed = [item for item in results if item["status"] == "completed"]
+    return {
+        "concurrency": concurrency,
+        "jobs": jobs,
+        "completed": len(completed),
+        "failed": jobs - len(completed),
+        "wall_seconds": round(wall, 3),
+        "jobs_per_minute": round(len(completed) * 60 / wall, 2) if wall > 0 else 0.0,
+        "latency_seconds": summarize([item["latency"] for item in completed]),
+        "queue_wait_seconds": summarize(queue_waits),
+        "stages": {stage: summarize(values) for stage, values in stage_durations.items()},
+        "ffmpeg_cpu_seconds": {stage: summarize(values) for stage, values in ffmpeg_cpu.items()},
+        "peak_rss_mb": round(sampler.peak_rss / 1024 / 1024, 1),
+        "peak_disk_mb": round(sampler.peak_disk / 1024 / 1024, 1)
+    }
+
+def environment_info(args, env):
+    """记录测试环境，便于判断两次结果是否可比"""
+    def command_output(command):
+        try:
+            return subprocess.run(command, cwd=REPO_DIR, capture_output=True, text=True, timeout=10).stdout.strip()
+        except Exception:
+            return None
+
+    ffmpeg_version = command_output(["ffmpeg", "-version"])
+    return {
+        "started_at": datetime.now().isoformat(timespec="seconds"),
+        "git_commit": command_output(["git", "rev-parse", "HEAD"]),
+        "git_dirty": bool(command_output(["git", "status", "--porcelain", "--untracked-files=no"])),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "ffmpeg": ffmpeg_version.splitlines()[0] if ffmpeg_version else None,
+        "args": vars(args),
+        "service_env": {key: value for key, value in env.items() if key not in ("TEMP_DIR", "ASR_API_BASE_URL")}
+    }
+
+def compare(report, baseline):
+    """与基准结果逐项对比吞吐量和p95延迟"""
+    def key(run):
+        return run["mode"], run["video"]["file"], run["concurrency"]
+
+    previous = {key(run): run for run in baseline.get("runs", [])}
+    lines = []
+    for run in report["runs"]:
+        old = previous.get(key(run))
+        if old is None or not old.get("latency_seconds") or not run.get("latency_seconds"):
+            continue
+        throughput = (run["jobs_per_minute"] / old["jobs_per_minute"] - 1) * 100 if old["jobs_per_minute"] else 0.0
+        p95 = (run["latency_seconds"]["p95"] / old["latency_seconds"]["p95"] - 1) * 100
+        lines.append(f"{run['mode']:<6} {run['video']['file']:<32} c={run['concurrency']:<3} "
+                     f"吞吐量 {throughput:+.1f}%  p95延迟 {p95:+.1f}%")
+    return lines
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="视频处理流水线性能测试")
+    parser.add_argument("--durations", default="30,120", help="测试视频时长(秒)，逗号分隔")
+    parser.add_argument("--resolutions", default="640x360,1280x720", help="测试视频分辨率，逗号分隔")
+    parser.add_argument("--concurrency", default="1,4", help="并发度，逗号分隔")
+    parser.add_argument("--jobs", type=int, default=0, help="每轮任务数，默认为并发度的2倍且不少于4")
+    parser.add_argument("--warmup", type=int, default=1, help="每种模式正式测试前的预热任务数")
+    parser.add_argument("--modes", default="direct,http", help="测试模式: direct / http，逗号分隔")
+    parser.add_argument("--max-frames", type=int, default=8, help="每个任务提取的帧数")
+    parser.add_argument("--frame-mode", default=None, help="帧提取模式，默认使用服务配置")
+    parser.add_argument("--asr-latency", type=float, default=0.5, help="模拟语音识别接口的响应延迟(秒)")
+    parser.add_argument("--cache", action="store_true", help="保留结果缓存和转录缓存(默认关闭)")
+    parser.add_argument("--env", action="append", default=[], metavar="KEY=VALUE",
+                        help="覆盖被测服务的配置，可重复指定")
+    parser.add_argument("--workdir", default=os.path.join(REPO_DIR, "bench", ".work"),
+                        help="测试视频和任务文件目录")
+    parser.add_argument("--output", default=None, help="结果JSON文件路径，默认写入 bench/results/")
+    parser.add_argument("--baseline", default=None, help="用于对比的历史结果JSON文件")
+    parser.add_argument("--verbose", action="store_true", help="输出被测服务的INFO日志")
+    return parser.parse_args(argv)
+
+async def main(args):
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    logger = logging.getLogger("bench")
+    media_dir = os.path.join(args.workdir, "media")
+    run_id = datetime.now().strftime("%Y%m%d-%H%M%S")
+
+    videos = []
+    for duration in [int(value) for value in args.durations.split(",")]:
+        for resolution in args.resolutions.split(","):
+            logger.info(f"准备测试视频: {duration}秒 {resolution}")
+            file_name = generate_video(media_dir, duration, resolution)
+            videos.append({
+                "file": file_name,
+                "duration": duration,
+                "resolution": resolution,
+                "size_bytes": os.path.getsize(os.path.join(media_dir, file_name))
+            })
+
+    fixtures = FixtureServer(media_dir, asr_latency=args.asr_latency).start()
+    options = {"max_frames": args.max_frames}
+    if args.frame_mode:
+        options["frame_mode"] = args.frame_mode
+    levels = [int(value) for value in args.concurrency.split(",")]
+    drivers = {"direct": DirectDriver, "http": HttpDriver}
+
+    report = None
+    try:
+        for mode in args.modes.split(","):
+            env = service_env(os.path.join(args.workdir, run_id, mode, "temp"), fixtures, args)
+            if report is None:
+                report = {"environment": environment_info(args, env), "runs": []}
+            driver = drivers[mode](env)
+            try:
+                await driver.start(verbose=args.verbose)
+                for _ in range(args.warmup):
+                    await driver.run_job(fixtures.media_url(videos[0]["file"]) + f"?warmup={uuid.uuid4().hex}", options)
+                for video in videos:
+                    for concurrency in levels:
+                        jobs = args.jobs or max(concurrency * 2, 4)
+                        logger.info(f"[{mode}] {video['file']} 并发度={concurrency} 任务数={jobs}")
+                        result = await run_level(driver, fixtures.media_url(video["file"]), options, concurrency, jobs)
+                        report["runs"].append(dict(mode=mode, video=video, **result))
+                        latency = result["latency_seconds"] or {}
+                        logger.info(f"[{mode}] 完成 {result['completed']}/{jobs}, "
+                                    f"{result['jobs_per_minute']} 任务/分钟, p50={latency.get('p50')}秒, "
+                                    f"p95={latency.get('p95')}秒, 峰值内存={result['peak_rss_mb']}MB, "
+                                    f"峰值磁盘={result['peak_disk_mb']}MB")
+            finally:
+                await driver.stop()
+    finally:
+        fixtures.stop()
+
+    report["environment"]["asr_requests"] = fixtures.asr_requests
+    output = args.output or os.path.join(REPO_DIR, "bench", "results", f"{run_id}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    logger.info(f"测试结果已保存到: {output}")
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            for line in compare(report, json.load(f)):
+                print(line)
+
+if __name__ == "__main__":
+    asyncio.run(main(parse_args()))
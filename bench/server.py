@@ -0,0 +1,12 @@
+"""
+在子进程中启动被测HTTP服务
+
+用法: python -m bench.server <端口> [日志级别]
+"""
+import sys
+import uvicorn
+import main as service
+
+if __name__ == "__main__":
+    log_level = sys.argv[2] if len(sys.argv) > 2 else "warning"
+    uvicorn.run(service.app, host="127.0.0.1", port=int(sys.argv[1]), log_level=log_level, access_log=False)